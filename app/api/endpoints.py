@@ -1,25 +1,110 @@
-from fastapi import APIRouter, Depends
-from app.services.question_service import QuestionService
+import json
+from typing import Any, List, Dict, Iterator, Optional
+from fastapi import APIRouter, Body, Depends
+from fastapi.responses import JSONResponse, StreamingResponse
+from app.models.database import engine, get_connection, get_pool_status
+from app.services.question_service import AsyncQuestionService
 from app.services.sql_service import SQLService
+from app.services.statement_cache import statement_cache_stats
+from app.services.columnar import arrow_ipc_stream
+from app.services.tracing import describe_result, get_tracer
 
 router = APIRouter()
 
+# LLM相关的处理器使用异步客户端，等待模型响应时不阻塞事件循环；
+# 数据库相关的处理器是同步的，由FastAPI放到线程池中执行，连接通过依赖从连接池借出
+
+def _pooled_stream(sql: str, columnar: bool = False) -> Iterator[Dict]:
+    """在生成器内借出连接，保证连接在响应流结束后才归还"""
+    connection = engine.raw_connection()
+    try:
+        yield from SQLService(connection).execute_sql_stream(sql, columnar=columnar)
+    finally:
+        connection.close()
+
+def _checked_stream(stream: Iterator[Dict]):
+    """先执行查询取出第一项：查询出错时返回400和错误信息，而不是200加一个空的响应流
+
+    Returns:
+        JSONResponse，或从第一项开始的完整结果流
+    """
+    first = next(stream, None)
+    if first is None or first.get("status") == "error":
+        stream.close()
+        return JSONResponse(status_code=400, content=first or {"status": "error", "error": "查询没有返回结果"})
+
+    def items():
+        yield first
+        yield from stream
+
+    return items()
+
+def _arrow_batches(items: Iterator[Dict]) -> Iterator[Dict]:
+    """取出列式批次；结果已开始输出后出错时抛出异常中断响应流，客户端读到不完整的流而不是正常结束"""
+    for item in items:
+        if item.get("status") == "error":
+            raise RuntimeError(item["error"])
+        if "batch" in item:
+            yield item["batch"]
+
 @router.post("/analyze_tables")
 async def analyze_tables(question: str, api_key: str):
-    service = QuestionService(api_key)
-    return service.analyze_tables(question)
+    service = AsyncQuestionService(api_key)
+    return await service.analyze_tables(question)
 
 @router.post("/get_fields")
-async def get_fields(tables: List[str]):
-    service = SQLService(get_db())
-    return service.get_fields(tables)
+def get_fields(tables: List[str], connection=Depends(get_connection)):
+    service = SQLService(connection)
+    with get_tracer().span("db.get_fields", tables=len(tables)):
+        return service.get_fields(tables)
 
 @router.post("/generate_sql")
-async def generate_sql(question: str, tables: List[str], fields: Dict):
-    service = SQLService(get_db())
-    return service.generate_sql(question, tables, fields)
+async def generate_sql(question: str, tables: List[str], fields: Dict, api_key: str):
+    service = AsyncQuestionService(api_key)
+    return await service.generate_sql(question, tables, fields)
+
+@router.post("/generate_sql/stream")
+async def generate_sql_stream(question: str, tables: List[str], fields: Dict, api_key: str):
+    """以SSE逐段返回模型生成的SQL，最后一个事件是改写后的完整SQL"""
+    service = AsyncQuestionService(api_key)
+
+    async def events():
+        async for event in service.generate_sql_stream(question, tables, fields):
+            yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
 
 @router.post("/execute_sql")
-async def execute_sql(sql: str):
-    service = SQLService(get_db())
-    return service.execute_sql(sql) 
\ No newline at end of file
+def execute_sql(sql: str, params: Optional[Dict[str, Any]] = Body(None), connection=Depends(get_connection)):
+    """params 为SQL中 :name 占位符的参数，由驱动绑定"""
+    service = SQLService(connection)
+    with get_tracer().span("db.execute_sql") as span:
+        result = service.execute_sql(sql, params=params)
+        span.set(**describe_result(result))
+    return result
+
+@router.post("/execute_sql/stream")
+def execute_sql_stream(sql: str, format: str = "ndjson"):
+    """分批流式返回查询结果
+    format=ndjson 时每行一个JSON对象（中途出错时最后一行是错误对象）；format=arrow 时返回Arrow IPC流，
+    中途出错时中断连接。查询本身执行失败时返回400和错误信息
+    """
+    items = _checked_stream(_pooled_stream(sql, columnar=format == "arrow"))
+    if isinstance(items, JSONResponse):
+        return items
+    if format == "arrow":
+        return StreamingResponse(
+            arrow_ipc_stream(_arrow_batches(items)),
+            media_type="application/vnd.apache.arrow.stream"
+        )
+    lines = (
+        json.dumps(batch, ensure_ascii=False, default=str) + "\n"
+        for batch in items
+    )
+    return StreamingResponse(lines, media_type="application/x-ndjson")
+
+@router.get("/db/pool")
+def pool_status():
+    """连接池使用情况，附带预编译语句缓存的命中统计"""
+    return dict(get_pool_status(), statements=statement_cache_stats())
@@ -1,7 +1,11 @@
 # app/api/qa_system.py
-from typing import Dict, Any
-import pandas as pd
+from typing import Dict, Any, List, Optional
+import numpy as np
 from ..utils.data_access import DataAccessUtils
+from ..services.columnar import as_columns, to_records
+from ..services.sql_validator import escape_like, get_sql_validator
+from ..services.entity_index import get_entity_index
+from ..services.question_templates import get_template_registry
 from ..models.question_types import QuestionClassifier
 import logging
 
@@ -9,12 +13,21 @@ class QASystem:
     def __init__(self, access_token: str):
         self.data_utils = DataAccessUtils(access_token)
         self.question_classifier = QuestionClassifier()
+        self.sql_validator = get_sql_validator()
+        self.entity_index = get_entity_index()
+        self.template_registry = get_template_registry()
         self.logger = logging.getLogger(__name__)
 
-    async def process_question(self, question: str) -> Dict[str, Any]:
+    async def process_question(self, question: str, question_type: str = None) -> Dict[str, Any]:
         try:
-            # 1. 分类问题类型
-            question_type = self.question_classifier.classify(question)
+            # 0. 命中参数化模板时一次查询直接作答，不再分类和走各类型的处理逻辑
+            answer = await self._handle_template_query(question)
+            if answer is not None:
+                return answer
+
+            # 1. 分类问题类型（批量处理时已预先分类）
+            if question_type is None:
+                question_type = self.question_classifier.classify(question)
             
             # 2. 根据问题类型选择处理策略
             if question_type == "basic":
@@ -31,18 +44,59 @@ class QASystem:
                 "status": "error"
             }
 
+    async def process_questions(self, questions: List[str]) -> List[Dict[str, Any]]:
+        """批量处理：一次向量化调用完成整批问题的分类，结果附带分类置信度"""
+        classifications = self.question_classifier.classify_batch(questions)
+        results = []
+        for question, classification in zip(questions, classifications):
+            result = await self.process_question(question, classification["type"])
+            if isinstance(result, dict):
+                result["classification"] = classification
+            results.append(result)
+        return results
+
+    async def _handle_template_query(self, question: str) -> Optional[Dict[str, Any]]:
+        """模板快速路径，未命中或执行失败时返回None"""
+        match = self.template_registry.match(question)
+        if match is None:
+            return None
+        try:
+            result = await self.data_utils.execute_query(match["sql"], match["params"])
+        except Exception as e:
+            self.logger.warning(f"Template {match['template']} failed, falling back: {str(e)}")
+            self.template_registry.record_fallback(match["template"])
+            return None
+        return {
+            "answer": self.template_registry.render_answer(match, result),
+            "data": result,
+            "type": "template",
+            "template": match["template"]
+        }
+
     async def _handle_basic_query(self, question: str) -> Dict[str, Any]:
         """处理基础查询，如股票基本信息、当日行情等"""
         # 示例实现
         if "股票代码" in question:
-            # 提取股票名称
-            company_name = question.split("的")[0]
-            sql = f"""
-            SELECT SecuCode, ChiName 
-            FROM constantdb.secumain 
-            WHERE ChiName LIKE '%{company_name}%'
-            """
-            result = await self.data_utils.execute_query(sql)
+            mentions = self.entity_index.resolve(question)
+            # 取值一律作为绑定参数传入，语句文本固定，可复用已准备好的语句，也避免SQL注入
+            if mentions:
+                # 实体索引解析出InnerCode，按主键精确查询
+                sql = """
+                SELECT SecuCode, ChiName 
+                FROM constantdb.secumain 
+                WHERE InnerCode = :inner_code
+                """
+                params = {"inner_code": int(mentions[0]['InnerCode'])}
+            else:
+                # 索引未加载或没有命中时按名称模糊匹配
+                company_name = question.split("的")[0]
+                sql = """
+                SELECT SecuCode, ChiName 
+                FROM constantdb.secumain 
+                WHERE ChiName LIKE :pattern
+                """
+                params = {"pattern": f"%{escape_like(company_name)}%"}
+            result = await self.data_utils.execute_query(sql, params)
             return {
                 "answer": f"该公司的股票代码是: {result[0]['SecuCode']}",
                 "data": result,
@@ -63,10 +117,15 @@ class QASystem:
                     STRING_AGG(sm.SecuAbbr, ',') as stock_names
                 FROM astockmarketquotesdb.qt_dailyquote qt
                 JOIN constantdb.secumain sm ON qt.InnerCode = sm.InnerCode
-                WHERE qt.ChangePCT >= 9.9
-                AND qt.TradingDay BETWEEN '2021-01-01' AND '2021-12-31'
+                WHERE qt.ChangePCT >= :limit_up_pct
+                AND qt.TradingDay BETWEEN :start_date AND :end_date
                 """
-                result = await self.data_utils.execute_query(sql)
+                params = {"limit_up_pct": 9.9, "start_date": "2021-01-01", "end_date": "2021-12-31"}
+                # STRING_AGG 不是MySQL语法，执行前改写为目标方言（GROUP_CONCAT）
+                validation = self.sql_validator.validate(sql)
+                if validation["status"] != "success":
+                    raise ValueError(validation["error"])
+                result = await self.data_utils.execute_query(validation["sql"], params)
                 return {
                     "answer": f"涨停股票数量: {result[0]['limit_up_count']}, 包括: {result[0]['stock_names']}",
                     "data": result,
@@ -89,44 +148,27 @@ class QASystem:
                     bs.TotalLiability / bs.TotalAssets as debt_ratio
                 FROM astockfinancedb.lc_balancesheetall bs
                 JOIN constantdb.secumain sm ON bs.CompanyCode = sm.CompanyCode
-                WHERE bs.EndDate = '2021-12-31'
+                WHERE bs.EndDate = :end_date
                 ORDER BY debt_ratio DESC
                 LIMIT 10
                 """
-                result = await self.data_utils.execute_query(sql)
+                result = await self.data_utils.execute_query(sql, {"end_date": "2021-12-31"})
                 
-                # 处理数据
-                df = pd.DataFrame(result)
+                # 处理数据：按列取数组直接做向量化统计，不再构造DataFrame
+                columns = as_columns(result)
+                debt_ratio = columns['debt_ratio'].astype(np.float64)
                 analysis = {
-                    "avg_debt_ratio": df['debt_ratio'].mean(),
-                    "max_debt_ratio": df['debt_ratio'].max(),
-                    "min_debt_ratio": df['debt_ratio'].min()
+                    "avg_debt_ratio": float(np.nanmean(debt_ratio)),
+                    "max_debt_ratio": float(np.nanmax(debt_ratio)),
+                    "min_debt_ratio": float(np.nanmin(debt_ratio))
                 }
                 
                 return {
                     "answer": f"行业平均资产负债率为: {analysis['avg_debt_ratio']:.2%}",
-                    "data": result,
+                    "data": to_records(columns),
                     "analysis": analysis,
                     "type": "complex"
                 }
         except Exception as e:
             self.logger.error(f"Error in complex query: {str(e)}")
             raise
-
-# app/models/question_types.py
-class QuestionClassifier:
-    def __init__(self):
-        # 定义关键词字典
-        self.keywords = {
-            "basic": ["股票代码", "股票名称", "收盘价", "开盘价", "最高价", "最低价"],
-            "statistical": ["平均", "总计", "涨停", "跌停", "换手率", "成交量"],
-            "complex": ["财务分析", "行业对比", "趋势分析", "风险评估"]
-        }
-
-    def classify(self, question: str) -> str:
-        """根据问题内容分类"""
-        # 简单的关键词匹配
-        for q_type, keywords in self.keywords.items():
-            if any(keyword in question for keyword in keywords):
-                return q_type
-        return "basic"  # 默认为基础查询
\ No newline at end of file
@@ -1,9 +1,16 @@
 # app/frontend/components/sql_editor.py
+import csv
+import os
+import tempfile
 import streamlit as st
 from streamlit_ace import st_ace
 import pandas as pd
 import plotly.express as px
 from typing import Dict, Any
+from utils.api_client import stream_sql
+
+# 页面上最多预览的行数，完整结果写入临时文件供下载（每个会话复用同一个文件）
+PREVIEW_ROWS = 1000
 
 class SQLEditor:
     def __init__(self):
@@ -54,13 +61,7 @@ class SQLEditor:
             if st.button("执行查询", key="execute_sql"):
                 self._execute_query(query)
         with col2:
-            st.download_button(
-                "下载结果",
-                data=self._get_download_data(),
-                file_name="query_result.csv",
-                mime="text/csv",
-                disabled=not st.session_state.get("query_result")
-            )
+            self._render_download()
     
     def _insert_template(self, template_name: str):
         """插入SQL模板"""
@@ -82,24 +83,62 @@ class SQLEditor:
         st.session_state.sql_query = templates.get(template_name, "")
     
     def _execute_query(self, query: str):
-        """执行SQL查询"""
+        """流式执行SQL查询，只保留预览行，完整结果边接收边写入CSV"""
         try:
             with st.spinner("执行查询中..."):
-                # 这里应该调用实际的API
-                # result = api.execute_query(query)
-                # 示例数据
-                result = pd.DataFrame({
-                    "SecuCode": ["000001", "000002"],
-                    "ChiName": ["平安银行", "万科A"],
-                    "ClosePrice": [10.5, 15.2]
-                })
-                
+                progress_text = st.empty()
+                columns, preview, row_count = [], [], 0
+                path = self._result_file()
+                st.session_state.query_result_path = None
+                st.session_state.pop("query_result_csv", None)
+                with open(path, "w", newline="", encoding="utf-8") as result_file:
+                    writer = csv.writer(result_file)
+                    for batch in stream_sql(query):
+                        if "columns" in batch:
+                            columns = batch["columns"]
+                            writer.writerow(columns)
+                        elif "rows" in batch:
+                            writer.writerows(batch["rows"])
+                            if len(preview) < PREVIEW_ROWS:
+                                preview.extend(batch["rows"][:PREVIEW_ROWS - len(preview)])
+                            row_count += len(batch["rows"])
+                            progress_text.write(f"已接收 {row_count} 行")
+                        elif batch.get("status") == "error":
+                            raise Exception(batch["error"])
+
+                result = pd.DataFrame(preview, columns=columns)
                 st.session_state.query_result = result
-                
+                st.session_state.query_result_path = path
+                progress_text.write(f"共 {row_count} 行，预览前 {len(preview)} 行")
+
                 # 显示结果
                 self._display_result(result)
         except Exception as e:
             st.error(f"查询错误: {str(e)}")
+
+    def _result_file(self) -> str:
+        """本会话的结果文件，新的查询覆盖上一次的结果，不再每次导出都留下一个临时文件"""
+        path = st.session_state.get("query_result_file")
+        if not path or not os.path.exists(path):
+            fd, path = tempfile.mkstemp(suffix=".csv")
+            os.close(fd)
+            st.session_state.query_result_file = path
+        return path
+
+    def _render_download(self):
+        """点击“准备导出”后才读取完整结果文件，页面每次重跑不再重复读取"""
+        path = st.session_state.get("query_result_path")
+        if st.session_state.get("query_result_csv") is None:
+            if not st.button("准备导出", key="prepare_export", disabled=not path):
+                return
+            with open(path, "rb") as f:
+                st.session_state.query_result_csv = f.read()
+        st.download_button(
+            "下载结果",
+            data=st.session_state.query_result_csv,
+            file_name="query_result.csv",
+            mime="text/csv"
+        )
     
     def _display_result(self, df: pd.DataFrame):
         """显示查询结果"""
@@ -0,0 +1,61 @@
+# app/frontend/components/stream_view.py
+import os
+import time
+from typing import Iterable, Optional
+import streamlit as st
+
+# 流式渲染的最小刷新间隔（秒），避免每个token都向浏览器推送一次界面更新
+STREAM_RENDER_INTERVAL = float(os.getenv("STREAM_RENDER_INTERVAL", "0.05"))
+
+class StreamView:
+    """把逐段到达的文本增量渲染到 st.empty() 占位符中
+
+    Streamlit 1.28 还没有 st.write_stream，这里用占位符反复替换内容实现打字机效果，
+    并记录首token时间和总耗时。language 不为空时按代码块渲染（如 sql）。
+    """
+
+    def __init__(
+        self,
+        placeholder=None,
+        language: Optional[str] = None,
+        cursor: str = "▌",
+        interval: float = STREAM_RENDER_INTERVAL
+    ):
+        self.placeholder = placeholder if placeholder is not None else st.empty()
+        self.language = language
+        self.cursor = cursor
+        self.interval = interval
+        self.first_token_seconds: Optional[float] = None
+        self.total_seconds: Optional[float] = None
+        self._started = time.perf_counter()
+        self._rendered_at = 0.0
+
+    def _render(self, text: str):
+        if self.language:
+            self.placeholder.code(text, language=self.language)
+        else:
+            self.placeholder.markdown(text)
+
+    def update(self, text: str):
+        """显示目前为止的文本，距上次刷新不足 interval 时跳过"""
+        now = time.perf_counter()
+        if self.first_token_seconds is None:
+            self.first_token_seconds = now - self._started
+        elif now - self._rendered_at < self.interval:
+            return
+        self._rendered_at = now
+        self._render(text + self.cursor)
+
+    def finish(self, text: str):
+        """显示完整文本并去掉光标"""
+        self.total_seconds = time.perf_counter() - self._started
+        self._render(text)
+
+    def consume(self, deltas: Iterable[str]) -> str:
+        """逐段读取并渲染，返回完整文本"""
+        text = ""
+        for delta in deltas:
+            text += delta
+            self.update(text)
+        self.finish(text)
+        return text
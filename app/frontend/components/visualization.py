@@ -1,9 +1,14 @@
 # app/frontend/components/visualization.py
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
 import streamlit as st
 import plotly.express as px
 import plotly.graph_objects as go
 from typing import Dict, Any
 import pandas as pd
+from services.columnar import to_dataframe
 
 class DataVisualizer:
     @staticmethod
@@ -12,7 +17,7 @@ class DataVisualizer:
         if result.get("type") == "basic":
             st.write(result["answer"])
             if "data" in result:
-                st.dataframe(pd.DataFrame(result["data"]))
+                st.dataframe(to_dataframe(result["data"]))
                 
         elif result.get("type") == "statistical":
             DataVisualizer._render_statistical(result)
@@ -26,7 +31,7 @@ class DataVisualizer:
         st.write(result["answer"])
         
         if "data" in result:
-            df = pd.DataFrame(result["data"])
+            df = to_dataframe(result["data"])
             
             # 创建图表
             fig = go.Figure()
@@ -60,7 +65,8 @@ class DataVisualizer:
         st.write(result["answer"])
         
         if "data" in result and "analysis" in result:
-            df = pd.DataFrame(result["data"])
+            # 列式结果直接共享底层数组，不复制
+            df = to_dataframe(result["data"])
             
             # 创建多个图表
             col1, col2 = st.columns(2)
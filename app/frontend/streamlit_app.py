@@ -1,4 +1,9 @@
 # app/frontend/streamlit_app.py
+import os
+import sys
+# 与后端共用服务层（services.*），问答流水线在本进程中执行
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
 import streamlit as st
 from tabs.qa_tab import render_qa_tab
 from tabs.query_tab import render_query_tab
@@ -6,6 +11,26 @@ from tabs.analysis_tab import render_analysis_tab
 from tabs.basic_tab import render_basic_tab
 from tabs.intermediate_tab import render_intermediate_tab
 from tabs.advanced_tab import render_advanced_tab
+from services.entity_index import get_entity_index
+from services.tracing import METRICS_PORT, get_tracer, start_metrics_server
+from utils.rate_limiter import get_rate_limiter
+
+@st.cache_resource
+def start_metrics():
+    """流水线各阶段的span记录在本进程，指标也由本进程导出；后端的 /metrics 只包含后端自己的span"""
+    if not METRICS_PORT:
+        return None
+    return start_metrics_server(
+        METRICS_PORT,
+        lambda: get_tracer().render_prometheus() + get_rate_limiter().render_prometheus()
+    )
+
+@st.cache_resource
+def load_entity_index():
+    """启动时从后端导出的快照加载实体索引，快照缺失或为空时只在这里记一次警告"""
+    index = get_entity_index()
+    index.refresh()
+    return index
 
 def init_session_state():
     if 'messages' not in st.session_state:
@@ -20,6 +45,8 @@ def init_session_state():
 def main():
     st.set_page_config(page_title="Finance QA System", layout="wide")
     init_session_state()
+    start_metrics()
+    load_entity_index()
 
     with st.sidebar:
         st.title("设置")
@@ -4,8 +4,19 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(
 
 import streamlit as st
 from datetime import datetime
-import json
+import time
 from services.question_service import QuestionService
+from services.batch_executor import write_back
+from services.token_accounting import get_token_ledger
+from services.question_cache import get_question_cache
+from services.sql_optimizer import get_sql_optimizer
+from services.sql_repair import get_sql_repairer
+from services.question_templates import get_template_registry
+from services.run_store import RunStore, list_runs
+from services.job_runner import get_job_runner, FINISHED_STATUSES, PAUSE, PAUSED
+from components.stream_view import StreamView
+from utils.rate_limiter import deadline, get_rate_limiter
+from services.tracing import get_tracer
 
 def create_question_tree(questions):
     # 直接使用tid作为组ID，team作为问题列表
@@ -14,205 +25,349 @@ def create_question_tree(questions):
         groups[group["tid"]] = group["team"]
     return groups
 
-def execute_question(question: str, api_key: str) -> dict:
-    """执行单个问题的处理流程"""
-    service = QuestionService(api_key)
+def _start_step(name: str) -> dict:
+    """开始一个步骤，start_time 用于显示，耗时按单调时钟计算"""
+    return {
+        "name": name,
+        "status": "processing",
+        "start_time": datetime.now().strftime("%H:%M:%S"),
+        "_started": time.perf_counter()
+    }
+
+def _finish_step(step: dict, status: str = "completed") -> dict:
+    """记录步骤的结束时间和耗时（毫秒）"""
+    step["status"] = status
+    step["end_time"] = datetime.now().strftime("%H:%M:%S")
+    step["duration_ms"] = round((time.perf_counter() - step.pop("_started")) * 1000, 1)
+    return step
+
+def execute_question(
+    question: str,
+    api_key: str,
+    sql_placeholder=None,
+    base_url: str = None,
+    model: str = None
+) -> dict:
+    """执行单个问题的处理流程
+    Args:
+        sql_placeholder: st.empty() 占位符，传入时SQL按模型输出流式显示在其中
+        base_url/model: 不指定时取会话中的设置；在后台任务中执行时必须指定
+    """
+    # 整个问题共用一个截止时间，各次模型调用的排队和重试都不超过它
+    with deadline():
+        return _execute_question(question, api_key, sql_placeholder, base_url, model)
+
+def _execute_question(question: str, api_key: str, sql_placeholder, base_url: str, model: str) -> dict:
+    service = QuestionService(api_key, base_url, model)
     result = {
         "status": "processing",
         "steps": [],
         "error": None,
         "answer": None
     }
+    # 整个问题是一条链路，各阶段、模型调用的span都挂在它下面
+    tracer = get_tracer()
+    root = tracer.start("question", activate=True, question=question)
     
     try:
+        # 模板快速路径：命中参数化模板时一次数据库查询直接作答，跳过四步模型流程
+        step0 = _start_step("模板匹配")
+        fast = service.answer_from_template(question)
+        if fast is not None:
+            step0["result"] = {
+                "template": fast["template"],
+                "sql": fast["sql"],
+                "params": fast["params"],
+                "answer": fast["answer"]
+            }
+            result["steps"].append(_finish_step(step0))
+            result["status"] = "completed"
+            result["answer"] = fast["result"]
+            result["token_usage"] = service.token_ledger.question_summary(question)
+            return result
+
         # 步骤1：分析所需表
-        step1 = {
-            "name": "分析所需表",
-            "status": "processing",
-            "start_time": datetime.now().strftime("%H:%M:%S")
-        }
+        step1 = _start_step("分析所需表")
         tables = service.analyze_tables(question)
-        step1["status"] = "completed"
+        _finish_step(step1)
         step1["result"] = tables
         result["steps"].append(step1)
 
         # 步骤2：获取字段信息
-        step2 = {
-            "name": "获取字段信息",
-            "status": "processing",
-            "start_time": datetime.now().strftime("%H:%M:%S")
-        }
+        step2 = _start_step("获取字段信息")
         fields = service.get_fields(tables)
-        step2["status"] = "completed"
+        _finish_step(step2)
         step2["result"] = fields
         result["steps"].append(step2)
 
         # 步骤3：生成SQL
-        step3 = {
-            "name": "生成SQL",
-            "status": "processing",
-            "start_time": datetime.now().strftime("%H:%M:%S")
-        }
-        sql = service.generate_sql(question, tables, fields)
-        step3["status"] = "completed"
+        step3 = _start_step("生成SQL")
+        on_delta = None
+        if sql_placeholder is not None:
+            view = StreamView(sql_placeholder, language="sql")
+            on_delta = lambda text: view.update(f"-- {question}\n{text}")
+        sql = service.generate_sql(question, tables, fields, on_delta)
+        _finish_step(step3)
         step3["result"] = sql
         result["steps"].append(step3)
 
         # 步骤4：执行SQL
-        step4 = {
-            "name": "执行SQL",
-            "status": "processing",
-            "start_time": datetime.now().strftime("%H:%M:%S")
-        }
+        step4 = _start_step("执行SQL")
         answer = service.execute_sql(sql)
-        step4["status"] = "completed"
+        _finish_step(step4)
         step4["result"] = answer
         result["steps"].append(step4)
 
-        result["status"] = "completed"
+        # 步骤5：执行出错时自动修复SQL并重新执行
+        if isinstance(answer, dict) and answer.get("status") == "error":
+            step5 = _start_step("修复SQL")
+            repair = service.repair_and_execute(question, sql, answer, fields)
+            sql, answer = repair["sql"], repair["result"]
+            _finish_step(step5, "completed" if answer.get("status") != "error" else "error")
+            step5["result"] = repair["attempts"]
+            result["steps"].append(step5)
         result["answer"] = answer
+        if isinstance(answer, dict) and answer.get("status") == "error":
+            # 修复后仍然失败：记为错误，续跑时这道题会重新执行
+            result["status"] = "error"
+            result["error"] = answer.get("error")
+            root.set(status="error", error=str(answer.get("error")))
+        else:
+            service.remember_sql(question, tables, fields, sql)
+            result["status"] = "completed"
 
     except Exception as e:
         result["status"] = "error"
         result["error"] = str(e)
-        
+        root.set(status="error", error=str(e))
+    finally:
+        tracer.finish(root)
+        result["trace"] = tracer.trace(root.trace_id)
+
+    result["token_usage"] = service.token_ledger.question_summary(question)
     return result
 
+def _log_entry(group: dict, question: dict, result: dict) -> dict:
+    return {
+        "group": group["tid"],
+        "question": question["question"],
+        "timestamp": datetime.now().strftime("%H:%M:%S"),
+        "steps": result["steps"],
+        "status": result["status"],
+        "token_usage": result.get("token_usage"),
+        "trace": result.get("trace")
+    }
+
+def _open_run(run: RunStore) -> RunStore:
+    """切换当前运行，执行日志从磁盘记录恢复"""
+    state = st.session_state.execution_state
+    state["run"] = run
+    state["execution_log"] = run.log_entries()
+    state["progress"] = run.finished / run.total if run.total else 0
+    return run
+
+def _select_run(uploaded_file):
+    """当前运行：上传的文件只在首次出现时解析登记，之后的重跑直接复用；未上传时可以继续之前的运行"""
+    state = st.session_state.execution_state
+    if uploaded_file is not None:
+        if state["upload_id"] != uploaded_file.file_id:
+            state["upload_id"] = uploaded_file.file_id
+            _open_run(RunStore.from_upload(uploaded_file.getvalue(), uploaded_file.name))
+        return state["run"]
+
+    runs = list_runs()
+    if not runs:
+        return None
+    labels = {
+        run["run_id"]: f"{run['name'] or run['run_id']}（已完成 {run['finished']}/{run['total']}）"
+        for run in runs
+    }
+    current = state["run"].run_id if state["run"] is not None else None
+    options = [None] + list(labels)
+    run_id = st.selectbox(
+        "或继续之前的运行",
+        options,
+        index=options.index(current) if current in labels else 0,
+        format_func=lambda run_id: "（不选择）" if run_id is None else labels[run_id]
+    )
+    if run_id is None:
+        state["run"] = None
+    elif current != run_id:
+        _open_run(RunStore(run_id))
+    return state["run"]
+
+# 后台任务执行中时界面刷新进度的间隔（秒）
+PROGRESS_REFRESH_SECONDS = float(os.getenv("PROGRESS_REFRESH_SECONDS", "1"))
+
+_JOB_STATUS_LABELS = {
+    "queued": "排队中",
+    "running": "执行中",
+    "paused": "已暂停",
+    "cancelled": "已取消",
+    "completed": "执行完成",
+    "failed": "执行出错"
+}
+
+def _current_job(run):
+    """当前运行的后台任务进度快照；刷新页面后按运行找回还未结束的任务"""
+    state = st.session_state.execution_state
+    if run is None:
+        return None
+    runner = get_job_runner()
+    job = runner.status(state["job_id"]) if state["job_id"] else None
+    if job is None or job["run_id"] != run.run_id:
+        state["job_id"] = runner.find_active(run.run_id)
+        if state["job_id"] is None:
+            return None
+        job = runner.status(state["job_id"])
+        # 读取任务正在写入的同一个运行记录对象，才能看到最新完成的题目
+        active_run = runner.run_store(state["job_id"])
+        if active_run is not None and active_run is not run:
+            _open_run(active_run)
+    return job
+
 def render_basic_tab():
     st.header("初级题目")
     
     if "execution_state" not in st.session_state:
         st.session_state.execution_state = {
-            "is_running": False,
             "current_group": "",
             "current_question": "",
             "progress": 0,
-            "results": None,
+            "run": None,
+            "upload_id": None,
+            "job_id": None,
             "execution_log": []
         }
+    state = st.session_state.execution_state
     
     # 添加文件上传功能
     uploaded_file = st.file_uploader("上传题目JSON文件", type=['json'])
+    # 每完成一题即写入磁盘记录，浏览器刷新后可选择之前的运行继续执行
+    run = _select_run(uploaded_file)
+
+    # 批量执行提交到后台任务池，脚本线程只轮询进度快照
+    runner = get_job_runner()
+    job = _current_job(run)
+    run = state["run"] if run is not None else None
+    is_active = job is not None and job["status"] not in FINISHED_STATUSES
+    is_paused = is_active and (job["status"] == PAUSED or job["control"] == PAUSE)
+    if is_active:
+        state["current_group"] = job["current_group"]
+        state["current_question"] = job["current_question"]
+        state["progress"] = job["finished"] / job["total"] if job["total"] else 0
+    if job is not None:
+        state["execution_log"] = run.log_entries()
+        if not is_active:
+            state["progress"] = run.finished / run.total if run.total else 0
+
+    # 并发设置
+    setting_col1, setting_col2, setting_col3 = st.columns([1, 1, 1])
+    with setting_col1:
+        max_workers = st.number_input("并发数", min_value=1, max_value=32, value=4, step=1)
+    with setting_col2:
+        keep_group_order = st.checkbox("组内按顺序执行", value=True)
+    with setting_col3:
+        restart = st.checkbox("忽略已完成的题目，全部重新执行", value=False)
     
+    # 生成SQL时流式显示模型输出
+    live_sql = st.empty()
+
     # 控制按钮行
-    col1, col2, col3, col4 = st.columns([1, 1, 1, 1])
+    col1, col2, col3, col4, col5 = st.columns([1, 1, 1, 1, 1])
     with col1:
-        if st.button("开始执行", disabled=st.session_state.execution_state["is_running"]):
-            st.session_state.execution_state["is_running"] = True
-            st.session_state.execution_state["execution_log"] = []  # 清空执行日志
+        if st.button("开始执行", disabled=is_active or run is None):
+            if restart:
+                run.reset()
+                _open_run(run)
+            # 下面的统计是整个进程共享的（其他会话、其他任务也在累计），开始新任务时不清零
+            # 工作线程没有脚本上下文，会话中的设置在提交时取出
+            api_key = st.session_state.api_key
+            base_url = st.session_state.base_url
+            model = st.session_state.model
+            state["job_id"] = runner.submit(
+                run,
+                lambda question: execute_question(question, api_key, base_url=base_url, model=model),
+                _log_entry,
+                max_workers=max_workers,
+                keep_group_order=keep_group_order
+            )
+            st.rerun()
     with col2:
-        if st.button("暂停执行", disabled=not st.session_state.execution_state["is_running"]):
-            st.session_state.execution_state["is_running"] = False
+        if is_paused:
+            if st.button("继续执行"):
+                runner.resume(state["job_id"])
+                st.rerun()
+        elif st.button("暂停执行", disabled=not is_active):
+            runner.pause(state["job_id"])
+            st.rerun()
     with col3:
-        test_button_disabled = st.session_state.execution_state["is_running"] or uploaded_file is None
+        test_button_disabled = is_active or run is None
         if st.button("测试(仅第一题)", disabled=test_button_disabled):
-            if uploaded_file is not None:
-                questions = json.loads(uploaded_file.read())
-                st.session_state.execution_state["results"] = questions
+            if run is not None:
                 # 只处理第一个组的第一个问题
-                first_group = questions[0]
-                first_question = first_group["team"][0]
+                first_group = run.questions[0]
+                first_question = dict(first_group["team"][0])
                 
-                st.session_state.execution_state["current_group"] = first_group["tid"]
-                st.session_state.execution_state["current_question"] = first_question["question"]
+                state["current_group"] = first_group["tid"]
+                state["current_question"] = first_question["question"]
                 
                 # 执行问题处理流程
-                result = execute_question(first_question["question"], st.session_state.api_key)
+                result = execute_question(first_question["question"], st.session_state.api_key, live_sql)
+                live_sql.empty()
                 
                 # 更新问题状态和答案
-                first_question["status"] = result["status"]
-                if result["status"] == "completed":
-                    first_question["answer"] = result["answer"]
-                else:
-                    first_question["answer"] = f"执行错误: {result['error']}"
+                write_back(first_question, result)
                 
                 # 记录执行日志
-                log_entry = {
-                    "group": first_group["tid"],
-                    "question": first_question["question"],
-                    "timestamp": datetime.now().strftime("%H:%M:%S"),
-                    "steps": result["steps"],
-                    "status": result["status"]
-                }
-                st.session_state.execution_state["execution_log"].append(log_entry)
-                st.session_state.execution_state["progress"] = 1
+                log_entry = _log_entry(first_group, first_question, result)
+                run.record(first_group, first_question, result, log_entry)
+                state["execution_log"].append(log_entry)
+                state["progress"] = run.finished / run.total
                 # progress_bar.progress(1)
                 # status_text.write("测试执行完成!")
     with col4:
-        if st.session_state.execution_state["results"] is not None:
-            result_json = json.dumps(st.session_state.execution_state["results"], 
-                                   ensure_ascii=False, 
-                                   indent=2)
+        if st.button("取消执行", disabled=not is_active):
+            runner.cancel(state["job_id"])
+            st.rerun()
+    with col5:
+        if run is not None and not is_active:
+            # 导出文件只在有新完成的题目时重新生成，平时的重跑直接读取已有文件
             st.download_button(
                 label="下载结果",
-                data=result_json,
+                data=run.export().read_bytes(),
                 file_name="results.json",
                 mime="application/json"
             )
+        if run is not None and run.journal_path().exists():
+            # 执行日志可用于挖掘新的问题模板（python -m app.services.question_templates mine --logs ...）
+            st.download_button(
+                label="下载执行日志",
+                data=run.journal_path().read_bytes(),
+                file_name="execution_log.jsonl",
+                mime="application/x-ndjson"
+            )
     
     # 进度显示
-    progress_bar = st.progress(st.session_state.execution_state["progress"])
-    status_text = st.empty()
+    st.progress(state["progress"])
+    if job is not None:
+        status = "暂停中" if is_paused and job["status"] != PAUSED else _JOB_STATUS_LABELS[job["status"]]
+        message = f"任务 {job['job_id']}：{status}（已完成 {job['finished']}/{job['total']}"
+        if job["errors"]:
+            message += f"，本次出错 {job['errors']} 题"
+        message += "）"
+        if job["error"]:
+            message += f"\n\n{job['error']}"
+        st.write(message)
     
     # 分成左右两列
     left_col, right_col = st.columns([1, 1])
     
-    if uploaded_file is not None:
+    if run is not None:
         try:
-            questions = json.loads(uploaded_file.read())
-            question_groups = create_question_tree(questions)
-            
-            # 如果正在执行
-            if st.session_state.execution_state["is_running"]:
-                st.session_state.execution_state["results"] = questions
-                
-                total_questions = sum(len(group["team"]) for group in questions)
-                completed_questions = 0
-                
-                for group in questions:
-                    if not st.session_state.execution_state["is_running"]:
-                        break
-                        
-                    st.session_state.execution_state["current_group"] = group["tid"]
-                    
-                    for q in group["team"]:
-                        if not st.session_state.execution_state["is_running"]:
-                            break
-                            
-                        st.session_state.execution_state["current_question"] = q["question"]
-                        current_status = f"正在处理: 组 {group['tid']} - {q['question'][:30]}..."
-                        status_text.write(current_status)
-                        
-                        # 执行问题处理流程
-                        result = execute_question(q["question"], st.session_state.api_key)
-                        
-                        # 更新问题状态和答案
-                        q["status"] = result["status"]
-                        if result["status"] == "completed":
-                            q["answer"] = result["answer"]
-                        else:
-                            q["answer"] = f"执行错误: {result['error']}"
-                        
-                        # 记录执行日志
-                        log_entry = {
-                            "group": group["tid"],
-                            "question": q["question"],
-                            "timestamp": datetime.now().strftime("%H:%M:%S"),
-                            "steps": result["steps"],
-                            "status": result["status"]
-                        }
-                        st.session_state.execution_state["execution_log"].append(log_entry)
-                        
-                        completed_questions += 1
-                        progress = completed_questions / total_questions
-                        progress_bar.progress(progress)
-                        st.session_state.execution_state["progress"] = progress
-                
-                st.session_state.execution_state["is_running"] = False
-                status_text.write("执行完成!")
-            
             # 显示问题和结果
             with left_col:
+                question_groups = create_question_tree(run.iter_results())
                 for group_id, group_questions in question_groups.items():
                     with st.expander(f"问题组 {group_id}", expanded=True):
                         for q in group_questions:
@@ -224,14 +379,70 @@ def render_basic_tab():
             # 显示执行过程
             with right_col:
                 st.subheader("执行过程")
-                st.write(f"当前状态: {'执行中' if st.session_state.execution_state['is_running'] else '已暂停'}")
-                st.write(f"当前组: {st.session_state.execution_state['current_group']}")
-                st.write(f"当前问题: {st.session_state.execution_state['current_question']}")
+                st.write(f"当前状态: {'暂停中' if is_paused else '执行中' if is_active else '未执行'}")
+                st.write(f"当前组: {state['current_group']}")
+                st.write(f"当前问题: {state['current_question']}")
+                job_stats = runner.stats()
+                if job_stats["active"]:
+                    st.write(
+                        f"后台任务: {job_stats['active']} 个执行中，"
+                        f"全局并发额度 {job_stats['in_use']}/{job_stats['max_concurrency']}"
+                    )
+                st.caption("以下统计为本进程所有会话和任务的累计值")
+                token_summary = get_token_ledger().summary()
+                if token_summary["questions"]:
+                    st.write(
+                        f"提示词token: {token_summary['prompt_tokens']} / "
+                        f"全量 {token_summary['baseline_tokens']}，"
+                        f"节省 {token_summary['saved_ratio']:.1%}"
+                    )
+                cache_stats = get_question_cache().stats()
+                if cache_stats["hits"] + cache_stats["near_hits"] + cache_stats["misses"]:
+                    st.write(
+                        f"缓存命中率: {cache_stats['hit_rate']:.1%}，"
+                        f"节省 {cache_stats['saved_seconds']:.1f} 秒"
+                    )
+                optimizer_stats = get_sql_optimizer().stats()
+                if optimizer_stats["queries"]:
+                    st.write(
+                        f"SQL改写: {optimizer_stats['rewritten']}/{optimizer_stats['queries']} 条，"
+                        f"估算扫描量减少 {optimizer_stats['reduction']:.1%}，"
+                        f"结果超出 {get_sql_optimizer().max_rows} 行被截断 {optimizer_stats['truncated']} 条"
+                    )
+                template_stats = get_template_registry().stats()
+                if template_stats["matched"]:
+                    st.write(
+                        f"模板直答: {template_stats['answered']}/{template_stats['questions']} 题，"
+                        f"命中率 {template_stats['hit_rate']:.1%}"
+                    )
+                repair_stats = get_sql_repairer().stats()
+                if repair_stats["questions"]:
+                    st.write(
+                        f"自动修复: {repair_stats['repaired']}/{repair_stats['questions']} 题，"
+                        f"成功率 {repair_stats['success_rate']:.1%}"
+                    )
+                    st.write("各次尝试：", {
+                        f"第{attempt}次": f"成功率 {s['success_rate']:.0%}，平均 {s['avg_seconds']:.2f} 秒"
+                        for attempt, s in repair_stats["attempts"].items()
+                    })
+                limiter_stats = get_rate_limiter().stats()
+                if limiter_stats["requests"]:
+                    st.write(
+                        f"模型调用: {limiter_stats['requests']} 次，重试 {limiter_stats['retries']} 次"
+                        f"（429 {limiter_stats['rate_limited']} 次，超时 {limiter_stats['timeouts']} 次），"
+                        f"当前并发上限 {limiter_stats['concurrency_limit']:.1f}"
+                    )
+                stage_stats = get_tracer().summary()
+                if stage_stats:
+                    st.write("各阶段耗时：", {
+                        stage: f"{s['count']} 次，p50 {s['p50'] * 1000:.0f} ms，p95 {s['p95'] * 1000:.0f} ms"
+                        for stage, s in stage_stats.items()
+                    })
                 
                 # 显示执行日志
-                for log in st.session_state.execution_state["execution_log"]:
+                for log in state["execution_log"]:
                     with st.expander(f"[{log['timestamp']}] 组 {log['group']} - {log['question'][:30]}...", expanded=True):
-                        if "error" in log:
+                        if log.get("error"):
                             st.error(log["error"])
                         else:
                             st.write("使用的表：", log["tables"])
@@ -239,4 +450,9 @@ def render_basic_tab():
                             st.write("执行结果：", log["result"])
                 
         except Exception as e:
-            st.error(f"Error: {str(e)}") 
\ No newline at end of file
+            st.error(f"Error: {str(e)}") 
+
+    if is_active:
+        # 后台任务执行中：定时重跑脚本刷新进度，每次只读取任务快照和运行记录
+        time.sleep(PROGRESS_REFRESH_SECONDS)
+        st.rerun()
@@ -1,5 +1,9 @@
 import streamlit as st
-from utils.api_client import call_api
+from utils.api_client import stream_api
+from components.stream_view import StreamView
+
+# 随问题一起发给模型的最近对话消息数
+QA_HISTORY_MESSAGES = 6
 
 def render_qa_tab():
     # 显示历史消息
@@ -9,24 +13,24 @@ def render_qa_tab():
 
     # 输入框
     if prompt := st.chat_input("输入你的问题..."):
+        history = st.session_state.messages[-QA_HISTORY_MESSAGES:]
         st.session_state.messages.append({"role": "user", "content": prompt})
         with st.chat_message("user"):
             st.write(prompt)
 
         if st.session_state.api_key:
-            with st.spinner("思考中..."):
+            # 流式输出：收到首个token就开始显示，不再等完整回答
+            with st.chat_message("assistant"):
+                view = StreamView()
                 try:
-                    response = call_api(
+                    answer = view.consume(stream_api(
                         "qa",
-                        {"question": prompt},
+                        {"question": prompt, "history": history},
                         st.session_state.api_key
-                    )
-                    answer = response["answer"]
-                    
+                    ))
+                    st.caption(f"首字 {view.first_token_seconds or 0:.2f} 秒，完成 {view.total_seconds:.2f} 秒")
                     st.session_state.messages.append({"role": "assistant", "content": answer})
-                    with st.chat_message("assistant"):
-                        st.write(answer)
                 except Exception as e:
                     st.error(f"Error: {str(e)}")
         else:
-            st.warning("请先设置API Key") 
\ No newline at end of file
+            st.warning("请先设置API Key")
@@ -1,81 +1,411 @@
 import json
-from typing import Dict, Any
-from openai import OpenAI
+import os
+from typing import Dict, Any, AsyncIterator, Iterator, List, Optional
+import httpx
 import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from utils.llm_client import get_client, get_async_client, DEFAULT_BASE_URL, DEFAULT_MODEL
+from utils.rate_limiter import estimate_request_tokens, get_rate_limiter
+# 追踪器与服务层共用：前端进程以 services.* 导入服务层，后端进程以 app.services.* 导入
+try:
+    from services.tracing import Span, get_tracer
+except ImportError:
+    from app.services.tracing import Span, get_tracer
 
-def call_api(endpoint: str, params: Dict, api_key: str) -> Any:
-    """统一的API调用入口"""
-    # 添加调试信息展示区
-    debug_container = st.expander("Debug Info", expanded=False)
-    
-    # Initialize OpenAI client
-    client = OpenAI(api_key=api_key, base_url=st.session_state.base_url)
-    model = st.session_state.model
+# 后端FastAPI服务地址
+BACKEND_URL = os.getenv("BACKEND_URL", "http://localhost:8000")
 
-    if endpoint == "analyze_tables":
-        with debug_container:
-            st.write(f"Analyzing tables with params: {params}")
-            st.write(f"Using model: {model}")
-            messages = [
-                {"role": "system", "content": "你是一个金融数据分析助手，帮助分析SQL查询需要用到的表。"},
-                {"role": "user", "content": params["prompt"]}
-            ]
-            st.write(f"Constructed messages: {messages}")
-            
-            st.write(f"Calling OpenAI API with model: {model}")
-            response = client.chat.completions.create(
-                model=model,
-                messages=messages,
-                temperature=0.7
-            )
-            st.write(f"Got API response: {response}")
-            
-            try:
-                content = response.choices[0].message.content
-                st.write(f"Extracted content: {content}")
-                tables = json.loads(content)
-                st.write(f"Parsed tables: {tables}")
-                return {"tables": tables}
-            except Exception as e:
-                st.write(f"Error parsing response: {str(e)}")
-                raise Exception(f"解析API响应失败: {str(e)}")
-            
-    elif endpoint == "get_fields":
-        # 调用后端API获取字段信息
-        response = client.post(
-            "fields",
-            json=params
-        )
-        return response.json()
-        
-    elif endpoint == "generate_sql":
-        messages = [
-            {"role": "system", "content": "你是一个SQL专家，帮助生成准确的SQL查询语句。"},
-            {"role": "user", "content": f"""
+def _table_analysis_messages(params: Dict) -> List[Dict]:
+    """构建表分析的对话消息"""
+    return [
+        {"role": "system", "content": "你是一个金融数据分析助手，帮助分析SQL查询需要用到的表。"},
+        {"role": "user", "content": params["prompt"]}
+    ]
+
+def _generate_sql_messages(params: Dict) -> List[Dict]:
+    """构建SQL生成的对话消息"""
+    entities = ""
+    if params.get("entities"):
+        entities = f"""
+问题中的公司/证券（已解析，请用这些键精确过滤，不要按名称LIKE模糊匹配）:
+{params['entities']}"""
+    return [
+        {"role": "system", "content": "你是一个SQL专家，帮助生成准确的SQL查询语句。"},
+        {"role": "user", "content": f"""
 根据以下信息生成SQL查询语句:
 问题: {params['question']}
 可用的表: {params['tables']}
-字段信息: {params['fields']}
+字段信息: {params['fields']}{entities}
 
 只返回SQL语句，不需要其他解释。
             """}
-        ]
-        
-        response = client.chat.completions.create(
+    ]
+
+def _repair_sql_messages(params: Dict) -> List[Dict]:
+    """构建SQL修复的对话消息"""
+    return [
+        {"role": "system", "content": "你是一个SQL专家，帮助修正执行出错的SQL查询语句。"},
+        {"role": "user", "content": f"""
+以下SQL执行出错，请修正:
+问题: {params['question']}
+字段信息: {params['fields']}
+SQL: {params['sql']}
+错误: {params['error']}
+
+只返回修正后的SQL语句，不需要其他解释。
+            """}
+    ]
+
+def _qa_messages(params: Dict) -> List[Dict]:
+    """构建问答的对话消息，带上最近的对话历史"""
+    history = [
+        {"role": message["role"], "content": message["content"]}
+        for message in params.get("history", [])
+    ]
+    return [
+        {"role": "system", "content": "你是一个金融数据分析助手，用简洁准确的中文回答用户关于股票、财务和行情的问题。"},
+        *history,
+        {"role": "user", "content": params["question"]}
+    ]
+
+# 支持流式输出的对话类endpoint：(消息构建函数, temperature)
+_CHAT_ENDPOINTS = {
+    "qa": (_qa_messages, 0.7),
+    "generate_sql": (_generate_sql_messages, 0.3),
+    "repair_sql": (_repair_sql_messages, 0.1)
+}
+
+def _parse_tables(response) -> Dict:
+    """解析表分析的模型输出，附带token用量"""
+    try:
+        result = {"tables": json.loads(response.choices[0].message.content)}
+    except Exception as e:
+        raise Exception(f"解析API响应失败: {str(e)}")
+    if response.usage:
+        result["usage"] = {
+            "prompt_tokens": response.usage.prompt_tokens,
+            "completion_tokens": response.usage.completion_tokens
+        }
+    return result
+
+def _record_usage(response):
+    """把响应中的token用量记到当前span上"""
+    span = get_tracer().current()
+    if span is not None and getattr(response, "usage", None):
+        span.set(
+            prompt_tokens=response.usage.prompt_tokens,
+            completion_tokens=response.usage.completion_tokens
+        )
+
+def _create_completion(client, span: Optional[Span] = None, **kwargs):
+    """经过共享限流器的对话补全调用：限速、自适应并发，429和超时按截止时间抖动重试"""
+    return get_rate_limiter().call(
+        lambda timeout: client.chat.completions.create(timeout=timeout, **kwargs),
+        estimate_request_tokens(kwargs["messages"]),
+        span
+    )
+
+async def _create_completion_async(client, span: Optional[Span] = None, **kwargs):
+    """_create_completion 的异步版本"""
+    return await get_rate_limiter().call_async(
+        lambda timeout: client.chat.completions.create(timeout=timeout, **kwargs),
+        estimate_request_tokens(kwargs["messages"]),
+        span
+    )
+
+class DebugPanel:
+    """调试信息展示区；没有streamlit脚本上下文（如后台任务的工作线程）时不输出"""
+
+    def __init__(self, title: str):
+        self._container = None
+        if get_script_run_ctx(suppress_warning=True) is not None:
+            self._container = st.expander(title, expanded=False)
+
+    def write(self, *args):
+        if self._container is not None:
+            self._container.write(*args)
+
+def call_api(
+    endpoint: str,
+    params: Dict,
+    api_key: str,
+    base_url: Optional[str] = None,
+    model: Optional[str] = None
+) -> Any:
+    """统一的API调用入口，每次调用记录为 call_api.<endpoint> span
+    Args:
+        base_url/model: 不指定时取streamlit会话中的设置；在后台线程中调用时必须指定
+    """
+    with get_tracer().span(f"call_api.{endpoint}"):
+        return _call_api(endpoint, params, api_key, base_url, model)
+
+def _call_api(
+    endpoint: str,
+    params: Dict,
+    api_key: str,
+    base_url: Optional[str] = None,
+    model: Optional[str] = None
+) -> Any:
+    # 复用进程内共享的客户端，避免每次调用都重新建立连接和TLS握手
+    client = get_client(api_key, base_url or st.session_state.base_url)
+    model = model or st.session_state.model
+
+    if endpoint == "analyze_tables":
+        # 添加调试信息展示区
+        debug = DebugPanel("Debug Info")
+        debug.write(f"Analyzing tables with params: {params}")
+        debug.write(f"Using model: {model}")
+        messages = _table_analysis_messages(params)
+        debug.write(f"Constructed messages: {messages}")
+
+        debug.write(f"Calling OpenAI API with model: {model}")
+        response = _create_completion(
+            client,
+            model=model,
+            messages=messages,
+            temperature=0.7
+        )
+        _record_usage(response)
+        debug.write(f"Got API response: {response}")
+
+        content = response.choices[0].message.content
+        debug.write(f"Extracted content: {content}")
+        try:
+            result = _parse_tables(response)
+        except Exception as e:
+            debug.write(f"Error parsing response: {str(e)}")
+            raise
+        debug.write(f"Parsed tables: {result['tables']}")
+        return result
+
+    elif endpoint == "get_fields":
+        # 调用后端API获取字段信息
+        response = client.post("fields", cast_to=httpx.Response, body=params)
+        return response.json()
+
+    elif endpoint == "generate_sql":
+        messages = _generate_sql_messages(params)
+
+        response = _create_completion(
+            client,
             model=model,
             messages=messages,
             temperature=0.3
         )
-        
+        _record_usage(response)
+
+        return response.choices[0].message.content
+
+    elif endpoint == "repair_sql":
+        response = _create_completion(
+            client,
+            model=model,
+            messages=_repair_sql_messages(params),
+            temperature=0.1
+        )
+        _record_usage(response)
         return response.choices[0].message.content
-        
+
+    elif endpoint == "qa":
+        response = _create_completion(
+            client,
+            model=model,
+            messages=_qa_messages(params),
+            temperature=0.7
+        )
+        _record_usage(response)
+        return {"answer": response.choices[0].message.content}
+
     elif endpoint == "execute_sql":
         # 调用后端API执行SQL
-        response = client.post(
-            "query",
-            json=params
+        response = client.post("query", cast_to=httpx.Response, body=params)
+        return response.json()
+
+    else:
+        raise Exception(f"未知的endpoint: {endpoint}")
+
+async def call_api_async(
+    endpoint: str,
+    params: Dict,
+    api_key: str,
+    base_url: Optional[str] = None,
+    model: Optional[str] = None
+) -> Any:
+    """call_api 的异步版本，不依赖streamlit会话，供FastAPI等事件循环内使用"""
+    with get_tracer().span(f"call_api.{endpoint}"):
+        return await _call_api_async(endpoint, params, api_key, base_url, model)
+
+async def _call_api_async(
+    endpoint: str,
+    params: Dict,
+    api_key: str,
+    base_url: Optional[str] = None,
+    model: Optional[str] = None
+) -> Any:
+    client = get_async_client(api_key, base_url or DEFAULT_BASE_URL)
+    model = model or DEFAULT_MODEL
+
+    if endpoint == "analyze_tables":
+        response = await _create_completion_async(
+            client,
+            model=model,
+            messages=_table_analysis_messages(params),
+            temperature=0.7
         )
+        _record_usage(response)
+        return _parse_tables(response)
+
+    elif endpoint == "get_fields":
+        response = await client.post("fields", cast_to=httpx.Response, body=params)
         return response.json()
-        
+
+    elif endpoint == "generate_sql":
+        response = await _create_completion_async(
+            client,
+            model=model,
+            messages=_generate_sql_messages(params),
+            temperature=0.3
+        )
+        _record_usage(response)
+        return response.choices[0].message.content
+
+    elif endpoint == "repair_sql":
+        response = await _create_completion_async(
+            client,
+            model=model,
+            messages=_repair_sql_messages(params),
+            temperature=0.1
+        )
+        _record_usage(response)
+        return response.choices[0].message.content
+
+    elif endpoint == "qa":
+        response = await _create_completion_async(
+            client,
+            model=model,
+            messages=_qa_messages(params),
+            temperature=0.7
+        )
+        _record_usage(response)
+        return {"answer": response.choices[0].message.content}
+
+    elif endpoint == "execute_sql":
+        response = await client.post("query", cast_to=httpx.Response, body=params)
+        return response.json()
+
     else:
-        raise Exception(f"未知的endpoint: {endpoint}")
\ No newline at end of file
+        raise Exception(f"未知的endpoint: {endpoint}")
+
+def _delta(chunk) -> str:
+    """流式响应块中新增的文本"""
+    if not chunk.choices:
+        return ""
+    return chunk.choices[0].delta.content or ""
+
+def stream_api(
+    endpoint: str,
+    params: Dict,
+    api_key: str,
+    base_url: Optional[str] = None,
+    model: Optional[str] = None
+) -> Iterator[str]:
+    """对话类endpoint（qa/generate_sql/repair_sql）的流式调用，模型每生成一段就产出一段文本
+
+    首个token到达即可开始渲染，感知延迟是首token时间而不是完整生成时间。
+    base_url/model 不指定时取streamlit会话中的设置。
+    """
+    if endpoint not in _CHAT_ENDPOINTS:
+        raise Exception(f"endpoint不支持流式输出: {endpoint}")
+    build_messages, temperature = _CHAT_ENDPOINTS[endpoint]
+    client = get_client(api_key, base_url or st.session_state.base_url)
+    # 生成器在调用方的上下文中逐段运行，span不作为父span激活，避免把调用方后续的span挂到它下面
+    tracer = get_tracer()
+    span = tracer.start(f"stream_api.{endpoint}")
+    stream = None
+    chunks = 0
+    try:
+        # 限流和重试只覆盖建立流式响应，开始输出后不再重试
+        stream = _create_completion(
+            client,
+            span,
+            model=model or st.session_state.model,
+            messages=build_messages(params),
+            temperature=temperature,
+            stream=True
+        )
+        for chunk in stream:
+            text = _delta(chunk)
+            if text:
+                if not chunks:
+                    span.set(first_token_seconds=span.duration)
+                chunks += 1
+                yield text
+    except Exception as e:
+        span.set(status="error", error=str(e))
+        raise
+    finally:
+        # 调用方提前停止读取时关闭响应，连接回到连接池
+        if stream is not None:
+            stream.response.close()
+        # 流式响应不带usage，按内容块数估计输出token数（服务端通常每块一个token）
+        span.set(completion_tokens=chunks)
+        tracer.finish(span)
+
+async def stream_api_async(
+    endpoint: str,
+    params: Dict,
+    api_key: str,
+    base_url: Optional[str] = None,
+    model: Optional[str] = None
+) -> AsyncIterator[str]:
+    """stream_api 的异步版本，不依赖streamlit会话"""
+    if endpoint not in _CHAT_ENDPOINTS:
+        raise Exception(f"endpoint不支持流式输出: {endpoint}")
+    build_messages, temperature = _CHAT_ENDPOINTS[endpoint]
+    client = get_async_client(api_key, base_url or DEFAULT_BASE_URL)
+    tracer = get_tracer()
+    span = tracer.start(f"stream_api.{endpoint}")
+    stream = None
+    chunks = 0
+    try:
+        stream = await _create_completion_async(
+            client,
+            span,
+            model=model or DEFAULT_MODEL,
+            messages=build_messages(params),
+            temperature=temperature,
+            stream=True
+        )
+        async for chunk in stream:
+            text = _delta(chunk)
+            if text:
+                if not chunks:
+                    span.set(first_token_seconds=span.duration)
+                chunks += 1
+                yield text
+    except Exception as e:
+        span.set(status="error", error=str(e))
+        raise
+    finally:
+        if stream is not None:
+            await stream.response.aclose()
+        span.set(completion_tokens=chunks)
+        tracer.finish(span)
+
+def stream_sql(sql: str) -> Iterator[Dict]:
+    """流式读取后端 /execute_sql/stream 的NDJSON结果，逐批产出，不在内存中累积整个结果集"""
+    with httpx.stream(
+        "POST",
+        f"{BACKEND_URL}/execute_sql/stream",
+        params={"sql": sql},
+        timeout=None
+    ) as response:
+        if response.status_code == 400:
+            # 查询执行失败，响应体是错误对象
+            response.read()
+            yield response.json()
+            return
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if line:
+                yield json.loads(line)
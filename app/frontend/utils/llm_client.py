@@ -0,0 +1,100 @@
+import os
+import threading
+from typing import Dict, Tuple
+import httpx
+from openai import AsyncOpenAI, OpenAI
+
+# 后端（无streamlit会话）使用的默认LLM配置
+DEFAULT_BASE_URL = os.getenv("LLM_BASE_URL", "https://open.bigmodel.cn/api/paas/v4/")
+DEFAULT_MODEL = os.getenv("LLM_MODEL", "glm-4-plus")
+
+# 连接池参数，可通过环境变量调整
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "20"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+# 模型调用的重试由 utils.rate_limiter 统一处理（抖动退避、截止时间），关闭SDK自带的重试
+LLM_SDK_MAX_RETRIES = 0
+
+def _http2_available() -> bool:
+    """HTTP/2 需要安装 h2（httpx[http2]）"""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+# 服务端不支持时会通过ALPN协商自动回退到HTTP/1.1
+LLM_HTTP2 = os.getenv("LLM_HTTP2", "1") == "1" and _http2_available()
+
+_clients: Dict[Tuple[str, str], OpenAI] = {}
+_async_clients: Dict[Tuple[str, str], AsyncOpenAI] = {}
+_clients_lock = threading.Lock()
+
+def _http_client_options() -> dict:
+    """同步与异步客户端共用的连接池配置"""
+    return {
+        "http2": LLM_HTTP2,
+        "limits": httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=LLM_KEEPALIVE_EXPIRY
+        ),
+        "timeout": LLM_TIMEOUT
+    }
+
+def _build_http_client() -> httpx.Client:
+    """构建带keep-alive连接池的HTTP客户端"""
+    return httpx.Client(**_http_client_options())
+
+def get_client(api_key: str, base_url: str) -> OpenAI:
+    """获取进程内共享的LLM客户端，按 (api_key, base_url) 复用连接池"""
+    key = (api_key, base_url)
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = OpenAI(
+                    api_key=api_key,
+                    base_url=base_url,
+                    max_retries=LLM_SDK_MAX_RETRIES,
+                    http_client=_build_http_client()
+                )
+                _clients[key] = client
+    return client
+
+def get_async_client(api_key: str, base_url: str) -> AsyncOpenAI:
+    """获取共享的异步LLM客户端
+
+    异步连接池绑定在创建它的事件循环上，只应在同一个事件循环（如uvicorn worker）内使用。
+    """
+    key = (api_key, base_url)
+    client = _async_clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _async_clients.get(key)
+            if client is None:
+                client = AsyncOpenAI(
+                    api_key=api_key,
+                    base_url=base_url,
+                    max_retries=LLM_SDK_MAX_RETRIES,
+                    http_client=httpx.AsyncClient(**_http_client_options())
+                )
+                _async_clients[key] = client
+    return client
+
+async def close_async_clients():
+    """关闭所有缓存的异步客户端"""
+    with _clients_lock:
+        clients = list(_async_clients.values())
+        _async_clients.clear()
+    for client in clients:
+        await client.close()
+
+def close_clients():
+    """关闭所有缓存的客户端及其连接"""
+    with _clients_lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
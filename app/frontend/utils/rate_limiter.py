@@ -0,0 +1,415 @@
+import asyncio
+import contextvars
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional
+import openai
+from utils.llm_client import LLM_TIMEOUT
+# 追踪器与服务层共用：前端进程以 services.* 导入服务层，后端进程以 app.services.* 导入
+try:
+    from services.tracing import METRIC_PREFIX, Span, get_tracer
+except ImportError:
+    from app.services.tracing import METRIC_PREFIX, Span, get_tracer
+
+# 模型服务的限额（每分钟请求数、每分钟token数），0表示不限制
+LLM_REQUESTS_PER_MINUTE = float(os.getenv("LLM_REQUESTS_PER_MINUTE", "0"))
+LLM_TOKENS_PER_MINUTE = float(os.getenv("LLM_TOKENS_PER_MINUTE", "0"))
+# 限额令牌桶的存储：memory 时每个进程各自计数，多个实例合计可能超过限额；
+# redis://... 时所有实例共用Redis中的令牌桶，默认与任务存储（JOB_STORE_URL）相同
+LLM_RATE_LIMIT_URL = os.getenv("LLM_RATE_LIMIT_URL", os.getenv("JOB_STORE_URL", "memory"))
+# 令牌桶容量按多少秒的额度计算；补充速度相应扣掉这部分，任意一分钟内都不超过限额，
+# 持续吞吐约为限额的 (60 - LLM_BURST_SECONDS) / 60
+LLM_BURST_SECONDS = float(os.getenv("LLM_BURST_SECONDS", "3"))
+# 预估输出token数，拿到实际用量后再补差
+LLM_COMPLETION_TOKENS_ESTIMATE = int(os.getenv("LLM_COMPLETION_TOKENS_ESTIMATE", "256"))
+# 自适应并发（AIMD）：初始/最小/最大并发，响应耗时超过目标值或遇到429、超时时按系数减小
+LLM_CONCURRENCY_INITIAL = int(os.getenv("LLM_CONCURRENCY_INITIAL", "8"))
+LLM_CONCURRENCY_MIN = int(os.getenv("LLM_CONCURRENCY_MIN", "1"))
+LLM_CONCURRENCY_MAX = int(os.getenv("LLM_CONCURRENCY_MAX", "64"))
+LLM_LATENCY_TARGET = float(os.getenv("LLM_LATENCY_TARGET", "20"))
+LLM_AIMD_BACKOFF = float(os.getenv("LLM_AIMD_BACKOFF", "0.5"))
+# 重试：指数退避的基数和上限（秒），加全抖动
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "20"))
+# 单次模型调用（含排队和重试）的默认截止时间（秒），外层设置了更早的截止时间时以外层为准
+LLM_CALL_DEADLINE = float(os.getenv("LLM_CALL_DEADLINE", "120"))
+# 单个问题从开始到答案的截止时间（秒）
+QUESTION_DEADLINE_SECONDS = float(os.getenv("QUESTION_DEADLINE_SECONDS", "300"))
+
+# 当前上下文的截止时间（time.monotonic），嵌套设置时取较早者
+_deadline: contextvars.ContextVar = contextvars.ContextVar("deadline", default=None)
+
+class DeadlineExceeded(TimeoutError):
+    """在截止时间之前没能完成调用（排队、限速或重试都计算在内）"""
+
+@contextmanager
+def deadline(seconds: float = QUESTION_DEADLINE_SECONDS) -> Iterator[float]:
+    """为代码块内的模型调用设置截止时间，重试和排队不会超过它，请求超时也按剩余时间设置"""
+    current = _deadline.get()
+    value = time.monotonic() + seconds
+    if current is not None:
+        value = min(value, current)
+    token = _deadline.set(value)
+    try:
+        yield value
+    finally:
+        _deadline.reset(token)
+
+def estimate_request_tokens(messages: List[Dict]) -> int:
+    """粗略估计一次对话请求的token数：中文约每字一个，其他字符约四个一个，加上预估输出"""
+    text = "".join(str(message.get("content", "")) for message in messages)
+    cjk = sum(1 for ch in text if "\u4e00" <= ch <= "\u9fff")
+    return cjk + (len(text) - cjk + 3) // 4 + LLM_COMPLETION_TOKENS_ESTIMATE
+
+class TokenBucket:
+    """按分钟限额匀速补充的令牌桶，允许预支：返回需要等待的秒数，由调用方等待
+
+    容量（突发）加上一分钟的补充量等于限额，满桶突发之后的一分钟内也不会超限。
+    """
+
+    def __init__(self, per_minute: float, burst_seconds: float = LLM_BURST_SECONDS):
+        burst_seconds = min(max(burst_seconds, 0.0), 30.0)
+        self.capacity = max(1.0, per_minute * burst_seconds / 60.0)
+        self.rate = max(per_minute - self.capacity, 1.0) / 60.0
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount: float) -> float:
+        with self._lock:
+            self._refill()
+            self.tokens -= amount
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def refund(self, amount: float):
+        """归还预支的额度；amount为负时补扣（实际用量超过预估）"""
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+# 补充令牌后扣除（amount为负时归还），余额不超过容量，整个过程在Redis中原子执行
+_RESERVE_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[4])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or capacity
+local updated = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+tokens = math.min(capacity, tokens - tonumber(ARGV[3]))
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 60)
+return tostring(tokens)
+"""
+
+class RedisTokenBucket(TokenBucket):
+    """多个实例共用的令牌桶，余额和补充时间保存在Redis中，限额对所有实例合计生效"""
+
+    def __init__(self, url: str, name: str, per_minute: float, burst_seconds: float = LLM_BURST_SECONDS, prefix: str = "llm"):
+        super().__init__(per_minute, burst_seconds)
+        import redis
+        self._redis = redis.Redis.from_url(url)
+        self._script = self._redis.register_script(_RESERVE_SCRIPT)
+        self._key = f"{prefix}:bucket:{name}"
+
+    def _apply(self, amount: float) -> float:
+        self.tokens = float(self._script(keys=[self._key], args=[self.capacity, self.rate, amount, time.time()]))
+        return self.tokens
+
+    def reserve(self, amount: float) -> float:
+        tokens = self._apply(amount)
+        return 0.0 if tokens >= 0 else -tokens / self.rate
+
+    def refund(self, amount: float):
+        self._apply(-amount)
+
+def create_bucket(name: str, per_minute: float, url: str = LLM_RATE_LIMIT_URL) -> Optional[TokenBucket]:
+    """根据URL创建限额令牌桶：memory（进程内）或 redis://...（实例间共享），不限制时返回None"""
+    if per_minute <= 0:
+        return None
+    if url.startswith("redis://") or url.startswith("rediss://"):
+        return RedisTokenBucket(url, name, per_minute)
+    return TokenBucket(per_minute)
+
+class AdaptiveConcurrency:
+    """AIMD自适应并发上限
+
+    并发占满时每次成功且耗时不超过目标值，上限增加 1/上限（约每一轮请求加1），
+    遇到429、超时或耗时超标时乘以退避系数；同一轮请求（一个平均耗时内）只减一次，
+    避免同一批并发请求的429把上限连续减到最小。
+    """
+
+    def __init__(
+        self,
+        initial: int = LLM_CONCURRENCY_INITIAL,
+        minimum: int = LLM_CONCURRENCY_MIN,
+        maximum: int = LLM_CONCURRENCY_MAX,
+        latency_target: float = LLM_LATENCY_TARGET,
+        backoff: float = LLM_AIMD_BACKOFF
+    ):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = float(min(max(initial, self.minimum), self.maximum))
+        self.latency_target = latency_target
+        self.backoff = backoff
+        self.in_flight = 0
+        self.latency = 0.0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def try_acquire(self) -> bool:
+        with self._cond:
+            if self.in_flight >= int(self.limit):
+                return False
+            self.in_flight += 1
+            return True
+
+    def acquire(self, timeout: Optional[float]) -> bool:
+        end = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                wait = None if end is None else end - time.monotonic()
+                if wait is not None and wait <= 0:
+                    return False
+                self._cond.wait(wait)
+            self.in_flight += 1
+            return True
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+
+    def on_success(self, latency: float):
+        with self._cond:
+            self.latency = latency if not self.latency else 0.8 * self.latency + 0.2 * latency
+            if latency > self.latency_target:
+                self._decrease()
+            elif self.in_flight + 1 >= int(self.limit):
+                # 只有并发占满时才试探更高的上限，空闲时上限不会无限上涨
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+                self._cond.notify_all()
+
+    def on_overload(self):
+        with self._cond:
+            self._decrease()
+
+    def _decrease(self):
+        now = time.monotonic()
+        if now - self._last_decrease < max(0.1, self.latency):
+            return
+        self._last_decrease = now
+        self.limit = max(float(self.minimum), self.limit * self.backoff)
+
+# 可重试的错误：429和超时说明服务端过载，需要同时降低并发；连接错误和5xx只重试
+_OVERLOAD_ERRORS = (openai.RateLimitError, openai.APITimeoutError)
+_RETRYABLE_ERRORS = _OVERLOAD_ERRORS + (openai.APIConnectionError, openai.InternalServerError)
+
+def _retry_after(error: Exception) -> Optional[float]:
+    """429响应的 Retry-After（秒）"""
+    response = getattr(error, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+class RateLimiter:
+    """模型调用的共享限流器
+
+    每次调用依次经过：请求数令牌桶、token数令牌桶（按预估用量预支，拿到实际用量后补差）、
+    AIMD自适应并发；429、超时、连接错误和5xx按带全抖动的指数退避重试，
+    排队、等待和重试都不超过截止时间（当前上下文的 deadline 与 LLM_CALL_DEADLINE 中较早者），
+    每次请求的超时也按剩余时间设置。重试次数记在当前span上。
+
+    令牌桶按 LLM_RATE_LIMIT_URL 在进程内或Redis中计数；自适应并发和统计始终是本进程的，
+    各实例根据各自遇到的429和耗时调整并发。
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float = LLM_REQUESTS_PER_MINUTE,
+        tokens_per_minute: float = LLM_TOKENS_PER_MINUTE,
+        concurrency: Optional[AdaptiveConcurrency] = None,
+        url: str = LLM_RATE_LIMIT_URL
+    ):
+        self.requests = create_bucket("requests", requests_per_minute, url)
+        self.tokens = create_bucket("tokens", tokens_per_minute, url)
+        self.concurrency = concurrency or AdaptiveConcurrency()
+        self._lock = threading.Lock()
+        self.reset()
+
+    def _count(self, **increments):
+        with self._lock:
+            for name, value in increments.items():
+                self._stats[name] += value
+
+    def _deadline(self) -> float:
+        call_deadline = time.monotonic() + LLM_CALL_DEADLINE
+        current = _deadline.get()
+        return call_deadline if current is None else min(call_deadline, current)
+
+    @staticmethod
+    def _remaining(deadline: float) -> float:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceeded("模型调用超过截止时间")
+        return remaining
+
+    def _reserve(self, tokens: int, deadline: float) -> float:
+        """预支请求数和token数额度，返回需要等待的秒数；等待会超过截止时间时归还额度并报错"""
+        wait = 0.0
+        if self.requests is not None:
+            wait = max(wait, self.requests.reserve(1))
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.reserve(tokens))
+        if wait >= self._remaining(deadline):
+            self._refund(tokens)
+            raise DeadlineExceeded(f"限速需要等待 {wait:.1f} 秒，超过截止时间")
+        if wait:
+            self._count(throttled=1, throttled_seconds=wait)
+        return wait
+
+    def _refund(self, tokens: int):
+        if self.requests is not None:
+            self.requests.refund(1)
+        if self.tokens is not None:
+            self.tokens.refund(tokens)
+
+    def _settle(self, result: Any, tokens: int):
+        """按响应中的实际用量补差"""
+        usage = getattr(result, "usage", None)
+        if self.tokens is not None and usage is not None:
+            self.tokens.refund(tokens - usage.total_tokens)
+
+    def _on_error(self, error: Exception, attempt: int, tokens: int, deadline: float) -> float:
+        """失败请求的处理，返回重试前的等待秒数；不可重试或来不及重试时重新抛出"""
+        if not isinstance(error, _RETRYABLE_ERRORS):
+            self._count(failed=1)
+            raise error
+        # 被拒绝的请求不计入用量
+        self._refund(tokens)
+        if isinstance(error, _OVERLOAD_ERRORS):
+            self.concurrency.on_overload()
+        self._count(
+            rate_limited=isinstance(error, openai.RateLimitError),
+            timeouts=isinstance(error, openai.APITimeoutError)
+        )
+        delay = random.uniform(0, min(LLM_RETRY_MAX_DELAY, LLM_RETRY_BASE_DELAY * 2 ** attempt))
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        if time.monotonic() + delay >= deadline:
+            self._count(failed=1)
+            raise error
+        self._count(retries=1)
+        return delay
+
+    def _on_success(self, result: Any, tokens: int, latency: float, attempt: int, span: Optional[Span]):
+        self.concurrency.on_success(latency)
+        self._settle(result, tokens)
+        self._count(succeeded=1)
+        if span is not None and attempt:
+            span.set(retries=span.attributes.get("retries", 0) + attempt)
+
+    def call(self, fn: Callable[[float], Any], tokens: int, span: Optional[Span] = None) -> Any:
+        """限流后调用 fn(timeout)，timeout 是本次请求可用的秒数"""
+        span = span or get_tracer().current()
+        deadline = self._deadline()
+        self._count(requests=1)
+        attempt = 0
+        while True:
+            wait = self._reserve(tokens, deadline)
+            if wait:
+                time.sleep(wait)
+            if not self.concurrency.acquire(self._remaining(deadline)):
+                self._refund(tokens)
+                raise DeadlineExceeded("等待模型并发额度超过截止时间")
+            start = time.monotonic()
+            try:
+                result = fn(min(LLM_TIMEOUT, self._remaining(deadline)))
+            except Exception as e:
+                self.concurrency.release()
+                time.sleep(self._on_error(e, attempt, tokens, deadline))
+                attempt += 1
+                continue
+            self.concurrency.release()
+            self._on_success(result, tokens, time.monotonic() - start, attempt, span)
+            return result
+
+    async def call_async(self, fn: Callable[[float], Awaitable[Any]], tokens: int, span: Optional[Span] = None) -> Any:
+        """call 的异步版本，等待时不阻塞事件循环"""
+        span = span or get_tracer().current()
+        deadline = self._deadline()
+        self._count(requests=1)
+        attempt = 0
+        while True:
+            wait = self._reserve(tokens, deadline)
+            if wait:
+                await asyncio.sleep(wait)
+            # 并发额度由线程和协程共用，协程这里轮询等待
+            while not self.concurrency.try_acquire():
+                if time.monotonic() + 0.01 >= deadline:
+                    self._refund(tokens)
+                    raise DeadlineExceeded("等待模型并发额度超过截止时间")
+                await asyncio.sleep(0.01)
+            start = time.monotonic()
+            try:
+                result = await fn(min(LLM_TIMEOUT, self._remaining(deadline)))
+            except Exception as e:
+                self.concurrency.release()
+                await asyncio.sleep(self._on_error(e, attempt, tokens, deadline))
+                attempt += 1
+                continue
+            self.concurrency.release()
+            self._on_success(result, tokens, time.monotonic() - start, attempt, span)
+            return result
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update(
+            concurrency_limit=self.concurrency.limit,
+            in_flight=self.concurrency.in_flight,
+            latency=self.concurrency.latency
+        )
+        return stats
+
+    def reset(self):
+        with self._lock:
+            self._stats = {
+                "requests": 0,
+                "succeeded": 0,
+                "failed": 0,
+                "retries": 0,
+                "rate_limited": 0,
+                "timeouts": 0,
+                "throttled": 0,
+                "throttled_seconds": 0.0
+            }
+
+    def render_prometheus(self) -> str:
+        """Prometheus文本格式的限流计数和当前并发上限"""
+        stats = self.stats()
+        lines = []
+        for name in ("requests", "succeeded", "failed", "retries", "rate_limited", "timeouts", "throttled"):
+            metric = f"{METRIC_PREFIX}_llm_{name}_total"
+            lines += [f"# TYPE {metric} counter", f"{metric} {stats[name]}"]
+        for name in ("concurrency_limit", "in_flight"):
+            metric = f"{METRIC_PREFIX}_llm_{name}"
+            lines += [f"# TYPE {metric} gauge", f"{metric} {stats[name]}"]
+        return "\n".join(lines) + "\n"
+
+@lru_cache(maxsize=1)
+def get_rate_limiter() -> RateLimiter:
+    """进程内共享的模型调用限流器，配置了Redis时各实例的令牌桶额度合计生效"""
+    return RateLimiter()
@@ -1,24 +1,80 @@
-# app/main.py
-from fastapi import FastAPI
-from fastapi.middleware.cors import CORSMiddleware
-import streamlit as st
-from pathlib import Path
-import uvicorn
-
-app = FastAPI(title="Finance QA System")
-
-# 配置CORS
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # 在生产环境中需要限制
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-@app.get("/")
-def read_root():
-    return {"message": "Welcome to Finance QA System"}
-
-if __name__ == "__main__":
+# app/main.py
+import sys
+import os
+# 服务层复用前端的 utils.api_client
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "frontend"))
+
+from fastapi import FastAPI
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
+import streamlit as st
+from pathlib import Path
+import uvicorn
+import logging
+from app.api.endpoints import router
+from app.models.database import engine, warm_pool
+from app.services.schema_catalog import get_schema_catalog
+from app.services.entity_index import get_entity_index
+from utils.rate_limiter import get_rate_limiter
+from app.services.tracing import get_tracer
+
+app = FastAPI(title="Finance QA System")
+
+# 配置CORS
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],  # 在生产环境中需要限制
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+app.include_router(router)
+
+@app.on_event("startup")
+def load_schema_catalog():
+    """启动时一次性加载表结构目录和实体索引，并预热连接池；各步失败互不影响，分别记录"""
+    logger = logging.getLogger(__name__)
+    try:
+        warm_pool(engine)
+    except Exception as e:
+        logger.warning(f"Failed to warm connection pool: {str(e)}")
+    try:
+        connection = engine.raw_connection()
+    except Exception as e:
+        logger.warning(f"Failed to connect to database at startup: {str(e)}")
+        return
+    try:
+        try:
+            get_schema_catalog().refresh(connection, force=True)
+        except Exception as e:
+            logger.warning(f"Failed to preload schema catalog: {str(e)}")
+        try:
+            index = get_entity_index()
+            index.load(connection)
+            if not len(index):
+                logger.warning("Entity index is empty, company names in questions will not be resolved")
+            # 导出快照，供不直连数据库的前端进程加载
+            index.export()
+        except Exception as e:
+            logger.warning(f"Failed to load entity index: {str(e)}")
+    finally:
+        connection.close()
+
+@app.get("/")
+def read_root():
+    return {"message": "Welcome to Finance QA System"}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Prometheus文本格式的各阶段耗时直方图、p50/p95/p99分位数、错误数和token/重试/行数计数，以及模型调用限流状态
+
+    只包含本进程（后端）记录的span；Streamlit前端中执行的问答流水线由前端进程在 METRICS_PORT 上导出
+    """
+    return PlainTextResponse(
+        get_tracer().render_prometheus() + get_rate_limiter().render_prometheus(),
+        media_type="text/plain; version=0.0.4"
+    )
+
+if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
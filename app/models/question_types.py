@@ -0,0 +1,186 @@
+# app/models/question_types.py
+import argparse
+import json
+import os
+import re
+import zlib
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+
+CONFIG_DIR = Path(__file__).parent.parent / "config"
+
+# 训练好的本地模型文件（由本模块的 train 命令生成），不存在时只用关键词
+QUESTION_CLASSIFIER_MODEL = os.getenv(
+    "QUESTION_CLASSIFIER_MODEL",
+    str(Path(__file__).parent.parent.parent / ".cache" / "question_classifier.npz")
+)
+# 关键词与模型的融合权重
+KEYWORD_WEIGHT = float(os.getenv("QUESTION_CLASSIFIER_KEYWORD_WEIGHT", "0.5"))
+
+QUESTION_TYPES = ("basic", "statistical", "complex")
+# 命中数相同时优先更复杂的类型：复杂问题里常常也带着基础关键词
+_TIE_BREAK = {"basic": 0, "statistical": 1, "complex": 2}
+
+def _char_ngrams(text: str) -> List[str]:
+    text = re.sub(r"\s+", "", text.lower())
+    return list(text) + [text[i:i + 2] for i in range(len(text) - 1)]
+
+class TfidfLinearModel:
+    """字符一二元组哈希TF-IDF + softmax线性分类器，只依赖numpy"""
+
+    def __init__(self, n_features: int = 4096, labels: Sequence[str] = QUESTION_TYPES):
+        self.n_features = n_features
+        self.labels = list(labels)
+        self.idf = np.ones(n_features, dtype=np.float32)
+        self.weights = np.zeros((n_features, len(self.labels)), dtype=np.float32)
+        self.bias = np.zeros(len(self.labels), dtype=np.float32)
+
+    def _counts(self, questions: Sequence[str]) -> np.ndarray:
+        matrix = np.zeros((len(questions), self.n_features), dtype=np.float32)
+        for row, question in enumerate(questions):
+            for gram in _char_ngrams(question):
+                matrix[row, zlib.crc32(gram.encode("utf-8")) % self.n_features] += 1
+        return matrix
+
+    def transform(self, questions: Sequence[str]) -> np.ndarray:
+        """一次性把整批问题转成L2归一化的TF-IDF矩阵"""
+        matrix = np.log1p(self._counts(questions)) * self.idf
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.maximum(norms, 1e-12)
+
+    def fit(self, questions: Sequence[str], labels: Sequence[str], epochs: int = 300, lr: float = 0.5, l2: float = 1e-4):
+        counts = self._counts(questions)
+        document_freq = (counts > 0).sum(axis=0)
+        self.idf = (np.log((1 + len(questions)) / (1 + document_freq)) + 1).astype(np.float32)
+        x = self.transform(questions)
+        y = np.zeros((len(questions), len(self.labels)), dtype=np.float32)
+        y[np.arange(len(labels)), [self.labels.index(label) for label in labels]] = 1
+
+        # 全批量梯度下降，训练集只有几十到几千条，不需要更复杂的优化器
+        for _ in range(epochs):
+            probabilities = self._softmax(x @ self.weights + self.bias)
+            gradient = probabilities - y
+            self.weights -= lr * (x.T @ gradient / len(x) + l2 * self.weights)
+            self.bias -= lr * gradient.mean(axis=0)
+        return self
+
+    @staticmethod
+    def _softmax(logits: np.ndarray) -> np.ndarray:
+        logits = logits - logits.max(axis=1, keepdims=True)
+        exp = np.exp(logits)
+        return exp / exp.sum(axis=1, keepdims=True)
+
+    def predict_proba(self, questions: Sequence[str]) -> np.ndarray:
+        return self._softmax(self.transform(questions) @ self.weights + self.bias)
+
+    def save(self, path: str):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        np.savez(path, idf=self.idf, weights=self.weights, bias=self.bias, labels=np.array(self.labels))
+
+    @classmethod
+    def load(cls, path: str) -> "TfidfLinearModel":
+        data = np.load(path)
+        model = cls(n_features=data["idf"].shape[0], labels=[str(label) for label in data["labels"]])
+        model.idf, model.weights, model.bias = data["idf"], data["weights"], data["bias"]
+        return model
+
+class QuestionClassifier:
+    def __init__(self, model_path: Optional[str] = QUESTION_CLASSIFIER_MODEL):
+        # 定义关键词字典
+        self.keywords = {
+            "basic": ["股票代码", "股票名称", "收盘价", "开盘价", "最高价", "最低价"],
+            "statistical": ["平均", "总计", "涨停", "跌停", "换手率", "成交量"],
+            "complex": ["财务分析", "行业对比", "趋势分析", "风险评估"]
+        }
+        # 所有关键词编译成一个正则，一次扫描统计各类型的命中数
+        owners = {keyword: q_type for q_type, keywords in self.keywords.items() for keyword in keywords}
+        self._owners = owners
+        self._pattern = re.compile("|".join(re.escape(k) for k in sorted(owners, key=len, reverse=True)))
+        self.model = None
+        if model_path and os.path.exists(model_path):
+            self.model = TfidfLinearModel.load(model_path)
+
+    def keyword_scores(self, questions: Sequence[str]) -> np.ndarray:
+        """各类型的关键词命中分布，没有命中的问题为全零行"""
+        scores = np.zeros((len(questions), len(QUESTION_TYPES)), dtype=np.float32)
+        for row, question in enumerate(questions):
+            for match in self._pattern.finditer(question):
+                scores[row, QUESTION_TYPES.index(self._owners[match.group()])] += 1
+        totals = scores.sum(axis=1, keepdims=True)
+        return np.divide(scores, totals, out=np.zeros_like(scores), where=totals > 0)
+
+    def predict_proba(self, questions: Sequence[str]) -> np.ndarray:
+        """每个问题属于各类型的概率，列顺序同 QUESTION_TYPES"""
+        keyword = self.keyword_scores(questions)
+        if self.model is None:
+            return keyword
+        model = self.model.predict_proba(questions)
+        model = model[:, [self.model.labels.index(t) for t in QUESTION_TYPES]]
+        # 没有关键词命中的问题完全由模型决定
+        has_keyword = keyword.sum(axis=1, keepdims=True) > 0
+        return np.where(has_keyword, KEYWORD_WEIGHT * keyword + (1 - KEYWORD_WEIGHT) * model, model)
+
+    def classify_batch(self, questions: Sequence[str]) -> List[Dict]:
+        """批量分类
+        Returns:
+            [{"type": 类型, "confidence": 置信度}, ...]，无法判断时为 basic、置信度0
+        """
+        probabilities = self.predict_proba(questions)
+        results = []
+        for row in probabilities:
+            if not row.any():
+                results.append({"type": "basic", "confidence": 0.0})
+                continue
+            best = max(range(len(QUESTION_TYPES)), key=lambda i: (round(float(row[i]), 6), _TIE_BREAK[QUESTION_TYPES[i]]))
+            results.append({"type": QUESTION_TYPES[best], "confidence": float(row[best])})
+        return results
+
+    def classify_with_confidence(self, question: str) -> Tuple[str, float]:
+        result = self.classify_batch([question])[0]
+        return result["type"], result["confidence"]
+
+    def classify(self, question: str) -> str:
+        """根据问题内容分类"""
+        return self.classify_batch([question])[0]["type"]
+
+def _load_labels(paths: Sequence[str]) -> Tuple[List[str], List[str]]:
+    questions, labels = [], []
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            for item in json.load(f):
+                questions.append(item["question"])
+                labels.append(item["type"])
+    return questions, labels
+
+def main(argv: Optional[list] = None):
+    """训练/评估问题分类模型
+
+    python -m app.models.question_types train --labels app/config/question_type_labels.json
+    python -m app.models.question_types evaluate --labels app/config/question_type_labels.json
+    """
+    parser = argparse.ArgumentParser(description="Train or evaluate the question type classifier")
+    parser.add_argument("command", choices=["train", "evaluate"])
+    parser.add_argument("--labels", nargs="+", default=[str(CONFIG_DIR / "question_type_labels.json")])
+    parser.add_argument("--model", default=QUESTION_CLASSIFIER_MODEL)
+    args = parser.parse_args(argv)
+
+    questions, labels = _load_labels(args.labels)
+    if args.command == "train":
+        TfidfLinearModel().fit(questions, labels).save(args.model)
+        print(f"Trained on {len(questions)} questions, saved to {args.model}")
+        return
+
+    report = {}
+    for name, classifier in (("keywords", QuestionClassifier(model_path=None)), ("combined", QuestionClassifier(args.model))):
+        predictions = classifier.classify_batch(questions)
+        correct = sum(p["type"] == label for p, label in zip(predictions, labels))
+        report[name] = {
+            "accuracy": correct / len(labels),
+            "mean_confidence": float(np.mean([p["confidence"] for p in predictions])),
+            "model_loaded": classifier.model is not None
+        }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
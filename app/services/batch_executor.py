@@ -0,0 +1,100 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import Any, Callable, ContextManager, Dict, List, Optional, Tuple
+import queue
+
+# 一个执行通道内的题目按顺序执行，不同通道之间并发
+Lane = List[Tuple[Dict, Dict]]
+
+def write_back(question: Dict, result: Dict) -> None:
+    """把单题执行结果写回题目JSON结构"""
+    question["status"] = result["status"]
+    if result["status"] == "completed":
+        question["answer"] = result["answer"]
+    else:
+        question["answer"] = f"执行错误: {result['error']}"
+
+class BatchExecutor:
+    """题目文件的并发批量执行器
+
+    使用有界线程池并发执行题目，总耗时取决于最慢的执行通道，而不是所有题目耗时之和。
+    keep_group_order=True 时同一 tid 组内的题目按顺序执行（适用于组内题目存在上下文依赖的情况），
+    否则每道题都是独立的通道。
+    """
+
+    def __init__(
+        self,
+        execute_fn: Callable[[str], Dict],
+        max_workers: int = 4,
+        keep_group_order: bool = True,
+        initializer: Optional[Callable[[], Any]] = None
+    ):
+        self.execute_fn = execute_fn
+        self.max_workers = max(1, int(max_workers))
+        self.keep_group_order = keep_group_order
+        self.initializer = initializer
+
+    def build_lanes(self, questions: List[Dict]) -> List[Lane]:
+        """按执行策略把题目划分为执行通道"""
+        if self.keep_group_order:
+            return [
+                [(group, q) for q in group["team"]]
+                for group in questions
+                if group["team"]
+            ]
+        return [[(group, q)] for group in questions for q in group["team"]]
+
+    def run(
+        self,
+        questions: List[Dict],
+        on_result: Optional[Callable[[Dict, Dict, Dict], None]] = None,
+        should_stop: Optional[Callable[[], bool]] = None,
+        gate: Optional[Callable[[], ContextManager[bool]]] = None
+    ) -> List[Dict]:
+        """并发执行所有题目
+        Args:
+            questions: 上传的题目JSON（[{tid, team: [{question, ...}]}]）
+            on_result: 每完成一题在调用线程中回调 on_result(group, question, result)
+            should_stop: 返回True时不再开始新的题目
+            gate: 每道题开始前在工作线程中进入的上下文（可以阻塞，如暂停、等待全局并发额度），
+                进入结果为False时该通道不再开始新的题目，题目执行完才退出
+        Returns:
+            原题目结构，答案已写回
+        """
+        lanes = self.build_lanes(questions)
+        done_queue = queue.Queue()
+
+        def run_lane(lane: Lane):
+            try:
+                for group, q in lane:
+                    if should_stop and should_stop():
+                        break
+                    with gate() if gate else nullcontext(True) as admitted:
+                        if not admitted:
+                            break
+                        try:
+                            result = self.execute_fn(q["question"])
+                        except Exception as e:
+                            result = {"status": "error", "steps": [], "error": str(e), "answer": None}
+                    done_queue.put((group, q, result))
+            finally:
+                # 通道结束标记
+                done_queue.put(None)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, initializer=self.initializer) as pool:
+            for lane in lanes:
+                pool.submit(run_lane, lane)
+
+            # 回写和回调都在调用线程中进行，避免并发修改题目结构
+            finished_lanes = 0
+            while finished_lanes < len(lanes):
+                item = done_queue.get()
+                if item is None:
+                    finished_lanes += 1
+                    continue
+                group, q, result = item
+                write_back(q, result)
+                if on_result:
+                    on_result(group, q, result)
+
+        return questions
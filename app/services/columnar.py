@@ -0,0 +1,90 @@
+from decimal import Decimal
+from numbers import Number
+from typing import Any, Dict, Iterable, Iterator, List, Sequence
+import numpy as np
+import pandas as pd
+
+# 列式结果：列名 -> NumPy数组，列的顺序即字典顺序
+Columns = Dict[str, np.ndarray]
+
+def _to_array(values: Sequence) -> np.ndarray:
+    """把一列值转成NumPy数组，数值列（含Decimal与None）统一转为float64"""
+    array = np.asarray(values)
+    if array.dtype.kind == "U":
+        # 字符串用object数组，pandas可直接复用而不需要再转换
+        return np.asarray(values, dtype=object)
+    if array.dtype != object:
+        return array
+    sample = next((value for value in values if value is not None), None)
+    if isinstance(sample, (Number, Decimal)) and not isinstance(sample, bool):
+        try:
+            return np.asarray(values, dtype=np.float64)
+        except (TypeError, ValueError):
+            pass
+    return array
+
+def rows_to_columns(rows: Sequence[Sequence], names: List[str]) -> Columns:
+    """一次性把行转置为列，每列一个数组"""
+    if not rows:
+        return {name: np.asarray([], dtype=object) for name in names}
+    return {name: _to_array(values) for name, values in zip(names, zip(*rows))}
+
+def as_columns(data: Any, names: List[str] = None) -> Columns:
+    """把各种查询结果形态统一成列式结果
+
+    已经是列式结果时原样返回（零拷贝）；也接受行字典列表、或行元组列表加列名。
+    """
+    if isinstance(data, dict):
+        return data
+    rows = list(data)
+    if rows and isinstance(rows[0], dict):
+        names = list(rows[0].keys())
+        rows = [tuple(row[name] for name in names) for row in rows]
+    return rows_to_columns(rows, names or [])
+
+def to_dataframe(data: Any) -> pd.DataFrame:
+    """转为DataFrame，列式结果不复制底层数组"""
+    if isinstance(data, dict):
+        return pd.DataFrame(data, copy=False)
+    return pd.DataFrame(data)
+
+def to_records(columns: Columns) -> List[Dict]:
+    """列式结果转回行字典，用于JSON序列化等需要行格式的场合"""
+    names = list(columns.keys())
+    return [dict(zip(names, row)) for row in zip(*(columns[name].tolist() for name in names))]
+
+class _ChunkSink:
+    """收集IPC写入器输出的字节，按批次取走"""
+
+    closed = False
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def arrow_ipc_stream(batches: Iterable[Columns]) -> Iterator[bytes]:
+    """把列式批次编码为Arrow IPC流，逐批产出字节，需要安装pyarrow"""
+    import pyarrow as pa
+
+    sink = _ChunkSink()
+    writer = None
+    for columns in batches:
+        record_batch = pa.RecordBatch.from_pydict(columns)
+        if writer is None:
+            writer = pa.ipc.new_stream(sink, record_batch.schema)
+        writer.write_batch(record_batch)
+        yield sink.drain()
+    if writer is not None:
+        writer.close()
+        yield sink.drain()
@@ -0,0 +1,275 @@
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+import unicodedata
+from collections import deque
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# 实体快照文件：后端启动时从数据库加载后导出到这里，前端等不直连数据库的进程从这里加载
+ENTITY_INDEX_SNAPSHOT = os.getenv(
+    "ENTITY_INDEX_SNAPSHOT",
+    str(Path(__file__).parent.parent.parent / ".cache" / "entities.json")
+)
+# 两次检查快照文件修改时间之间的最小间隔（秒），后端重新导出后前端据此重新加载
+ENTITY_INDEX_CHECK_INTERVAL = float(os.getenv("ENTITY_INDEX_CHECK_INTERVAL", "60"))
+
+# 证券主表与公司名称变更表中参与匹配的字段
+SECUMAIN_FIELDS = ("InnerCode", "CompanyCode", "SecuCode", "SecuAbbr", "ChiName", "ChiNameAbbr", "SecuCategory")
+NAME_CHANGE_FIELDS = ("CompanyCode", "ChiName", "ChiNameAbbr", "SecuAbbr")
+NAME_FIELDS = ("SecuAbbr", "ChiName", "ChiNameAbbr")
+SECUMAIN_TABLE = "constantdb.secumain"
+NAME_CHANGE_TABLE = "astockbasicinfodb.lc_namechange"
+# A股证券类别，同名时优先
+A_SHARE_CATEGORY = 1
+
+def normalize(text: str) -> str:
+    """全半角统一、小写"""
+    return unicodedata.normalize("NFKC", text).lower()
+
+class AhoCorasick:
+    """多模式字符串匹配自动机，一次线性扫描找出文本中出现的所有模式"""
+
+    def __init__(self):
+        # 状态转移、失败指针、每个状态结束的模式 (长度, 值)
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[Tuple[int, object]]] = [[]]
+
+    def add(self, pattern: str, value):
+        state = 0
+        for char in pattern:
+            nxt = self._goto[state].get(char)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][char] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            state = nxt
+        self._output[state].append((len(pattern), value))
+
+    def build(self):
+        """按广度优先计算失败指针，并合并后缀状态的输出"""
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(char, 0)
+                self._output[nxt] = self._output[nxt] + self._output[self._fail[nxt]]
+
+    def find(self, text: str) -> Iterable[Tuple[int, int, object]]:
+        """产出 (起始位置, 结束位置, 值)"""
+        state = 0
+        for i, char in enumerate(text):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            for length, value in self._output[state]:
+                yield i + 1 - length, i + 1, value
+
+class EntityIndex:
+    """公司/证券实体索引
+
+    从证券主表和公司名称变更表一次性加载证券代码、简称、中文全称和历史名称，构建AC自动机。
+    解析问题时一次扫描找出所有提及，按最左最长取不重叠的匹配，解析为 InnerCode/CompanyCode。
+    """
+
+    def __init__(self, snapshot_path: Optional[str] = ENTITY_INDEX_SNAPSHOT):
+        self.snapshot_path = snapshot_path
+        self._lock = threading.Lock()
+        self._entities: List[Dict] = []
+        self._matcher: Optional[AhoCorasick] = None
+        # 从数据库加载时不再读快照；从快照加载时记录文件修改时间
+        self._from_database = False
+        self._snapshot_mtime: Optional[float] = None
+        self._checked_at = 0.0
+        self.logger = logging.getLogger(__name__)
+
+    @property
+    def loaded(self) -> bool:
+        return self._matcher is not None
+
+    def __len__(self) -> int:
+        return len(self._entities)
+
+    def load_records(self, records: List[Dict]):
+        """由实体记录构建索引，记录含 InnerCode/CompanyCode/SecuCode/SecuAbbr/ChiName 及 names（历史名称）"""
+        matcher = AhoCorasick()
+        for entity_id, record in enumerate(records):
+            keys = {("SecuCode", record.get("SecuCode"))}
+            keys.update((field, record.get(field)) for field in NAME_FIELDS)
+            keys.update(("HistoricalName", name) for name in record.get("names", ()))
+            for field, key in keys:
+                if key and len(str(key)) >= 2:
+                    matcher.add(normalize(str(key)), (entity_id, field))
+        matcher.build()
+        with self._lock:
+            self._entities = records
+            self._matcher = matcher
+        self.logger.info(f"Loaded entity index: {len(records)} securities")
+
+    def load(self, connection):
+        """从数据库加载证券主表和公司名称变更记录"""
+        from .schema_catalog import get_schema_catalog
+
+        catalog = get_schema_catalog()
+
+        def query(table: str, wanted: Tuple[str, ...]) -> List[Dict]:
+            known = {c["name"].lower() for c in catalog.columns(table)}
+            fields = [f for f in wanted if not known or f.lower() in known]
+            cursor = connection.cursor()
+            cursor.execute(f"SELECT {', '.join(fields)} FROM {table}")
+            return [dict(zip(fields, row)) for row in cursor.fetchall()]
+
+        records = query(SECUMAIN_TABLE, SECUMAIN_FIELDS)
+        by_company: Dict[object, List[Dict]] = {}
+        for record in records:
+            record["names"] = []
+            by_company.setdefault(record.get("CompanyCode"), []).append(record)
+        try:
+            for change in query(NAME_CHANGE_TABLE, NAME_CHANGE_FIELDS):
+                for record in by_company.get(change.get("CompanyCode"), ()):
+                    record["names"].extend(
+                        change[field] for field in NAME_FIELDS
+                        if change.get(field) and change[field] != record.get(field)
+                    )
+        except Exception as e:
+            self.logger.warning(f"Failed to load historical names: {str(e)}")
+        self.load_records(records)
+        self._from_database = True
+
+    def load_snapshot(self, path: Optional[str] = None):
+        with open(path or self.snapshot_path, "r", encoding="utf-8") as f:
+            self.load_records(json.load(f))
+
+    def _load_configured_snapshot(self):
+        """首次解析时加载配置的快照；文件缺失或损坏时记一次警告并使用空索引，不让每个问题都报错"""
+        try:
+            self.load_snapshot()
+        except (OSError, ValueError) as e:
+            self.logger.warning(f"Failed to load entity snapshot {self.snapshot_path}, entity index is empty: {str(e)}")
+            self.load_records([])
+            return
+        if not self._entities:
+            self.logger.warning(f"Entity snapshot {self.snapshot_path} is empty, company names will not be resolved")
+
+    def refresh(self):
+        """按配置的快照加载索引（进程启动时和解析问题前调用）；快照文件修改后按检查间隔重新加载"""
+        if self._from_database or not self.snapshot_path:
+            return
+        now = time.monotonic()
+        if self._matcher is not None and now - self._checked_at < ENTITY_INDEX_CHECK_INTERVAL:
+            return
+        self._checked_at = now
+        try:
+            mtime = os.path.getmtime(self.snapshot_path)
+        except OSError:
+            mtime = None
+        if self._matcher is not None and mtime == self._snapshot_mtime:
+            return
+        self._snapshot_mtime = mtime
+        self._load_configured_snapshot()
+
+    def export(self, path: Optional[str] = None):
+        path = path or self.snapshot_path
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        # 先写临时文件再替换，读取快照的进程不会读到写了一半的文件
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._entities, f, ensure_ascii=False, default=str)
+        os.replace(tmp_path, path)
+
+    def _rank(self, entity_id: int) -> Tuple:
+        record = self._entities[entity_id]
+        return (record.get("SecuCategory") != A_SHARE_CATEGORY, entity_id)
+
+    def resolve(self, question: str) -> List[Dict]:
+        """找出问题中提及的所有公司/证券
+        Returns:
+            [{mention, start, end, field, InnerCode, CompanyCode, SecuCode, SecuAbbr, ChiName}, ...]，按出现顺序
+        """
+        self.refresh()
+        if self._matcher is None:
+            return []
+        text = normalize(question)
+        # 极少数字符归一化后长度会变，此时按归一化文本截取提及
+        source = question if len(text) == len(question) else text
+        candidates: Dict[Tuple[int, int], List[Tuple[int, str]]] = {}
+        for start, end, (entity_id, field) in self._matcher.find(text):
+            # 证券代码两侧不能紧邻数字，避免匹配到日期等长数字的片段
+            if field == "SecuCode" and (
+                (start > 0 and text[start - 1].isdigit()) or (end < len(text) and text[end].isdigit())
+            ):
+                continue
+            candidates.setdefault((start, end), []).append((entity_id, field))
+
+        # 最左最长：按起始位置升序、长度降序选取不重叠的匹配
+        mentions = []
+        covered_until = 0
+        for (start, end) in sorted(candidates, key=lambda span: (span[0], -span[1])):
+            if start < covered_until:
+                continue
+            entity_id, field = min(candidates[(start, end)], key=lambda c: self._rank(c[0]))
+            record = self._entities[entity_id]
+            mentions.append({
+                "mention": source[start:end],
+                "start": start,
+                "end": end,
+                "field": field,
+                "InnerCode": record.get("InnerCode"),
+                "CompanyCode": record.get("CompanyCode"),
+                "SecuCode": record.get("SecuCode"),
+                "SecuAbbr": record.get("SecuAbbr"),
+                "ChiName": record.get("ChiName")
+            })
+            covered_until = end
+        return mentions
+
+    @staticmethod
+    def describe(mentions: List[Dict]) -> str:
+        """实体解析结果的文字说明，放入SQL生成提示词，引导使用精确的键做过滤"""
+        return "\n".join(
+            f"{m['mention']}: InnerCode={m['InnerCode']}, CompanyCode={m['CompanyCode']}, "
+            f"SecuCode={m['SecuCode']}, SecuAbbr={m['SecuAbbr']}"
+            for m in mentions
+        )
+
+@lru_cache(maxsize=1)
+def get_entity_index() -> EntityIndex:
+    """进程内共享的实体索引"""
+    return EntityIndex()
+
+def main():
+    """从数据库构建实体索引并导出快照
+
+    用法: python -m app.services.entity_index --export .cache/entities.json
+    """
+    parser = argparse.ArgumentParser(description="Build the company/security entity index")
+    parser.add_argument("--export", required=True, help="快照输出路径")
+    parser.add_argument("--question", help="导出后用该问题测试解析")
+    args = parser.parse_args()
+
+    from app.models.database import engine
+
+    index = EntityIndex(snapshot_path=None)
+    connection = engine.raw_connection()
+    try:
+        index.load(connection)
+    finally:
+        connection.close()
+    index.export(args.export)
+    print(f"Exported {len(index)} securities to {args.export}")
+    if args.question:
+        print(json.dumps(index.resolve(args.question), ensure_ascii=False, indent=2, default=str))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,410 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Callable, Dict, Iterator, List, Optional
+from .batch_executor import BatchExecutor
+from .run_store import RunStore
+
+# 全局并发额度：所有用户的批量任务合计同时执行的题目数上限
+JOB_MAX_CONCURRENCY = int(os.getenv("JOB_MAX_CONCURRENCY", "8"))
+# 任务状态和并发额度的存储：memory（单进程）或 redis://...（docker-compose中的redis服务，多个实例共享额度）
+JOB_STORE_URL = os.getenv("JOB_STORE_URL", "memory")
+# 暂停、等待并发额度时检查控制命令的间隔（秒）
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "0.5"))
+# Redis中并发额度的租约时长（秒），持有进程崩溃时额度最迟在租约到期后收回
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "600"))
+# 已结束任务的状态保留时长（秒）
+JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_SECONDS", str(24 * 3600)))
+# 执行中的任务定期刷新状态的更新时间；超过 JOB_STALE_SECONDS 没有刷新的未结束任务视为执行实例已退出，按失败处理
+JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", "15"))
+JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", "120"))
+
+QUEUED = "queued"
+RUNNING = "running"
+PAUSED = "paused"
+CANCELLED = "cancelled"
+COMPLETED = "completed"
+FAILED = "failed"
+FINISHED_STATUSES = (CANCELLED, COMPLETED, FAILED)
+
+# 控制命令
+PAUSE = "pause"
+RESUME = "resume"
+CANCEL = "cancel"
+
+def effective_snapshot(snapshot: Dict, now: Optional[float] = None) -> Dict:
+    """未结束但心跳超时的任务按失败返回（如执行它的实例已崩溃），不再被当作执行中的任务找回"""
+    now = time.time() if now is None else now
+    if snapshot["status"] in FINISHED_STATUSES or now - snapshot["updated"] <= JOB_STALE_SECONDS:
+        return snapshot
+    return dict(snapshot, status=FAILED, error=f"任务 {JOB_STALE_SECONDS:.0f} 秒没有心跳，执行实例可能已退出")
+
+class MemoryJobStore:
+    """进程内的任务状态、控制命令和并发额度"""
+
+    def __init__(self, max_concurrency: int = JOB_MAX_CONCURRENCY):
+        self.max_concurrency = max_concurrency
+        self._lock = threading.Condition()
+        self._snapshots: Dict[str, Dict] = {}
+        self._controls: Dict[str, str] = {}
+        self._slots = set()
+
+    def save(self, snapshot: Dict):
+        with self._lock:
+            self._snapshots[snapshot["job_id"]] = snapshot
+
+    def load(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            return self._snapshots.get(job_id)
+
+    def jobs(self) -> List[Dict]:
+        with self._lock:
+            return list(self._snapshots.values())
+
+    def delete(self, job_id: str):
+        with self._lock:
+            self._snapshots.pop(job_id, None)
+            self._controls.pop(job_id, None)
+
+    def set_control(self, job_id: str, command: str):
+        with self._lock:
+            self._controls[job_id] = command
+            self._lock.notify_all()
+
+    def control(self, job_id: str) -> Optional[str]:
+        return self._controls.get(job_id)
+
+    def wait(self, timeout: float):
+        """等待控制命令变化或额度释放"""
+        with self._lock:
+            self._lock.wait(timeout)
+
+    def try_acquire(self, token: str) -> bool:
+        with self._lock:
+            if len(self._slots) >= self.max_concurrency:
+                return False
+            self._slots.add(token)
+            return True
+
+    def release(self, token: str):
+        with self._lock:
+            self._slots.discard(token)
+            self._lock.notify_all()
+
+    def in_use(self) -> int:
+        return len(self._slots)
+
+# 清理过期租约后有空余额度才占用，整个过程在Redis中原子执行
+_ACQUIRE_SCRIPT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+if redis.call('ZCARD', KEYS[1]) < tonumber(ARGV[2]) then
+    redis.call('ZADD', KEYS[1], ARGV[3], ARGV[4])
+    return 1
+end
+return 0
+"""
+
+class RedisJobStore:
+    """基于Redis的任务状态、控制命令和并发额度（docker-compose中的redis服务）
+
+    额度是一个有序集合，成员是占用额度的令牌，分数是租约到期时间；
+    任何实例都可以查询进度或发出暂停/取消命令，由执行任务的实例在下一个检查点响应。
+    """
+
+    def __init__(self, url: str, max_concurrency: int = JOB_MAX_CONCURRENCY, prefix: str = "jobs"):
+        import redis
+        self._redis = redis.Redis.from_url(url)
+        self._acquire = self._redis.register_script(_ACQUIRE_SCRIPT)
+        self.max_concurrency = max_concurrency
+        self._prefix = prefix
+
+    def _key(self, *parts: str) -> str:
+        return ":".join((self._prefix,) + parts)
+
+    def save(self, snapshot: Dict):
+        pipe = self._redis.pipeline()
+        pipe.set(self._key("job", snapshot["job_id"]), json.dumps(snapshot, ensure_ascii=False), ex=int(JOB_RETENTION_SECONDS))
+        pipe.sadd(self._key("index"), snapshot["job_id"])
+        pipe.execute()
+
+    def load(self, job_id: str) -> Optional[Dict]:
+        raw = self._redis.get(self._key("job", job_id))
+        return json.loads(raw) if raw is not None else None
+
+    def jobs(self) -> List[Dict]:
+        snapshots = []
+        for job_id in self._redis.smembers(self._key("index")):
+            snapshot = self.load(job_id.decode("utf-8"))
+            if snapshot is None:
+                # 状态已过期
+                self._redis.srem(self._key("index"), job_id)
+            else:
+                snapshots.append(snapshot)
+        return snapshots
+
+    def delete(self, job_id: str):
+        self._redis.delete(self._key("job", job_id), self._key("control", job_id))
+        self._redis.srem(self._key("index"), job_id)
+
+    def set_control(self, job_id: str, command: str):
+        self._redis.set(self._key("control", job_id), command, ex=int(JOB_RETENTION_SECONDS))
+
+    def control(self, job_id: str) -> Optional[str]:
+        raw = self._redis.get(self._key("control", job_id))
+        return raw.decode("utf-8") if raw is not None else None
+
+    def wait(self, timeout: float):
+        time.sleep(timeout)
+
+    def try_acquire(self, token: str) -> bool:
+        now = time.time()
+        return bool(self._acquire(
+            keys=[self._key("slots")],
+            args=[now, self.max_concurrency, now + JOB_LEASE_SECONDS, token]
+        ))
+
+    def release(self, token: str):
+        self._redis.zrem(self._key("slots"), token)
+
+    def in_use(self) -> int:
+        return self._redis.zcount(self._key("slots"), time.time(), "+inf")
+
+def create_store(url: str, max_concurrency: int = JOB_MAX_CONCURRENCY):
+    """根据URL创建任务存储：memory 或 redis://..."""
+    if url.startswith("redis://") or url.startswith("rediss://"):
+        return RedisJobStore(url, max_concurrency)
+    if url == "memory":
+        return MemoryJobStore(max_concurrency)
+    raise ValueError(f"不支持的任务存储地址: {url}")
+
+class Job:
+    """一次后台批量执行：执行运行记录中还未完成的题目，每完成一题写入运行记录并更新进度"""
+
+    def __init__(
+        self,
+        run: RunStore,
+        store,
+        execute_fn: Callable[[str], Dict],
+        log_entry: Callable[[Dict, Dict, Dict], Dict],
+        max_workers: int = 4,
+        keep_group_order: bool = True
+    ):
+        self.job_id = uuid.uuid4().hex[:12]
+        self.run = run
+        self.store = store
+        self.execute_fn = execute_fn
+        self.log_entry = log_entry
+        self.max_workers = max_workers
+        self.keep_group_order = keep_group_order
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._state = {
+            "job_id": self.job_id,
+            "run_id": run.run_id,
+            "status": QUEUED,
+            "total": run.total,
+            "finished": run.finished,
+            "processed": 0,
+            "errors": 0,
+            "current_group": "",
+            "current_question": "",
+            "created": time.time(),
+            "updated": time.time(),
+            "error": None
+        }
+        self._publish()
+
+    def _publish(self, **changes):
+        # 在锁内保存，工作线程和任务线程并发发布时不会被较旧的快照覆盖
+        with self._lock:
+            self._state.update(changes, updated=time.time())
+            self.store.save(dict(self._state))
+
+    @property
+    def status(self) -> str:
+        return self._state["status"]
+
+    def cancelled(self) -> bool:
+        return self.store.control(self.job_id) == CANCEL
+
+    def _wait_resumed(self) -> bool:
+        """暂停时阻塞到继续或取消，返回False表示已取消"""
+        while True:
+            command = self.store.control(self.job_id)
+            if command == CANCEL:
+                return False
+            if command != PAUSE:
+                if self.status == PAUSED:
+                    self._publish(status=RUNNING)
+                return True
+            if self.status != PAUSED:
+                self._publish(status=PAUSED)
+            self.store.wait(JOB_POLL_SECONDS)
+
+    @contextmanager
+    def slot(self) -> Iterator[bool]:
+        """题目开始前的检查点：暂停时在这里等待，然后占用一份全局并发额度，题目执行完归还"""
+        token = None
+        while self._wait_resumed():
+            token = f"{self.job_id}:{uuid.uuid4().hex[:8]}"
+            if self.store.try_acquire(token):
+                break
+            token = None
+            self.store.wait(JOB_POLL_SECONDS)
+        try:
+            yield token is not None
+        finally:
+            if token is not None:
+                self.store.release(token)
+
+    def _on_result(self, group: Dict, question: Dict, result: Dict):
+        self.run.record(group, question, result, self.log_entry(group, question, result))
+        with self._lock:
+            processed = self._state["processed"] + 1
+            errors = self._state["errors"] + (result["status"] != "completed")
+            finished = self._state["finished"] + (result["status"] == "completed")
+        self._publish(
+            processed=processed,
+            errors=errors,
+            finished=finished,
+            current_group=group["tid"],
+            current_question=question["question"]
+        )
+
+    def _heartbeat(self, stop: threading.Event):
+        """一道题可能执行很久，定期刷新更新时间，其他实例据此判断任务是否还活着"""
+        while not stop.wait(JOB_HEARTBEAT_SECONDS):
+            self._publish()
+
+    def execute(self):
+        """在任务线程中执行到完成、取消或出错"""
+        stop = threading.Event()
+        threading.Thread(target=self._heartbeat, args=(stop,), name=f"job-{self.job_id}-heartbeat", daemon=True).start()
+        try:
+            self._execute()
+        finally:
+            stop.set()
+
+    def _execute(self):
+        self._publish(status=PAUSED if self.store.control(self.job_id) == PAUSE else RUNNING)
+        executor = BatchExecutor(
+            self.execute_fn,
+            max_workers=self.max_workers,
+            keep_group_order=self.keep_group_order
+        )
+        try:
+            executor.run(
+                self.run.pending(),
+                on_result=self._on_result,
+                should_stop=self.cancelled,
+                gate=self.slot
+            )
+        except Exception as e:
+            self.logger.error(f"Job {self.job_id} failed: {str(e)}")
+            self._publish(status=FAILED, error=str(e))
+            return
+        self._publish(status=CANCELLED if self.cancelled() else COMPLETED)
+
+class JobRunner:
+    """批量执行的后台任务池
+
+    每个任务在独立的线程中调度，脚本线程提交后立即返回，界面按任务ID轮询进度快照；
+    所有任务的题目共享同一份全局并发额度（JOB_MAX_CONCURRENCY），多个用户的运行按题目交替执行，
+    而不是各自占满自己的并发数。暂停和取消在每道题开始前生效，已经开始的题目执行完成后写入运行记录。
+    """
+
+    def __init__(self, store=None):
+        self.store = store or MemoryJobStore()
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, Job] = {}
+        self.logger = logging.getLogger(__name__)
+
+    def submit(
+        self,
+        run: RunStore,
+        execute_fn: Callable[[str], Dict],
+        log_entry: Callable[[Dict, Dict, Dict], Dict],
+        max_workers: int = 4,
+        keep_group_order: bool = True
+    ) -> str:
+        """提交一次运行的后台执行，返回任务ID；同一运行已有未结束的任务时返回该任务
+        Args:
+            execute_fn: 执行单个问题，在没有streamlit脚本上下文的工作线程中调用
+            log_entry: (组, 题目, 结果) -> 写入运行记录的执行日志条目
+        """
+        with self._lock:
+            self._prune()
+            active = self._active(run.run_id)
+            if active is not None:
+                return active.job_id
+            job = Job(run, self.store, execute_fn, log_entry, max_workers, keep_group_order)
+            self._jobs[job.job_id] = job
+        threading.Thread(target=job.execute, name=f"job-{job.job_id}", daemon=True).start()
+        self.logger.info(f"Submitted job {job.job_id} for run {run.run_id}")
+        return job.job_id
+
+    def _active(self, run_id: str) -> Optional[Job]:
+        return next(
+            (job for job in self._jobs.values() if job.run.run_id == run_id and job.status not in FINISHED_STATUSES),
+            None
+        )
+
+    def _prune(self):
+        """清理已结束且超过保留时长的任务"""
+        deadline = time.time() - JOB_RETENTION_SECONDS
+        for job_id, job in list(self._jobs.items()):
+            if job.status in FINISHED_STATUSES and job._state["updated"] < deadline:
+                del self._jobs[job_id]
+                self.store.delete(job_id)
+
+    def find_active(self, run_id: str) -> Optional[str]:
+        """运行当前未结束的任务ID（包括其他实例上的任务），用于刷新页面后找回任务；心跳超时的任务不算"""
+        for snapshot in self.store.jobs():
+            snapshot = effective_snapshot(snapshot)
+            if snapshot["run_id"] == run_id and snapshot["status"] not in FINISHED_STATUSES:
+                return snapshot["job_id"]
+        return None
+
+    def run_store(self, job_id: str) -> Optional[RunStore]:
+        """本进程中任务正在写入的运行记录，界面读取同一个对象才能看到最新完成的题目"""
+        job = self._jobs.get(job_id)
+        return job.run if job is not None else None
+
+    def status(self, job_id: str) -> Optional[Dict]:
+        """任务的进度快照，只读取已发布的状态，可以频繁轮询"""
+        snapshot = self.store.load(job_id)
+        if snapshot is None:
+            return None
+        return dict(effective_snapshot(snapshot), control=self.store.control(job_id))
+
+    def pause(self, job_id: str):
+        self.store.set_control(job_id, PAUSE)
+
+    def resume(self, job_id: str):
+        self.store.set_control(job_id, RESUME)
+
+    def cancel(self, job_id: str):
+        self.store.set_control(job_id, CANCEL)
+
+    def jobs(self) -> List[Dict]:
+        snapshots = [effective_snapshot(snapshot) for snapshot in self.store.jobs()]
+        return sorted(snapshots, key=lambda snapshot: snapshot["created"], reverse=True)
+
+    def stats(self) -> Dict:
+        snapshots = [effective_snapshot(snapshot) for snapshot in self.store.jobs()]
+        return {
+            "max_concurrency": self.store.max_concurrency,
+            "in_use": self.store.in_use(),
+            "active": sum(snapshot["status"] not in FINISHED_STATUSES for snapshot in snapshots),
+            "jobs": len(snapshots)
+        }
+
+@lru_cache(maxsize=1)
+def get_job_runner() -> JobRunner:
+    """进程内共享的任务池，同一进程中所有会话的任务共用并发额度"""
+    return JobRunner(create_store(JOB_STORE_URL))
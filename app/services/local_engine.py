@@ -0,0 +1,344 @@
+import argparse
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+from datetime import date
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+from sqlglot import exp
+from sqlglot.errors import ParseError
+from .columnar import Columns
+from .result_cache import canonicalize_sql
+from .sql_validator import SQL_DIALECT, bind_params, parse_sql
+
+# 本地Parquet数据目录，设置 LOCAL_ENGINE=1 后已加载的表走本地嵌入式引擎执行
+LOCAL_ENGINE_DIR = os.getenv(
+    "LOCAL_ENGINE_DIR",
+    str(Path(__file__).parent.parent.parent / ".cache" / "parquet")
+)
+LOCAL_ENGINE_ENABLED = os.getenv("LOCAL_ENGINE", "0") == "1"
+
+# 按这些日期字段的年份分区，依次取表中第一个存在的字段
+PARTITION_COLUMNS = ("TradingDay", "EndDate")
+PARTITION_KEY = "part_year"
+MANIFEST_FILE = "manifest.json"
+
+# 日期字面量开头的年份，如 '2021-06-01'、'20210601'
+_YEAR = re.compile(r"^(\d{4})")
+# 字段在左侧时的比较运算，字段在右侧时取反向
+_COMPARISONS = {exp.EQ: "=", exp.GT: ">", exp.GTE: ">=", exp.LT: "<", exp.LTE: "<="}
+_FLIPPED = {"=": "=", ">": "<", ">=": "<=", "<": ">", "<=": ">="}
+
+class LocalEngine:
+    """基于DuckDB的本地列式执行引擎
+
+    每张表存为 <目录>/<库名>/<表名>/ 下的Parquet文件，含日期字段的表按年份做Hive分区。
+    执行时按每个查询块顶层 AND 连接的 WHERE 条件推出各表的日期范围，只读取命中年份的分区文件，
+    其余文件不打开；无法确定范围的表读取全部分区。
+    """
+
+    def __init__(self, root: str = LOCAL_ENGINE_DIR):
+        import duckdb
+
+        self.root = Path(root)
+        self._db = duckdb.connect()
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+        self.tables: Dict[str, Dict] = {}
+        self.reload()
+
+    def reload(self):
+        """扫描数据目录，为每张表注册视图"""
+        tables = {}
+        for manifest_path in self.root.glob(f"*/*/{MANIFEST_FILE}"):
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            tables[manifest["table"]] = dict(manifest, path=manifest_path.parent)
+        with self._lock:
+            for name, manifest in tables.items():
+                if "." in name:
+                    self._db.execute(f'CREATE SCHEMA IF NOT EXISTS "{name.split(".")[0]}"')
+                self._db.execute(f"CREATE OR REPLACE VIEW {name} AS SELECT * FROM {self._scan(manifest)}")
+            self.tables = tables
+        self.logger.info(f"Local engine loaded {len(tables)} tables from {self.root}")
+
+    def covers(self, sql: str) -> bool:
+        """SQL涉及的表是否都已在本地加载"""
+        _, tables = canonicalize_sql(sql)
+        return bool(tables) and all(table in self.tables for table in tables)
+
+    def _scan(self, manifest: Dict, years: Optional[Set[int]] = None) -> str:
+        """生成读取表数据的 read_parquet 表达式，years 不为None时只读取这些年份的分区"""
+        path = manifest["path"]
+        if manifest.get("partition_column") is None:
+            files = [str(path / "data.parquet")]
+        elif years is None:
+            files = [str(path / "**" / "*.parquet")]
+        else:
+            files = [
+                str(path / f"{PARTITION_KEY}={year}" / "*.parquet")
+                for year in sorted(years) if year in manifest["years"]
+            ]
+            if not files:
+                # 没有命中的分区：保留表结构，返回空结果
+                return f"(SELECT * FROM read_parquet('{path / '**' / '*.parquet'}', hive_partitioning = true) LIMIT 0)"
+        file_list = ", ".join(f"'{file}'" for file in files)
+        return f"read_parquet([{file_list}], hive_partitioning = true)"
+
+    def _year_range(self, select: exp.Select, alias: str, column: str, single: bool,
+                    params: Dict[str, Any]) -> Optional[Tuple[int, int]]:
+        """由查询块顶层 AND 连接的 WHERE 条件推出表的年份范围，没有可用条件时返回None
+
+        只使用限定为该表别名的字段（查询块只有一张表时也接受不带别名的字段），
+        OR、NOT、CASE、子查询中的条件都不参与裁剪。
+        """
+        where = select.args.get("where")
+        if where is None:
+            return None
+
+        def is_column(node) -> bool:
+            if not isinstance(node, exp.Column) or node.name.lower() != column:
+                return False
+            return node.table.lower() == alias if node.table else single
+
+        def year(node) -> Optional[int]:
+            if isinstance(node, exp.Placeholder):
+                value = params.get(node.name)
+            elif isinstance(node, exp.Literal) and node.is_string:
+                value = node.this
+            else:
+                return None
+            match = _YEAR.match(str(value)) if isinstance(value, (str, date)) else None
+            return int(match.group(1)) if match else None
+
+        low, high, found = 0, 9999, False
+        for condition in where.this.flatten() if isinstance(where.this, exp.And) else [where.this]:
+            if isinstance(condition, exp.Between) and is_column(condition.this):
+                low_year, high_year = year(condition.args.get("low")), year(condition.args.get("high"))
+                if low_year is not None and high_year is not None:
+                    low, high, found = max(low, low_year), min(high, high_year), True
+                continue
+            op = _COMPARISONS.get(type(condition))
+            if op is None:
+                continue
+            if is_column(condition.this):
+                value = year(condition.expression)
+            elif is_column(condition.expression):
+                op, value = _FLIPPED[op], year(condition.this)
+            else:
+                continue
+            if value is None:
+                continue
+            if op in (">=", ">", "="):
+                low = max(low, value)
+            if op in ("<=", "<", "="):
+                high = min(high, value)
+            found = True
+        return (low, high) if found else None
+
+    def prune(self, sql: str, params: Optional[Dict[str, Any]] = None) -> str:
+        """把有日期范围条件的表引用替换为只读取命中分区的扫描，参数化的SQL按参数值提取范围"""
+        if not any(manifest.get("partition_column") for manifest in self.tables.values()):
+            return sql
+        try:
+            tree = parse_sql(sql)
+        except ParseError:
+            return sql
+        scans: Dict[str, str] = {}
+        for select in list(tree.find_all(exp.Select)):
+            # 只看该查询块自己 FROM/JOIN 的基表，子查询和CTE各自按所在查询块的条件处理
+            sources = [select.args.get("from")] + list(select.args.get("joins") or [])
+            tables = [source.this for source in sources if source is not None and isinstance(source.this, exp.Table)]
+            single = len(sources) == 1 and len(tables) == 1
+            for table in tables:
+                name = f"{table.db}.{table.name}".lower() if table.db else table.name.lower()
+                manifest = self.tables.get(name)
+                column = manifest and manifest.get("partition_column")
+                if not column:
+                    continue
+                year_range = self._year_range(select, table.alias_or_name.lower(), column.lower(), single, params or {})
+                if year_range is None:
+                    continue
+                years = set(range(year_range[0], year_range[1] + 1)) if year_range[0] <= year_range[1] else set()
+                marker = f"__pruned_scan_{len(scans)}__"
+                scans[marker] = self._scan(manifest, years)
+                # 保留原别名（没有别名时用表名），字段上的限定名仍然有效
+                table.replace(exp.Table(
+                    this=exp.to_identifier(marker), alias=exp.TableAlias(this=exp.to_identifier(table.alias_or_name))
+                ))
+        if not scans:
+            return sql
+        sql = tree.sql(dialect=SQL_DIALECT)
+        for marker, scan in scans.items():
+            sql = sql.replace(marker, scan, 1)
+        return sql
+
+    def execute(self, sql: str, columnar: bool = False, params: Optional[Dict[str, Any]] = None):
+        """执行查询，返回行元组列表或 {列名: 数组}；params 为 :name 占位符的参数"""
+        cursor = self._db.cursor()
+        try:
+            if params:
+                cursor.execute(*bind_params(self.prune(sql, params), params, "qmark"))
+            else:
+                cursor.execute(self.prune(sql))
+            if columnar:
+                return {name: _unmask(values) for name, values in cursor.fetchnumpy().items()}
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+
+def _unmask(values):
+    """DuckDB对含NULL的列返回MaskedArray，数值列填充NaN，其余列转为None"""
+    import numpy as np
+
+    if not isinstance(values, np.ma.MaskedArray):
+        return values
+    if values.dtype.kind in "fiu":
+        return values.astype(np.float64).filled(np.nan)
+    result = values.data.astype(object)
+    result[values.mask] = None
+    return result
+
+def _record_batches(batches: Iterator[Columns], partition_column: Optional[str]):
+    """把列式批次转为Arrow批次，按需追加分区年份列"""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    schema = None
+    for columns in batches:
+        table = pa.table(columns)
+        if partition_column is not None:
+            dates = table.column(partition_column)
+            if pa.types.is_string(dates.type):
+                dates = pc.strptime(
+                    pc.utf8_slice_codeunits(dates, 0, 10), format="%Y-%m-%d", unit="s", error_is_null=True
+                )
+            table = table.append_column(PARTITION_KEY, pc.year(dates))
+        if schema is None:
+            # 第一批中全为NULL的列无法推断类型，按字符串处理
+            schema = pa.schema([
+                field.with_type(pa.string()) if pa.types.is_null(field.type) else field
+                for field in table.schema
+            ])
+        yield from table.cast(schema).to_batches()
+
+def load_table(connection, table: str, root: str = LOCAL_ENGINE_DIR, batch_size: int = 50000) -> Dict:
+    """从数据库流式读取整张表，写为按年份分区的Parquet文件"""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+    from .sql_service import SQLService
+
+    table = table.lower()
+    # 不带库名的表（如SQLite）放在 main 目录下
+    target = Path(root) / Path(*(table.split(".") if "." in table else ["main", table]))
+    if target.exists():
+        shutil.rmtree(target)
+    target.mkdir(parents=True)
+
+    stream = SQLService(connection).execute_sql_stream(f"SELECT * FROM {table}", batch_size, columnar=True)
+    header = next(stream)
+    if "error" in header:
+        raise RuntimeError(header["error"])
+    names = {name.lower(): name for name in header["columns"]}
+    partition_column = next((names[c.lower()] for c in PARTITION_COLUMNS if c.lower() in names), None)
+
+    row_count = 0
+    def batches():
+        nonlocal row_count
+        for item in stream:
+            if "error" in item:
+                raise RuntimeError(item["error"])
+            if "batch" in item:
+                row_count += len(next(iter(item["batch"].values()), ()))
+                yield item["batch"]
+
+    record_batches = _record_batches(batches(), partition_column)
+    first = next(record_batches, None)
+    years: List[int] = []
+    if first is not None:
+        def all_batches():
+            yield first
+            yield from record_batches
+        if partition_column is None:
+            with pq.ParquetWriter(target / "data.parquet", first.schema) as writer:
+                for batch in all_batches():
+                    writer.write_batch(batch)
+        else:
+            # 每个年份一个写入器，年份列只体现在目录名上；日期为空的行归入0年分区
+            schema = first.schema.remove(first.schema.get_field_index(PARTITION_KEY))
+            writers = {}
+            try:
+                for batch in all_batches():
+                    part_years = batch.column(PARTITION_KEY).fill_null(0)
+                    data = pa.Table.from_batches([batch]).drop_columns([PARTITION_KEY])
+                    for year in pc.unique(part_years).to_pylist():
+                        if year not in writers:
+                            directory = target / f"{PARTITION_KEY}={year}"
+                            directory.mkdir()
+                            writers[year] = pq.ParquetWriter(directory / "part-0.parquet", schema)
+                        writers[year].write_table(data.filter(pc.equal(part_years, year)))
+            finally:
+                for writer in writers.values():
+                    writer.close()
+            years = sorted(writers)
+
+    manifest = {
+        "table": table,
+        "partition_column": partition_column if first is not None else None,
+        "years": years,
+        "rows": row_count
+    }
+    if first is None:
+        # 空表也写一个带列名的文件，保证视图可以创建
+        pq.write_table(pa.table({name: pa.array([], pa.string()) for name in header["columns"]}), target / "data.parquet")
+    with open(target / MANIFEST_FILE, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+@lru_cache(maxsize=1)
+def get_local_engine() -> Optional[LocalEngine]:
+    """进程内共享的本地引擎，未开启或未安装duckdb时返回None"""
+    if not LOCAL_ENGINE_ENABLED:
+        return None
+    try:
+        return LocalEngine()
+    except ImportError:
+        logging.getLogger(__name__).warning("LOCAL_ENGINE=1 but duckdb is not installed")
+        return None
+
+def main():
+    """把数据库中的表导出为本地Parquet数据
+
+    用法: python -m app.services.local_engine constantdb.secumain astockmarketquotesdb.qt_dailyquote
+          python -m app.services.local_engine --all
+    """
+    parser = argparse.ArgumentParser(description="Load finance tables into partitioned Parquet files")
+    parser.add_argument("tables", nargs="*", help="库名.表名")
+    parser.add_argument("--all", action="store_true", help="加载表结构目录中的所有表")
+    parser.add_argument("--root", default=LOCAL_ENGINE_DIR)
+    parser.add_argument("--batch-size", type=int, default=50000)
+    args = parser.parse_args()
+
+    from app.models.database import engine
+    from .schema_catalog import get_schema_catalog
+
+    connection = engine.raw_connection()
+    try:
+        tables = args.tables
+        if args.all:
+            catalog = get_schema_catalog()
+            catalog.refresh(connection, force=True)
+            tables = sorted(catalog.tables)
+        for table in tables:
+            manifest = load_table(connection, table, args.root, args.batch_size)
+            print(f"{table}: {manifest['rows']} rows, partitions={manifest['years'] or '-'}")
+    finally:
+        connection.close()
+
+if __name__ == "__main__":
+    main()
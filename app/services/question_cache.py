@@ -0,0 +1,313 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import defaultdict
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional, Set, Tuple
+
+# 缓存配置，可通过环境变量调整
+QUESTION_CACHE_URL = os.getenv(
+    "QUESTION_CACHE_URL",
+    "sqlite:///" + str(Path(__file__).parent.parent.parent / ".cache" / "question_cache.sqlite3")
+)
+QUESTION_CACHE_TTL = float(os.getenv("QUESTION_CACHE_TTL", str(7 * 24 * 3600)))
+QUESTION_CACHE_MAX_ENTRIES = int(os.getenv("QUESTION_CACHE_MAX_ENTRIES", "100000"))
+# 近似问题命中的相似度阈值（字二元组Jaccard），0表示只做精确匹配
+QUESTION_CACHE_SIMILARITY = float(os.getenv("QUESTION_CACHE_SIMILARITY", "0"))
+
+# 空白和标点，数字中的小数点和数字前的负号除外，1.5 与 15、-5% 与 5% 不会归一化成同一个问题
+_PUNCTUATION = re.compile(r"(?:(?!(?<=\d)\.(?=\d)|(?<!\d)-(?=\d))[\s\W_])+", re.UNICODE)
+_NUMBERS = re.compile(r"(?:(?<!\d)-)?\d+(?:\.\d+)?")
+
+def normalize_question(question: str) -> str:
+    """归一化问题文本：全半角统一、小写、去除空白和标点（保留数字的小数点和负号）"""
+    text = unicodedata.normalize("NFKC", question).lower()
+    return _PUNCTUATION.sub("", text)
+
+def _bigrams(text: str) -> Set[str]:
+    if len(text) < 2:
+        return {text}
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+class SQLiteCacheBackend:
+    """基于SQLite的磁盘缓存，按最近访问时间做LRU淘汰"""
+
+    def __init__(self, path: str):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS question_cache (
+                stage TEXT NOT NULL,
+                cache_key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                elapsed REAL NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                PRIMARY KEY (stage, cache_key)
+            )
+        """)
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_question_cache_accessed ON question_cache (accessed_at)"
+        )
+        self._conn.commit()
+
+    def get(self, stage: str, key: str, ttl: float) -> Optional[Tuple[Any, float]]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, elapsed, created_at FROM question_cache WHERE stage = ? AND cache_key = ?",
+                (stage, key)
+            ).fetchone()
+            if row is None:
+                return None
+            if now - row[2] > ttl:
+                self._conn.execute(
+                    "DELETE FROM question_cache WHERE stage = ? AND cache_key = ?", (stage, key)
+                )
+                self._conn.commit()
+                return None
+            self._conn.execute(
+                "UPDATE question_cache SET accessed_at = ? WHERE stage = ? AND cache_key = ?",
+                (now, stage, key)
+            )
+            self._conn.commit()
+        return json.loads(row[0]), row[1]
+
+    def set(self, stage: str, key: str, value: Any, elapsed: float, ttl: float, max_entries: int):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO question_cache VALUES (?, ?, ?, ?, ?, ?)",
+                (stage, key, json.dumps(value, ensure_ascii=False), elapsed, now, now)
+            )
+            # 超出容量时淘汰最久未访问的条目
+            count = self._conn.execute("SELECT COUNT(*) FROM question_cache").fetchone()[0]
+            if count > max_entries:
+                self._conn.execute(
+                    """DELETE FROM question_cache WHERE rowid IN (
+                        SELECT rowid FROM question_cache ORDER BY accessed_at LIMIT ?
+                    )""",
+                    (count - max_entries,)
+                )
+            self._conn.commit()
+
+    def keys(self, stage: str) -> Iterable[str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT cache_key FROM question_cache WHERE stage = ?", (stage,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM question_cache")
+            self._conn.commit()
+
+class RedisCacheBackend:
+    """基于Redis的缓存（docker-compose中的redis服务）
+
+    过期交给Redis的EXPIRE；所有条目另记在一个按最近访问时间排序的有序集合中，
+    超出容量时按它淘汰最久未访问的条目，已过期的条目在读取和列举时从集合中移除。
+    """
+
+    def __init__(self, url: str, prefix: str = "qcache"):
+        import redis
+        self._redis = redis.Redis.from_url(url)
+        self._prefix = prefix
+        self._lru = f"{prefix}:lru"
+
+    def _key(self, stage: str, key: str) -> str:
+        return f"{self._prefix}:{stage}:{key}"
+
+    def get(self, stage: str, key: str, ttl: float) -> Optional[Tuple[Any, float]]:
+        raw = self._redis.get(self._key(stage, key))
+        if raw is None:
+            self._redis.zrem(self._lru, f"{stage}:{key}")
+            return None
+        self._redis.zadd(self._lru, {f"{stage}:{key}": time.time()})
+        entry = json.loads(raw)
+        return entry["value"], entry["elapsed"]
+
+    def set(self, stage: str, key: str, value: Any, elapsed: float, ttl: float, max_entries: int):
+        payload = json.dumps({"value": value, "elapsed": elapsed}, ensure_ascii=False)
+        pipe = self._redis.pipeline()
+        pipe.set(self._key(stage, key), payload, ex=int(ttl))
+        pipe.zadd(self._lru, {f"{stage}:{key}": time.time()})
+        pipe.zcard(self._lru)
+        count = pipe.execute()[-1]
+        # 超出容量时淘汰最久未访问的条目
+        if count > max_entries:
+            evicted = [member.decode("utf-8") for member in self._redis.zrange(self._lru, 0, count - max_entries - 1)]
+            if evicted:
+                pipe = self._redis.pipeline()
+                pipe.delete(*(f"{self._prefix}:{member}" for member in evicted))
+                pipe.zrem(self._lru, *evicted)
+                pipe.execute()
+
+    def keys(self, stage: str) -> Iterable[str]:
+        members = [member.decode("utf-8") for member, _ in self._redis.zscan_iter(self._lru, match=f"{stage}:*")]
+        if not members:
+            return []
+        pipe = self._redis.pipeline()
+        for member in members:
+            pipe.exists(f"{self._prefix}:{member}")
+        alive = pipe.execute()
+        expired = [member for member, exists in zip(members, alive) if not exists]
+        if expired:
+            self._redis.zrem(self._lru, *expired)
+        return [member.split(":", 1)[1] for member, exists in zip(members, alive) if exists]
+
+    def clear(self):
+        for key in self._redis.scan_iter(f"{self._prefix}:*"):
+            self._redis.delete(key)
+
+class QuestionCache:
+    """问题流水线缓存
+
+    按阶段缓存选表结果和生成的SQL（字段信息由后端的表结构目录提供，不在这里缓存）。问题类阶段先按归一化文本精确匹配，
+    开启相似度阈值后再在字二元组倒排索引上查找近似问题：数字必须完全一致（避免跨年份误命中），
+    实体索引解析出的公司/证券也必须一致（避免“平安银行”命中“招商银行”的问题）。
+    variant 区分同一问题在不同上下文下的结果（如生成SQL时的表和字段），近似匹配时也必须一致。
+    """
+
+    QUESTION_STAGES = ("analyze_tables", "generate_sql")
+
+    def __init__(
+        self,
+        backend,
+        ttl: float = QUESTION_CACHE_TTL,
+        max_entries: int = QUESTION_CACHE_MAX_ENTRIES,
+        similarity: float = QUESTION_CACHE_SIMILARITY,
+        entity_index=None
+    ):
+        self.backend = backend
+        self.entity_index = entity_index
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.similarity = similarity
+        self._lock = threading.Lock()
+        self._stats = defaultdict(float)
+        # 近似匹配索引：stage -> 二元组 -> 问题key集合
+        self._index: Dict[str, Dict[str, Set[str]]] = {}
+        if similarity > 0:
+            for stage in self.QUESTION_STAGES:
+                for key in backend.keys(stage):
+                    self._add_to_index(stage, key)
+
+    def _add_to_index(self, stage: str, key: str):
+        index = self._index.setdefault(stage, defaultdict(set))
+        for gram in _bigrams(key.split("#", 1)[0]):
+            index[gram].add(key)
+
+    def _entities(self, text: str) -> Tuple:
+        """问题中提及的公司/证券，没有实体索引时为空"""
+        if self.entity_index is None:
+            return ()
+        return tuple(sorted({
+            str(mention.get("InnerCode") or mention.get("CompanyCode"))
+            for mention in self.entity_index.resolve(text)
+        }))
+
+    def _find_similar(self, stage: str, key: str) -> Optional[str]:
+        index = self._index.get(stage)
+        if not index:
+            return None
+        question, _, variant = key.partition("#")
+        grams = _bigrams(question)
+        numbers = _NUMBERS.findall(question)
+        overlap = defaultdict(int)
+        for gram in grams:
+            for candidate in index.get(gram, ()):
+                overlap[candidate] += 1
+        scores = {
+            candidate: shared / len(grams | _bigrams(candidate.split("#", 1)[0]))
+            for candidate, shared in overlap.items()
+        }
+        entities = None
+        for candidate in sorted(scores, key=scores.get, reverse=True):
+            if scores[candidate] < self.similarity:
+                break
+            candidate_question, _, candidate_variant = candidate.partition("#")
+            if candidate_variant != variant or _NUMBERS.findall(candidate_question) != numbers:
+                continue
+            if entities is None:
+                entities = self._entities(question)
+            if self._entities(candidate_question) == entities:
+                return candidate
+        return None
+
+    @staticmethod
+    def make_key(stage: str, value: Any, variant: str = "") -> str:
+        """问题类阶段用归一化问题做key，字段阶段用排序后的表名；variant 以 # 分隔附在后面"""
+        if isinstance(value, (list, tuple)):
+            key = ",".join(sorted(table.lower() for table in value))
+        else:
+            key = normalize_question(value)
+        return f"{key}#{variant}" if variant else key
+
+    def get(self, stage: str, value: Any, variant: str = "") -> Optional[Any]:
+        """查找缓存，未命中返回None"""
+        key = self.make_key(stage, value, variant)
+        entry = self.backend.get(stage, key, self.ttl)
+        hit_type = "hits"
+        if entry is None and self.similarity > 0 and stage in self.QUESTION_STAGES:
+            similar = self._find_similar(stage, key)
+            if similar:
+                entry = self.backend.get(stage, similar, self.ttl)
+                hit_type = "near_hits"
+        with self._lock:
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            self._stats[hit_type] += 1
+            self._stats["saved_seconds"] += entry[1]
+        return entry[0]
+
+    def put(self, stage: str, value: Any, result: Any, elapsed: float, variant: str = ""):
+        """写入缓存，elapsed 是本次计算耗时，命中时计入节省的时间"""
+        key = self.make_key(stage, value, variant)
+        self.backend.set(stage, key, result, elapsed, self.ttl, self.max_entries)
+        if self.similarity > 0 and stage in self.QUESTION_STAGES:
+            with self._lock:
+                self._add_to_index(stage, key)
+
+    def stats(self) -> Dict:
+        """命中率与节省的时间"""
+        with self._lock:
+            hits = self._stats["hits"] + self._stats["near_hits"]
+            lookups = hits + self._stats["misses"]
+            return {
+                "hits": int(self._stats["hits"]),
+                "near_hits": int(self._stats["near_hits"]),
+                "misses": int(self._stats["misses"]),
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "saved_seconds": self._stats["saved_seconds"]
+            }
+
+    def clear(self):
+        self.backend.clear()
+        with self._lock:
+            self._index.clear()
+            self._stats.clear()
+
+def create_backend(url: str):
+    """根据URL创建缓存后端：sqlite:///路径 或 redis://..."""
+    if url.startswith("redis://") or url.startswith("rediss://"):
+        return RedisCacheBackend(url)
+    if url.startswith("sqlite:///"):
+        return SQLiteCacheBackend(url[len("sqlite:///"):])
+    raise ValueError(f"不支持的缓存地址: {url}")
+
+@lru_cache(maxsize=1)
+def get_question_cache() -> QuestionCache:
+    """进程内共享的问题缓存"""
+    from .entity_index import get_entity_index
+
+    return QuestionCache(create_backend(QUESTION_CACHE_URL), entity_index=get_entity_index())
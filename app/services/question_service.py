@@ -1,13 +1,47 @@
-from utils.api_client import call_api
-from typing import List, Dict
+from utils.api_client import DebugPanel, call_api, call_api_async, stream_api, stream_api_async
+from typing import Any, AsyncIterator, Callable, List, Dict, Optional
+import hashlib
 import json
+import time
 from pathlib import Path
-import streamlit as st
+from .table_router import get_table_router, TABLE_ROUTER_MIN_CONFIDENCE
+from .token_accounting import estimate_tokens, get_token_ledger
+from .question_cache import get_question_cache
+from .result_cache import get_result_cache
+from .schema_catalog import get_schema_catalog
+from .sql_validator import extract_sql, get_sql_validator
+from .sql_optimizer import get_sql_optimizer
+from .sql_repair import get_sql_repairer
+from .entity_index import EntityIndex, get_entity_index
+from .question_templates import get_template_registry
+from utils.rate_limiter import deadline
+from .tracing import describe_result, traced
+
+def _describe_repair(repair: Dict) -> Dict:
+    """修复循环的span属性：重试次数和最终执行结果"""
+    return dict(describe_result(repair["result"]), retries=len(repair["attempts"]))
 
 class QuestionService:
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, base_url: Optional[str] = None, model: Optional[str] = None):
+        """
+        Args:
+            base_url/model: 不指定时取streamlit会话中的设置；在后台任务线程中使用时必须指定
+        """
         self.api_key = api_key
+        self.base_url = base_url
+        self.model = model
         self.table_descriptions = self._load_table_metadata()
+        self.table_router = get_table_router()
+        self.token_ledger = get_token_ledger()
+        self.cache = get_question_cache()
+        self.result_cache = get_result_cache()
+        self.sql_validator = get_sql_validator()
+        self.sql_optimizer = get_sql_optimizer()
+        self.sql_repairer = get_sql_repairer()
+        self.entity_index = get_entity_index()
+        self.template_registry = get_template_registry()
+        # 本实例生成过的SQL：问题 -> (SQL, 生成耗时)，命中缓存时耗时为None；执行成功后才写入缓存
+        self._generated: Dict[str, tuple] = {}
         
     def _load_table_metadata(self) -> dict:
         """加载表的元数据信息"""
@@ -19,39 +53,112 @@ class QuestionService:
                 for table_name, meta in metadata["tables"].items()
             }
         
+    def _call_api(self, endpoint: str, params: Dict):
+        return call_api(endpoint, params, self.api_key, self.base_url, self.model)
+
+    def _template_match(self, question: str) -> Optional[Dict]:
+        """匹配参数化模板，命中时整个选表提示词都被省掉"""
+        match = self.template_registry.match(question)
+        if match is not None:
+            baseline = estimate_tokens(self._generate_table_analysis_prompt(question))
+            self.token_ledger.record(question, "analyze_tables", 0, baseline)
+        return match
+
+    def _template_answer(self, match: Dict, result: Dict) -> Optional[Dict]:
+        """模板执行结果，执行失败时记为回退并返回None"""
+        if not isinstance(result, dict) or result.get("status") != "success":
+            self.template_registry.record_fallback(match["template"])
+            return None
+        return dict(
+            match,
+            result=result,
+            answer=self.template_registry.render_answer(match, result.get("data"))
+        )
+
+    @traced("answer_from_template", lambda match: {"hit": match is not None})
+    def answer_from_template(self, question: str) -> Optional[Dict]:
+        """模板快速路径：问题命中参数化模板时一次数据库查询直接作答
+        Returns:
+            {"template", "sql", "params", "slots", "result", "answer", ...}，未命中或执行失败时返回None，
+            调用方回退到四步模型流程
+        """
+        match = self._template_match(question)
+        if match is None:
+            return None
+        return self._template_answer(match, self.execute_sql(match["sql"], match["params"]))
+
+    @traced("analyze_tables", lambda tables: {"tables": len(tables)})
     def analyze_tables(self, question: str) -> List[str]:
         """分析问题需要用到的表"""
         # 添加调试信息展示区
-        debug_container = st.expander("Question Analysis Debug", expanded=False)
-        
-        prompt = self._generate_table_analysis_prompt(question)
-        with debug_container:
-            st.write(f"Generated prompt: {prompt}")
-            
-            params = {
-                "prompt": prompt,
-                "question": question
-            }
-            st.write(f"Calling API with params: {params}")
-            
-            response = call_api(
-                "analyze_tables",
-                params,
-                self.api_key
-            )
-            st.write(f"API response: {response}")
-            
-            tables = response.get("tables", [])
-            st.write(f"Extracted tables: {tables}")
+        debug = DebugPanel("Question Analysis Debug")
+
+        # 优先使用本地路由索引，置信度不足时才调用LLM
+        routing = self._route_locally(question)
+        if routing["confidence"] >= TABLE_ROUTER_MIN_CONFIDENCE:
+            debug.write(f"Routed locally: {routing['tables']} (confidence {routing['confidence']:.2f})")
+            return routing["tables"]
+
+        cached = self.cache.get("analyze_tables", question)
+        if cached is not None:
+            debug.write(f"Cache hit: {cached}")
+            return cached
         
+        start = time.perf_counter()
+        candidates = self.table_router.candidates(question, routing["confidence"])
+        prompt = self._generate_table_analysis_prompt(question, candidates)
+        debug.write(f"Generated prompt: {prompt}")
+
+        params = {
+            "prompt": prompt,
+            "question": question
+        }
+        debug.write(f"Calling API with params: {params}")
+
+        response = self._call_api("analyze_tables", params)
+        debug.write(f"API response: {response}")
+        self._record_prompt_tokens(question, prompt, response)
+
+        tables = response.get("tables", [])
+        debug.write(f"Extracted tables: {tables}")
+
+        if tables:
+            self.cache.put("analyze_tables", question, tables, time.perf_counter() - start)
         return tables
     
-    def _generate_table_analysis_prompt(self, question: str) -> str:
-        """生成用于分析表的prompt"""
+    def _route_locally(self, question: str) -> Dict:
+        """本地路由选表，命中时整个表分析提示词都被省掉"""
+        routing = self.table_router.route(question)
+        if routing["confidence"] >= TABLE_ROUTER_MIN_CONFIDENCE:
+            baseline = estimate_tokens(self._generate_table_analysis_prompt(question))
+            self.token_ledger.record(question, "analyze_tables", 0, baseline)
+        return routing
+
+    def _record_prompt_tokens(self, question: str, prompt: str, response: Dict):
+        """记录裁剪后的表分析提示词用量，以及全量表描述时的用量"""
+        estimated = estimate_tokens(prompt)
+        baseline = estimate_tokens(self._generate_table_analysis_prompt(question))
+        usage = response.get("usage") or {}
+        prompt_tokens = usage.get("prompt_tokens") or estimated
+        # 有实际用量时按估算比例换算全量提示词的用量
+        self.token_ledger.record(
+            question,
+            "analyze_tables",
+            prompt_tokens,
+            round(baseline * prompt_tokens / estimated),
+            usage.get("completion_tokens") or 0
+        )
+
+    def _generate_table_analysis_prompt(self, question: str, tables: Optional[List[str]] = None) -> str:
+        """生成用于分析表的prompt
+        Args:
+            question: 问题
+            tables: 候选表，为空时使用全部表
+        """
         # 构建表描述文本
         table_descriptions = "\n".join([
-            f"- {table}: {desc}"
-            for table, desc in self.table_descriptions.items()
+            f"- {table}: {self.table_descriptions[table]}"
+            for table in (tables or self.table_descriptions)
         ])
         
         return f"""作为一个金融数据分析助手，请帮我分析以下问题需要用到哪些数据表：
@@ -70,30 +177,312 @@ class QuestionService:
 3. 如果问题信息不足，返回空列表 []
 """
     
+    @traced("get_fields")
     def get_fields(self, tables: List[str]) -> Dict:
-        """获取表字段信息"""
-        return call_api(
-            "get_fields",
-            {"tables": tables},
-            self.api_key
+        """获取表字段信息
+
+        不经过问题缓存：后端从内存中的表结构目录返回，缓存下来反而会在表结构变化后继续提供旧字段
+        """
+        fields = self._call_api("get_fields", {"tables": tables})
+        self._remember_fields(fields)
+        return fields
+
+    def _generate_sql_params(self, question: str, tables: List[str], fields: Dict) -> Dict:
+        """SQL生成参数，附带问题中解析出的公司/证券及其InnerCode/CompanyCode"""
+        params = {
+            "question": question,
+            "tables": tables,
+            "fields": fields
+        }
+        mentions = self.entity_index.resolve(question)
+        if mentions:
+            params["entities"] = EntityIndex.describe(mentions)
+        return params
+
+    @staticmethod
+    def _sql_variant(tables: List[str], fields: Dict) -> str:
+        """生成SQL缓存的上下文：所选表及其字段信息的摘要，表或表结构变化后不再命中旧的SQL"""
+        context = json.dumps(
+            {"tables": sorted(table.lower() for table in tables), "fields": fields},
+            sort_keys=True,
+            ensure_ascii=False,
+            default=str
         )
+        return hashlib.sha1(context.encode("utf-8")).hexdigest()[:16]
+
+    def _cached_sql(self, question: str, tables: List[str], fields: Dict) -> Optional[str]:
+        cached = self.cache.get("generate_sql", question, self._sql_variant(tables, fields))
+        if cached is not None:
+            self._generated[question] = (cached, None)
+        return cached
+
+    def remember_sql(self, question: str, tables: List[str], fields: Dict, sql: str):
+        """SQL执行成功后写入生成SQL缓存，执行失败的SQL不缓存
+
+        sql 是最终执行成功的SQL：经过修复时是修复后的SQL，替换缓存中原来的SQL
+        """
+        generated = self._generated.pop(question, None)
+        if generated is None:
+            return
+        original, elapsed = generated
+        if elapsed is None and sql == original:
+            return
+        self.cache.put("generate_sql", question, sql, elapsed or 0.0, self._sql_variant(tables, fields))
+
+    def _remember_fields(self, fields):
+        """字段信息并入表结构目录，供执行前的SQL校验使用"""
+        if isinstance(fields, dict):
+            get_schema_catalog().merge(fields)
+    
+    @traced("generate_sql")
+    def generate_sql(
+        self,
+        question: str,
+        tables: List[str],
+        fields: Dict,
+        on_delta: Optional[Callable[[str], None]] = None
+    ) -> str:
+        """生成SQL语句
+        Args:
+            on_delta: 传入时流式生成，每收到一段输出就以目前为止的完整文本回调一次，最后回调改写后的SQL
+        """
+        cached = self._cached_sql(question, tables, fields)
+        if cached is not None:
+            if on_delta is not None:
+                on_delta(cached)
+            return cached
+        start = time.perf_counter()
+        params = self._generate_sql_params(question, tables, fields)
+        if on_delta is None:
+            sql = self._call_api("generate_sql", params)
+        else:
+            sql = ""
+            for text in stream_api("generate_sql", params, self.api_key, self.base_url, self.model):
+                sql += text
+                on_delta(sql)
+        # 去掉模型输出中的代码块标记和说明文字，再做LIMIT/投影/日期谓词下推改写
+        sql = self.sql_optimizer.optimize(extract_sql(sql), question)["sql"]
+        self._generated[question] = (sql, time.perf_counter() - start)
+        if on_delta is not None:
+            on_delta(sql)
+        return sql
     
-    def generate_sql(self, question: str, tables: List[str], fields: Dict) -> str:
+    @staticmethod
+    def _execute_params(sql: str, params: Optional[Dict[str, Any]]) -> Dict:
+        request = {"sql": sql}
+        if params:
+            request["params"] = params
+        return request
+
+    @staticmethod
+    def _params_variant(params: Optional[Dict[str, Any]]) -> str:
+        """参数化查询的结果缓存按参数值区分"""
+        return "#" + json.dumps(params, sort_keys=True, default=str) if params else ""
+
+    @traced("execute_sql", describe_result)
+    def execute_sql(self, sql: str, params: Optional[Dict[str, Any]] = None) -> Dict:
+        """执行SQL语句，相同（规范化后）的查询直接返回缓存结果，校验不通过的SQL不发出请求
+        Args:
+            params: SQL中 :name 占位符的参数，由后端按驱动绑定
+        """
+        validation = self.sql_validator.validate(sql)
+        if validation["status"] != "success":
+            return validation
+        sql = validation["sql"]
+        variant = self._params_variant(params)
+        cached = self.result_cache.get(sql, variant)
+        if cached is not None:
+            return self.sql_optimizer.mark_truncated(sql, cached)
+        result = self._call_api("execute_sql", self._execute_params(sql, params))
+        if isinstance(result, dict) and result.get("status") == "success":
+            self.result_cache.put(sql, result, variant)
+        return self.sql_optimizer.mark_truncated(sql, result)
+
+    @traced("repair_sql")
+    def repair_sql(self, question: str, sql: str, error: str, fields: Dict) -> str:
+        """把出错的SQL和错误信息交给模型修正"""
+        fixed = self._call_api(
+            "repair_sql",
+            {
+                "question": question,
+                "sql": sql,
+                "error": error,
+                "fields": fields
+            }
+        )
+        return extract_sql(fixed)
+
+    @traced("repair_and_execute", _describe_repair)
+    def repair_and_execute(self, question: str, sql: str, result: Dict, fields: Dict) -> Dict:
+        """执行失败时进入修复循环，返回 {"sql", "result", "attempts"}"""
+        return self.sql_repairer.repair(
+            question,
+            sql,
+            result,
+            lambda q, s, e: self.repair_sql(q, s, e, fields),
+            self.execute_sql
+        )
+
+class AsyncQuestionService(QuestionService):
+    """QuestionService 的异步版本
+
+    每一步都基于异步HTTP客户端，等待LLM响应时不阻塞事件循环，
+    单个uvicorn worker即可同时处理大量进行中的问题。
+    """
+
+    async def _call(self, endpoint: str, params: Dict):
+        return await call_api_async(endpoint, params, self.api_key, self.base_url, self.model)
+
+    @traced("answer_from_template", lambda match: {"hit": match is not None})
+    async def answer_from_template(self, question: str) -> Optional[Dict]:
+        """模板快速路径，见 QuestionService.answer_from_template"""
+        match = self._template_match(question)
+        if match is None:
+            return None
+        return self._template_answer(match, await self.execute_sql(match["sql"], match["params"]))
+
+    @traced("analyze_tables", lambda tables: {"tables": len(tables)})
+    async def analyze_tables(self, question: str) -> List[str]:
+        """分析问题需要用到的表"""
+        routing = self._route_locally(question)
+        if routing["confidence"] >= TABLE_ROUTER_MIN_CONFIDENCE:
+            return routing["tables"]
+        cached = self.cache.get("analyze_tables", question)
+        if cached is not None:
+            return cached
+
+        start = time.perf_counter()
+        candidates = self.table_router.candidates(question, routing["confidence"])
+        prompt = self._generate_table_analysis_prompt(question, candidates)
+        response = await self._call(
+            "analyze_tables",
+            {
+                "prompt": prompt,
+                "question": question
+            }
+        )
+        self._record_prompt_tokens(question, prompt, response)
+        tables = response.get("tables", [])
+        if tables:
+            self.cache.put("analyze_tables", question, tables, time.perf_counter() - start)
+        return tables
+
+    @traced("get_fields")
+    async def get_fields(self, tables: List[str]) -> Dict:
+        """获取表字段信息，不经过问题缓存（见 QuestionService.get_fields）"""
+        fields = await self._call("get_fields", {"tables": tables})
+        self._remember_fields(fields)
+        return fields
+
+    @traced("generate_sql")
+    async def generate_sql(self, question: str, tables: List[str], fields: Dict) -> str:
         """生成SQL语句"""
-        return call_api(
+        cached = self._cached_sql(question, tables, fields)
+        if cached is not None:
+            return cached
+        start = time.perf_counter()
+        sql = await self._call(
+            "generate_sql",
+            self._generate_sql_params(question, tables, fields)
+        )
+        sql = self.sql_optimizer.optimize(extract_sql(sql), question)["sql"]
+        self._generated[question] = (sql, time.perf_counter() - start)
+        return sql
+
+    async def generate_sql_stream(self, question: str, tables: List[str], fields: Dict) -> AsyncIterator[Dict]:
+        """流式生成SQL
+        Yields:
+            若干 {"delta": 新增文本}，最后 {"sql": 改写后的SQL}；命中缓存时只产出最后一项
+        """
+        cached = self._cached_sql(question, tables, fields)
+        if cached is not None:
+            yield {"sql": cached}
+            return
+        start = time.perf_counter()
+        sql = ""
+        async for text in stream_api_async(
             "generate_sql",
+            self._generate_sql_params(question, tables, fields),
+            self.api_key,
+            self.base_url,
+            self.model
+        ):
+            sql += text
+            yield {"delta": text}
+        sql = self.sql_optimizer.optimize(extract_sql(sql), question)["sql"]
+        self._generated[question] = (sql, time.perf_counter() - start)
+        yield {"sql": sql}
+
+    @traced("execute_sql", describe_result)
+    async def execute_sql(self, sql: str, params: Optional[Dict[str, Any]] = None) -> Dict:
+        """执行SQL语句，相同（规范化后）的查询直接返回缓存结果，校验不通过的SQL不发出请求"""
+        validation = self.sql_validator.validate(sql)
+        if validation["status"] != "success":
+            return validation
+        sql = validation["sql"]
+        variant = self._params_variant(params)
+        cached = self.result_cache.get(sql, variant)
+        if cached is not None:
+            return self.sql_optimizer.mark_truncated(sql, cached)
+        result = await self._call("execute_sql", self._execute_params(sql, params))
+        if isinstance(result, dict) and result.get("status") == "success":
+            self.result_cache.put(sql, result, variant)
+        return self.sql_optimizer.mark_truncated(sql, result)
+
+    @traced("repair_sql")
+    async def repair_sql(self, question: str, sql: str, error: str, fields: Dict) -> str:
+        """把出错的SQL和错误信息交给模型修正"""
+        fixed = await self._call(
+            "repair_sql",
             {
                 "question": question,
-                "tables": tables,
+                "sql": sql,
+                "error": error,
                 "fields": fields
-            },
-            self.api_key
+            }
         )
-    
-    def execute_sql(self, sql: str) -> Dict:
-        """执行SQL语句"""
-        return call_api(
-            "execute_sql",
-            {"sql": sql},
-            self.api_key
-        ) 
\ No newline at end of file
+        return extract_sql(fixed)
+
+    @traced("repair_and_execute", _describe_repair)
+    async def repair_and_execute(self, question: str, sql: str, result: Dict, fields: Dict) -> Dict:
+        """执行失败时进入修复循环，返回 {"sql", "result", "attempts"}"""
+        return await self.sql_repairer.repair_async(
+            question,
+            sql,
+            result,
+            lambda q, s, e: self.repair_sql(q, s, e, fields),
+            self.execute_sql
+        )
+
+    @traced("answer")
+    async def answer(self, question: str) -> Dict:
+        """端到端执行：先尝试模板快速路径，未命中时执行四步流程，执行出错时自动修复"""
+        # 整个问题共用一个截止时间，各次模型调用的排队和重试都不超过它
+        with deadline():
+            return await self._answer(question)
+
+    async def _answer(self, question: str) -> Dict:
+        fast = await self.answer_from_template(question)
+        if fast is not None:
+            return {
+                "template": fast["template"],
+                "sql": fast["sql"],
+                "params": fast["params"],
+                "result": fast["result"],
+                "answer": fast["answer"]
+            }
+        tables = await self.analyze_tables(question)
+        fields = await self.get_fields(tables)
+        sql = await self.generate_sql(question, tables, fields)
+        result = await self.execute_sql(sql)
+        if isinstance(result, dict) and result.get("status") == "error":
+            repair = await self.repair_and_execute(question, sql, result, fields)
+            sql, result = repair["sql"], repair["result"]
+        if isinstance(result, dict) and result.get("status") == "success":
+            self.remember_sql(question, tables, fields, sql)
+        return {
+            "tables": tables,
+            "fields": fields,
+            "sql": sql,
+            "result": result
+        }
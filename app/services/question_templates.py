@@ -0,0 +1,489 @@
+import argparse
+import json
+import logging
+import os
+import re
+import threading
+import unicodedata
+import zlib
+from collections import defaultdict
+from datetime import date
+from decimal import Decimal
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from sqlglot import exp
+from sqlglot.errors import ParseError
+from .entity_index import EntityIndex, get_entity_index
+from .sql_validator import SQL_DIALECT, parse_sql, render_sql
+
+CONFIG_DIR = Path(__file__).parent.parent / "config"
+
+# 模板文件列表（按 os.pathsep 分隔），挖掘出的模板审核后加到这里
+QUESTION_TEMPLATE_FILES = os.getenv(
+    "QUESTION_TEMPLATE_FILES",
+    str(CONFIG_DIR / "question_templates.json")
+)
+# 挖掘模板时，同一问题骨架至少出现的次数和不同取值组合数
+TEMPLATE_MIN_SUPPORT = int(os.getenv("TEMPLATE_MIN_SUPPORT", "3"))
+TEMPLATE_MIN_DISTINCT = int(os.getenv("TEMPLATE_MIN_DISTINCT", "2"))
+
+# 模板在 template_text 的结果上做整句匹配：只去掉空白和句末标点，日期、小数、*ST 等保持原样交给槽位解析
+_DATE = r"\d{4}年\d{1,2}月\d{1,2}日|\d{4}[-/]\d{1,2}[-/]\d{1,2}|\d{8}"
+SLOT_PATTERNS = {
+    "company": r".+?",
+    "date": _DATE,
+    "year": r"\d{4}",
+    "number": r"-?\d+(?:\.\d+)?"
+}
+_DATE_TEXT = re.compile(
+    r"(\d{4})年(\d{1,2})月(\d{1,2})日|(?<!\d)(\d{4})[-/](\d{1,2})[-/](\d{1,2})(?!\d)|(?<!\d)(\d{4})(\d{2})(\d{2})(?!\d)"
+)
+_WHITESPACE = re.compile(r"\s+")
+_TRAILING_PUNCTUATION = re.compile(r"[?!.,;:。、…~]+$")
+# 挖掘时识别的年份：后面不紧跟月份
+_YEAR_TEXT = re.compile(r"(?<!\d)(\d{4})(?=年)(?!年\d{1,2}月)")
+# 挖掘日志中SQL所在的步骤
+SQL_STEPS = ("生成SQL",)
+EXECUTE_STEPS = ("执行SQL",)
+REPAIR_STEPS = ("修复SQL",)
+TEMPLATE_STEP = "模板匹配"
+# 公司槽位参数与对应的键字段
+_KEY_SUFFIXES = {"innercode": "_inner_code", "companycode": "_company_code", "secucode": "_secu_code"}
+
+def template_text(question: str) -> str:
+    """模板匹配用的问题文本：全半角统一、小写、去掉空白和句末标点"""
+    text = _WHITESPACE.sub("", unicodedata.normalize("NFKC", question).lower())
+    return _TRAILING_PUNCTUATION.sub("", text)
+
+def parse_date(text: str) -> Optional[str]:
+    """2021年3月1日 / 2021-3-1 / 20210301 -> 2021-03-01，不是合法日期时返回None"""
+    match = _DATE_TEXT.fullmatch(text)
+    if match is None:
+        return None
+    parts = [int(part) for part in match.groups() if part]
+    try:
+        return date(*parts).isoformat()
+    except ValueError:
+        return None
+
+def slot_values(
+    slot: str,
+    slot_type: str,
+    text: str,
+    entity_index: EntityIndex
+) -> Optional[Tuple[Dict[str, Any], Dict[str, Any]]]:
+    """解析槽位文本
+    Returns:
+        (SQL参数, 答案格式化用的取值)，无法解析时返回None
+        company: 参数 <槽位>_inner_code/_company_code/_secu_code，取值 <槽位>=证券简称
+        date: 参数 <槽位>=YYYY-MM-DD
+        year: 参数 <槽位>=年份、<槽位>_start/_end=当年首尾日期
+    """
+    if slot_type == "company":
+        mentions = entity_index.resolve(text)
+        # 槽位文本必须整体是一个公司/证券的名称或代码
+        if len(mentions) != 1 or mentions[0]["end"] - mentions[0]["start"] != len(text):
+            return None
+        mention = mentions[0]
+        return (
+            {
+                f"{slot}_inner_code": mention["InnerCode"],
+                f"{slot}_company_code": mention["CompanyCode"],
+                f"{slot}_secu_code": mention["SecuCode"]
+            },
+            {
+                slot: mention["SecuAbbr"],
+                f"{slot}_secu_code": mention["SecuCode"],
+                f"{slot}_full_name": mention["ChiName"]
+            }
+        )
+    if slot_type == "date":
+        day = parse_date(text)
+        if day is None:
+            return None
+        return {slot: day}, {slot: day}
+    if slot_type == "year":
+        year = int(text)
+        return (
+            {slot: year, f"{slot}_start": f"{year}-01-01", f"{slot}_end": f"{year}-12-31"},
+            {slot: year}
+        )
+    if slot_type == "number":
+        value = Decimal(text) if "." in text else int(text)
+        return {slot: value}, {slot: value}
+    raise ValueError(f"未知的槽位类型: {slot_type}")
+
+class TemplateRegistry:
+    """参数化问题模板注册表
+
+    每个模板是 带命名槽位的问题正则 + 用 :name 占位符的预置SQL。问题整句命中某个模板且所有槽位
+    都能解析（公司经实体索引解析为 InnerCode/CompanyCode，日期、年份转为日期参数）时，
+    直接得到可执行的SQL和绑定参数，不再经过选表、取字段、生成SQL三次模型调用。
+    """
+
+    def __init__(self, paths: Optional[Iterable[str]] = None, entity_index: Optional[EntityIndex] = None):
+        self.entity_index = entity_index or get_entity_index()
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._templates: List[Dict] = []
+        self._stats = defaultdict(lambda: defaultdict(int))
+        self._questions = 0
+        if paths is None:
+            paths = [path for path in QUESTION_TEMPLATE_FILES.split(os.pathsep) if path]
+        for path in paths:
+            self.load(path)
+
+    @property
+    def templates(self) -> List[Dict]:
+        return list(self._templates)
+
+    def load(self, path: str):
+        """加载模板文件，格式同 app/config/question_templates.json"""
+        if not os.path.exists(path):
+            self.logger.warning(f"Question template file not found: {path}")
+            return
+        with open(path, "r", encoding="utf-8") as f:
+            for template in json.load(f)["templates"]:
+                self.add(template)
+
+    def add(self, template: Dict):
+        """注册一个模板：校验槽位与正则一致，预先编译正则并解析SQL的输出列名"""
+        regex = re.compile(template["pattern"])
+        slots = template.get("slots", {})
+        if set(regex.groupindex) != set(slots):
+            raise ValueError(f"模板 {template['name']} 的槽位与正则的命名分组不一致")
+        try:
+            columns = parse_sql(template["sql"]).named_selects
+        except ParseError as e:
+            raise ValueError(f"模板 {template['name']} 的SQL无法解析: {str(e)}")
+        compiled = dict(template, regex=regex, columns=columns)
+        with self._lock:
+            self._templates = [t for t in self._templates if t["name"] != template["name"]] + [compiled]
+
+    def match(self, question: str) -> Optional[Dict]:
+        """按注册顺序匹配问题
+        Returns:
+            {"template", "sql", "params", "slots", "columns", "answer_format"}，没有命中时返回None
+        """
+        text = template_text(question)
+        with self._lock:
+            self._questions += 1
+            templates = self._templates
+        for template in templates:
+            found = template["regex"].fullmatch(text)
+            if found is None:
+                continue
+            params, values = {}, {}
+            for slot, slot_type in template["slots"].items():
+                resolved = slot_values(slot, slot_type, found.group(slot), self.entity_index)
+                if resolved is None:
+                    break
+                params.update(resolved[0])
+                values.update(resolved[1])
+            else:
+                self._record(template["name"], "matched")
+                return {
+                    "template": template["name"],
+                    "sql": template["sql"],
+                    "params": params,
+                    "slots": values,
+                    "columns": template["columns"],
+                    "answer_format": template.get("answer")
+                }
+        return None
+
+    @staticmethod
+    def render_answer(match: Dict, data: Any) -> Optional[str]:
+        """用结果第一行和槽位取值填充模板的答案格式，无格式或无结果时返回None"""
+        if not match.get("answer_format") or not data:
+            return None
+        if isinstance(data, dict):
+            # 列式结果
+            if not all(len(values) for values in data.values()):
+                return None
+            row = {name: values[0] for name, values in data.items()}
+        elif isinstance(data[0], dict):
+            row = data[0]
+        else:
+            row = dict(zip(match["columns"], data[0]))
+        try:
+            return match["answer_format"].format(**{**match["slots"], **row})
+        except (KeyError, IndexError, ValueError, TypeError):
+            return None
+
+    def _record(self, name: str, outcome: str):
+        with self._lock:
+            self._stats[name][outcome] += 1
+
+    def record_fallback(self, name: str):
+        """模板命中但执行失败、回退到模型流程"""
+        self._record(name, "fallback")
+
+    def stats(self) -> Dict:
+        """各模板命中与回退次数"""
+        with self._lock:
+            matched = sum(s["matched"] for s in self._stats.values())
+            fallback = sum(s["fallback"] for s in self._stats.values())
+            return {
+                "questions": self._questions,
+                "matched": matched,
+                "answered": matched - fallback,
+                "hit_rate": (matched - fallback) / self._questions if self._questions else 0.0,
+                "templates": {name: dict(s) for name, s in sorted(self._stats.items())}
+            }
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self._questions = 0
+
+@lru_cache(maxsize=1)
+def get_template_registry() -> TemplateRegistry:
+    """进程内共享的模板注册表"""
+    return TemplateRegistry()
+
+def slotify_question(text: str, entity_index: EntityIndex) -> Tuple[List, Dict[str, str], Dict[str, Any]]:
+    """把问题（template_text 的结果）中的日期、公司、年份替换为槽位
+    Returns:
+        (骨架片段列表：字符串或 (槽位名, 类型)，槽位类型, SQL参数)
+    """
+    spans = []
+    for match in _DATE_TEXT.finditer(text):
+        spans.append((match.start(), match.end(), "date"))
+    for mention in entity_index.resolve(text):
+        spans.append((mention["start"], mention["end"], "company"))
+    for match in _YEAR_TEXT.finditer(text):
+        spans.append((match.start(), match.end(), "year"))
+
+    # 优先级：日期 > 公司 > 年份，重叠时保留先加入的
+    chosen = []
+    for span in spans:
+        if all(span[1] <= other[0] or span[0] >= other[1] for other in chosen):
+            chosen.append(span)
+
+    parts, slots, params = [], {}, {}
+    position = 0
+    counters = defaultdict(int)
+    for start, end, slot_type in sorted(chosen):
+        counters[slot_type] += 1
+        slot = {"date": "day"}.get(slot_type, slot_type)
+        if counters[slot_type] > 1:
+            slot = f"{slot}{counters[slot_type]}"
+        resolved = slot_values(slot, slot_type, text[start:end], entity_index)
+        if resolved is None:
+            continue
+        if start > position:
+            parts.append(text[position:start])
+        parts.append((slot, slot_type))
+        slots[slot] = slot_type
+        params.update(resolved[0])
+        position = end
+    if position < len(text):
+        parts.append(text[position:])
+    return parts, slots, params
+
+def slotify_sql(sql: str, params: Dict[str, Any]) -> Optional[Tuple[str, set]]:
+    """把SQL中与槽位参数取值相同的字面量替换为 :name 占位符
+    Returns:
+        (参数化SQL, 用到的参数名)，同一个字面量对应多个参数等无法确定时返回None
+    """
+    owners: Dict[str, List[str]] = defaultdict(list)
+    for name, value in params.items():
+        if value is None:
+            continue
+        owners[str(value)].append(name)
+        if isinstance(value, str) and re.fullmatch(r"\d{4}-\d{2}-\d{2}", value):
+            owners[value.replace("-", "")].append(name)
+            owners[f"{value} 00:00:00"].append(name)
+    try:
+        tree = parse_sql(sql)
+    except ParseError:
+        return None
+
+    used, ambiguous = set(), []
+
+    def choose(node, names: List[str]) -> Optional[str]:
+        if len(names) == 1:
+            return names[0]
+        # 取值相同的多个参数（如InnerCode与CompanyCode相等）按比较的字段确定
+        if isinstance(node.parent, exp.Binary):
+            other = node.parent.left if node.parent.right is node else node.parent.right
+            if isinstance(other, exp.Column):
+                suffix = _KEY_SUFFIXES.get(other.name.lower())
+                matched = [name for name in names if suffix and name.endswith(suffix)]
+                if len(matched) == 1:
+                    return matched[0]
+        return None
+
+    def replace(node):
+        if not isinstance(node, exp.Literal) or isinstance(node.parent, (exp.Limit, exp.Offset)):
+            return node
+        names = owners.get(node.this)
+        if not names:
+            return node
+        name = choose(node, names)
+        if name is None:
+            ambiguous.append(node.this)
+            return node
+        used.add(name)
+        return exp.Placeholder(this=name)
+
+    tree = tree.transform(replace)
+    if ambiguous:
+        return None
+    return render_sql(tree, SQL_DIALECT), used
+
+def skeleton_pattern(parts: List) -> str:
+    """骨架片段转为整句匹配的模板正则"""
+    return "".join(
+        re.escape(part) if isinstance(part, str) else f"(?P<{part[0]}>{SLOT_PATTERNS[part[1]]})"
+        for part in parts
+    )
+
+def mine_templates(
+    records: Iterable[Tuple[str, str]],
+    entity_index: EntityIndex,
+    min_support: int = TEMPLATE_MIN_SUPPORT,
+    min_distinct: int = TEMPLATE_MIN_DISTINCT
+) -> List[Dict]:
+    """从历史 (问题, 成功执行的SQL) 中挖掘候选模板
+
+    问题中的日期、公司、年份替换为槽位，SQL中取值相同的字面量替换为占位符，
+    按 (问题骨架, 参数化SQL) 分组，出现次数和不同取值组合数都达到阈值的组输出为候选模板。
+    """
+    groups: Dict[Tuple[str, str], Dict] = {}
+    for question, sql in records:
+        text = template_text(question)
+        parts, slots, params = slotify_question(text, entity_index)
+        if not slots:
+            continue
+        slotified = slotify_sql(sql, params)
+        if slotified is None:
+            continue
+        template_sql, used = slotified
+        # 每个槽位都必须体现在SQL里，否则SQL与该槽位的取值无关，模板会答非所问
+        if not all(any(name == slot or name.startswith(f"{slot}_") for name in used) for slot in slots):
+            continue
+        pattern = skeleton_pattern(parts)
+        group = groups.setdefault((pattern, template_sql), {
+            "slots": slots,
+            "count": 0,
+            "values": set(),
+            "examples": []
+        })
+        group["count"] += 1
+        group["values"].add(json.dumps({name: params[name] for name in sorted(used)}, default=str))
+        if len(group["examples"]) < 3 and question not in group["examples"]:
+            group["examples"].append(question)
+
+    templates = []
+    for (pattern, sql), group in sorted(groups.items(), key=lambda item: -item[1]["count"]):
+        if group["count"] < min_support or len(group["values"]) < min_distinct:
+            continue
+        templates.append({
+            "name": f"mined_{zlib.crc32((pattern + sql).encode('utf-8')):08x}",
+            "description": group["examples"][0],
+            "pattern": pattern,
+            "slots": group["slots"],
+            "sql": sql,
+            "support": group["count"],
+            "distinct": len(group["values"]),
+            "examples": group["examples"]
+        })
+    return templates
+
+def records_from_logs(paths: Iterable[str]) -> Iterator[Tuple[str, str]]:
+    """从执行日志中取出执行成功的 (问题, 最终SQL)
+    支持基础题目页下载的 execution_log.jsonl（运行记录，每行一题）和旧版的 execution_log.json（列表）
+    """
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            if path.endswith(".jsonl"):
+                entries = []
+                for line in f:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        # 运行中断时写了一半的行
+                        continue
+            else:
+                entries = json.load(f)
+        for entry in entries:
+            steps = {step.get("name"): step for step in entry.get("steps", [])}
+            if entry.get("status") != "completed" or TEMPLATE_STEP in steps:
+                continue
+            sql = next((steps[name].get("result") for name in SQL_STEPS if name in steps), None)
+            executed = next((steps[name].get("result") for name in EXECUTE_STEPS if name in steps), None)
+            if not isinstance(sql, str) or not isinstance(executed, dict):
+                continue
+            if executed.get("status") == "error":
+                # 执行失败后修复成功的，取最后一次修复的SQL
+                attempts = next((steps[name].get("result") for name in REPAIR_STEPS if name in steps), None) or []
+                if not attempts or attempts[-1].get("status") != "success":
+                    continue
+                sql = attempts[-1]["sql"]
+            yield entry["question"], sql
+
+def records_from_cache(cache) -> Iterator[Tuple[str, str]]:
+    """从问题缓存的 generate_sql 阶段取出 (归一化问题, SQL)"""
+    for key in cache.backend.keys("generate_sql"):
+        entry = cache.backend.get("generate_sql", key, cache.ttl)
+        if entry is not None and isinstance(entry[0], str):
+            yield key, entry[0]
+
+def main(argv: Optional[list] = None):
+    """模板挖掘与测试
+
+    python -m app.services.question_templates mine --logs execution_log.json --output .cache/mined_templates.json
+    python -m app.services.question_templates mine --cache --output .cache/mined_templates.json
+    python -m app.services.question_templates match "平安银行的股票代码是什么？"
+    """
+    parser = argparse.ArgumentParser(description="Mine or test parameterized question templates")
+    parser.add_argument("command", choices=["mine", "match"])
+    parser.add_argument("question", nargs="?", help="match 时要测试的问题")
+    parser.add_argument("--logs", nargs="*", default=[], help="执行日志JSON文件")
+    parser.add_argument("--cache", action="store_true", help="同时从问题缓存的SQL生成结果中挖掘")
+    parser.add_argument("--entities", help="实体索引快照，不指定时从数据库加载")
+    parser.add_argument("--output", help="候选模板输出路径，不指定时打印")
+    parser.add_argument("--min-support", type=int, default=TEMPLATE_MIN_SUPPORT)
+    parser.add_argument("--min-distinct", type=int, default=TEMPLATE_MIN_DISTINCT)
+    args = parser.parse_args(argv)
+
+    index = EntityIndex(snapshot_path=args.entities)
+    if args.entities:
+        index.load_snapshot()
+    else:
+        from app.models.database import engine
+
+        connection = engine.raw_connection()
+        try:
+            index.load(connection)
+        finally:
+            connection.close()
+
+    if args.command == "match":
+        match = TemplateRegistry(entity_index=index).match(args.question or "")
+        print(json.dumps(
+            {k: v for k, v in match.items() if k != "columns"} if match else None,
+            ensure_ascii=False, indent=2, default=str
+        ))
+        return
+
+    records = list(records_from_logs(args.logs))
+    if args.cache:
+        from .question_cache import get_question_cache
+
+        records.extend(records_from_cache(get_question_cache()))
+    templates = mine_templates(records, index, args.min_support, args.min_distinct)
+    output = json.dumps({"templates": templates}, ensure_ascii=False, indent=2, default=str)
+    if args.output:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+        print(f"Mined {len(templates)} candidate templates from {len(records)} records, saved to {args.output}")
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+import os
+import pickle
+import re
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from decimal import Decimal, InvalidOperation
+from functools import lru_cache
+from typing import Any, Dict, Optional, Set, Tuple
+
+# 结果缓存容量（字节）与过期时间（秒，0表示不过期）
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "0"))
+
+_TOKEN = re.compile(r"""
+    (?P<comment>--[^\n]*|/\*.*?\*/)
+  | (?P<string>'(?:[^'\\]|\\.|'')*')
+  | (?P<quoted>"(?:[^"\\]|\\.)*"|`[^`]*`)
+  | (?P<number>\d+\.\d*|\.\d+|\d+)
+  | (?P<word>[A-Za-z_][A-Za-z0-9_$]*)
+  | (?P<space>\s+)
+  | (?P<symbol>.)
+""", re.VERBOSE | re.DOTALL)
+
+_TABLE_KEYWORDS = {"from", "join", "into", "update"}
+_WRITE_KEYWORDS = {"insert", "update", "delete", "replace", "create", "alter", "drop", "truncate"}
+
+def _normalize_number(text: str) -> str:
+    try:
+        value = Decimal(text).normalize()
+    except InvalidOperation:
+        return text
+    # 避免 100 被规范成 1E+2
+    return format(value, "f")
+
+def canonicalize_sql(sql: str) -> Tuple[str, Set[str]]:
+    """规范化SQL文本并提取涉及的表
+
+    去掉注释、折叠空白、字符串字面量之外统一小写、数字字面量去掉多余的零，
+    使仅在格式上不同的SQL得到相同的缓存key。
+    Returns:
+        (规范化后的SQL, 涉及的表名集合)
+    """
+    tokens = []
+    for match in _TOKEN.finditer(sql.strip().rstrip(";")):
+        kind = match.lastgroup
+        text = match.group()
+        if kind in ("comment", "space"):
+            continue
+        if kind == "number":
+            text = _normalize_number(text)
+        elif kind == "quoted":
+            text = text.strip('"`').lower()
+            kind = "word"
+        elif kind != "string":
+            text = text.lower()
+        tokens.append((kind, text))
+
+    # FROM/JOIN/INTO/UPDATE 之后的（可能带库名的）标识符即表名
+    tables = set()
+    for i, (kind, text) in enumerate(tokens[:-1]):
+        if kind != "word" or text not in _TABLE_KEYWORDS or tokens[i + 1][0] != "word":
+            continue
+        name = tokens[i + 1][1]
+        j = i + 2
+        while j + 1 < len(tokens) and tokens[j][1] == "." and tokens[j + 1][0] == "word":
+            name = f"{name}.{tokens[j + 1][1]}"
+            j += 2
+        tables.add(name)
+
+    # 只在两个非符号记号之间保留空格，符号两侧的空白不影响语义
+    parts = []
+    for i, (kind, text) in enumerate(tokens):
+        if i and kind != "symbol" and tokens[i - 1][0] != "symbol":
+            parts.append(" ")
+        parts.append(text)
+    return "".join(parts), tables
+
+def is_read_only(canonical_sql: str) -> bool:
+    return canonical_sql.startswith(("select", "with", "("))
+
+class ResultCache:
+    """查询结果缓存
+
+    以规范化SQL为key，按结果序列化后的字节数计量容量并做LRU淘汰，
+    维护 表名 -> key 的反向索引以支持按表失效。
+    """
+
+    def __init__(self, max_bytes: int = RESULT_CACHE_MAX_BYTES, ttl: float = RESULT_CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # key -> (结果, 字节数, 写入时间, 涉及的表)
+        self._entries: "OrderedDict[str, Tuple[Any, int, float, Set[str]]]" = OrderedDict()
+        self._table_keys: Dict[str, Set[str]] = defaultdict(set)
+        self._bytes = 0
+        self._stats = defaultdict(int)
+
+    def get(self, sql: str, variant: str = "") -> Optional[Any]:
+        """查找缓存，未命中返回None；variant 区分同一SQL的不同结果形态（如列式）"""
+        key, _ = canonicalize_sql(sql)
+        key += variant
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl and time.time() - entry[2] > self.ttl:
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry[0]
+
+    def put(self, sql: str, result: Any, variant: str = ""):
+        """写入查询结果；写操作会使其涉及的表失效"""
+        key, tables = canonicalize_sql(sql)
+        if not is_read_only(key):
+            if key.split(" ", 1)[0] in _WRITE_KEYWORDS:
+                for table in tables:
+                    self.invalidate_table(table)
+            return
+        key += variant
+
+        size = len(pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (result, size, time.time(), tables)
+            self._bytes += size
+            for table in tables:
+                self._table_keys[table].add(key)
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._stats["evictions"] += 1
+
+    def _remove(self, key: str):
+        _, size, _, tables = self._entries.pop(key)
+        self._bytes -= size
+        for table in tables:
+            keys = self._table_keys.get(table)
+            if keys:
+                keys.discard(key)
+                if not keys:
+                    del self._table_keys[table]
+
+    def invalidate_table(self, table: str):
+        """使涉及某张表的所有缓存失效，表名可带或不带库名"""
+        table = table.lower()
+        with self._lock:
+            matched = [
+                name for name in self._table_keys
+                if name == table or name.split(".")[-1] == table.split(".")[-1]
+            ]
+            for name in matched:
+                for key in list(self._table_keys.get(name, ())):
+                    self._remove(key)
+                    self._stats["invalidations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._table_keys.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self._stats["hits"],
+                "misses": self._stats["misses"],
+                "evictions": self._stats["evictions"],
+                "invalidations": self._stats["invalidations"],
+                "hit_rate": self._stats["hits"] / lookups if lookups else 0.0
+            }
+
+@lru_cache(maxsize=1)
+def get_result_cache() -> ResultCache:
+    """进程内共享的查询结果缓存"""
+    return ResultCache()
@@ -0,0 +1,219 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+from .batch_executor import write_back
+
+# 批量运行记录的目录，每次运行一个子目录
+RUN_STORE_DIR = os.getenv(
+    "RUN_STORE_DIR",
+    str(Path(__file__).parent.parent.parent / ".cache" / "runs")
+)
+
+QUESTIONS_FILE = "questions.json"
+JOURNAL_FILE = "journal.jsonl"
+EXPORT_FILE = "results.json"
+META_FILE = "meta.json"
+
+def _key(tid, question: str) -> Tuple[str, str]:
+    return str(tid), question
+
+class RunStore:
+    """一次批量运行的磁盘记录，浏览器刷新或进程重启后可以继续
+
+    <目录>/<run_id>/questions.json  上传的原始题目文件（run_id 是文件内容的哈希，同一文件对应同一次运行）
+    <目录>/<run_id>/journal.jsonl   每完成一题追加一行（执行日志 + tid/答案），写入后立即落盘
+    <目录>/<run_id>/results.json    导出文件，日志有新记录时才按组逐个写出，不在内存中拼接整个结果
+    继续执行时跳过已成功完成的 (tid, 问题)，执行出错的题目会重新执行。
+    """
+
+    def __init__(self, run_id: str, root: str = RUN_STORE_DIR):
+        self.run_id = run_id
+        self.path = Path(root) / run_id
+        self._lock = threading.Lock()
+        self._questions: Optional[List[Dict]] = None
+        self._records: Optional[Dict[Tuple[str, str], Dict]] = None
+        # 上次导出时的日志大小，日志只追加，大小不变即内容不变
+        self._exported_size: Optional[int] = None
+        self.logger = logging.getLogger(__name__)
+
+    @classmethod
+    def from_upload(cls, data: bytes, name: str = "", root: str = RUN_STORE_DIR) -> "RunStore":
+        """登记上传的题目文件，已登记过的同一文件返回原来的运行"""
+        store = cls(hashlib.sha256(data).hexdigest()[:16], root)
+        if not (store.path / QUESTIONS_FILE).exists():
+            questions = json.loads(data)
+            store.path.mkdir(parents=True, exist_ok=True)
+            tmp = store.path / (QUESTIONS_FILE + ".tmp")
+            tmp.write_bytes(data)
+            os.replace(tmp, store.path / QUESTIONS_FILE)
+            with open(store.path / META_FILE, "w", encoding="utf-8") as f:
+                json.dump({"name": name, "created": time.time()}, f, ensure_ascii=False)
+            store._questions = questions
+        return store
+
+    @property
+    def questions(self) -> List[Dict]:
+        """原始题目结构，只解析一次"""
+        if self._questions is None:
+            with open(self.path / QUESTIONS_FILE, "r", encoding="utf-8") as f:
+                self._questions = json.load(f)
+        return self._questions
+
+    @property
+    def meta(self) -> Dict:
+        try:
+            with open(self.path / META_FILE, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    @property
+    def total(self) -> int:
+        return sum(len(group["team"]) for group in self.questions)
+
+    def _load(self) -> Dict[Tuple[str, str], Dict]:
+        """读取日志，同一题有多条记录时以最后一条为准；崩溃时写了一半的末行被忽略"""
+        if self._records is None:
+            records = {}
+            journal = self.path / JOURNAL_FILE
+            if journal.exists():
+                with open(journal, "r", encoding="utf-8") as f:
+                    for line in f:
+                        try:
+                            record = json.loads(line)
+                        except ValueError:
+                            self.logger.warning(f"Skipping damaged journal line in run {self.run_id}")
+                            continue
+                        records[_key(record["tid"], record["question"])] = record
+            self._records = records
+        return self._records
+
+    def record(self, group: Dict, question: Dict, result: Dict, log: Dict) -> Dict:
+        """追加一题的执行结果并立即落盘
+        Args:
+            log: 执行日志条目（步骤、token用量、链路等），原样写入日志行
+        """
+        record = dict(
+            log,
+            tid=group["tid"],
+            id=question.get("id"),
+            question=question["question"],
+            status=result["status"],
+            answer=result.get("answer"),
+            error=result.get("error"),
+            finished_at=time.time()
+        )
+        line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            records = self._load()
+            journal = self.path / JOURNAL_FILE
+            with open(journal, "a+b") as f:
+                # 上次写到一半的行补上换行，避免与新记录粘在一起
+                if f.tell() > 0:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        f.write(b"\n")
+                f.write(line.encode("utf-8"))
+                f.flush()
+                os.fsync(f.fileno())
+            records[_key(record["tid"], record["question"])] = record
+        return record
+
+    def is_finished(self, tid, question: str) -> bool:
+        record = self._load().get(_key(tid, question))
+        return record is not None and record["status"] == "completed"
+
+    def _records_snapshot(self) -> List[Dict]:
+        """记录的快照，后台任务线程可能同时在追加记录"""
+        records = self._load()
+        with self._lock:
+            return list(records.values())
+
+    @property
+    def finished(self) -> int:
+        return sum(record["status"] == "completed" for record in self._records_snapshot())
+
+    def pending(self) -> List[Dict]:
+        """还未成功完成的题目，保持原来的组结构"""
+        groups = []
+        for group in self.questions:
+            team = [dict(q) for q in group["team"] if not self.is_finished(group["tid"], q["question"])]
+            if team:
+                groups.append(dict(group, team=team))
+        return groups
+
+    def log_entries(self) -> List[Dict]:
+        """按完成顺序的执行日志"""
+        return sorted(self._records_snapshot(), key=lambda record: record.get("finished_at", 0))
+
+    def iter_results(self) -> Iterator[Dict]:
+        """逐组产出写回了答案的题目结构，不修改原始题目"""
+        records = self._load()
+        for group in self.questions:
+            team = []
+            for q in group["team"]:
+                q = dict(q)
+                record = records.get(_key(group["tid"], q["question"]))
+                if record is not None:
+                    write_back(q, record)
+                team.append(q)
+            yield dict(group, team=team)
+
+    def export(self) -> Path:
+        """导出结果文件，日志自上次导出后没有变化时直接返回已有文件"""
+        journal = self.path / JOURNAL_FILE
+        target = self.path / EXPORT_FILE
+        with self._lock:
+            size = journal.stat().st_size if journal.exists() else 0
+            if target.exists() and size == self._exported_size:
+                return target
+            tmp = self.path / (EXPORT_FILE + ".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write("[")
+                for i, group in enumerate(self.iter_results()):
+                    f.write(",\n" if i else "\n")
+                    json.dump(group, f, ensure_ascii=False, indent=2, default=str)
+                f.write("\n]\n")
+            os.replace(tmp, target)
+            self._exported_size = size
+        return target
+
+    def journal_path(self) -> Path:
+        return self.path / JOURNAL_FILE
+
+    def summary(self) -> Dict:
+        meta = self.meta
+        return {
+            "run_id": self.run_id,
+            "name": meta.get("name", ""),
+            "created": meta.get("created"),
+            "total": self.total,
+            "finished": self.finished
+        }
+
+    def reset(self):
+        """清空日志和导出文件，下次执行时所有题目重新执行"""
+        with self._lock:
+            for name in (JOURNAL_FILE, EXPORT_FILE):
+                (self.path / name).unlink(missing_ok=True)
+            self._records = {}
+            self._exported_size = None
+
+    def delete(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+def list_runs(root: str = RUN_STORE_DIR) -> List[Dict]:
+    """已登记的运行，最近创建的在前"""
+    runs = []
+    for path in Path(root).glob(f"*/{QUESTIONS_FILE}"):
+        try:
+            runs.append(RunStore(path.parent.name, root).summary())
+        except (OSError, ValueError, KeyError) as e:
+            logging.getLogger(__name__).warning(f"Skipping unreadable run {path.parent.name}: {str(e)}")
+    return sorted(runs, key=lambda run: run["created"] or 0, reverse=True)
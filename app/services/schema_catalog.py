@@ -0,0 +1,174 @@
+import json
+import logging
+import os
+import threading
+import time
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+# 两次检查版本戳之间的最小间隔（秒）
+SCHEMA_CATALOG_CHECK_INTERVAL = float(os.getenv("SCHEMA_CATALOG_CHECK_INTERVAL", "300"))
+# 可选的表结构快照文件，设置后从文件加载，文件修改时自动重新加载
+SCHEMA_CATALOG_SNAPSHOT = os.getenv("SCHEMA_CATALOG_SNAPSHOT")
+
+# 一次查询取回所有表的字段信息
+MYSQL_COLUMNS_SQL = """
+SELECT TABLE_SCHEMA, TABLE_NAME, COLUMN_NAME, DATA_TYPE, COLUMN_COMMENT
+FROM information_schema.columns
+WHERE TABLE_SCHEMA NOT IN ('information_schema', 'mysql', 'performance_schema', 'sys')
+ORDER BY TABLE_SCHEMA, TABLE_NAME, ORDINAL_POSITION
+"""
+MYSQL_VERSION_SQL = """
+SELECT COUNT(*), MAX(CREATE_TIME) FROM information_schema.tables
+WHERE TABLE_SCHEMA NOT IN ('information_schema', 'mysql', 'performance_schema', 'sys')
+"""
+# 表行数估计，供SQL优化器估算扫描代价
+MYSQL_ROWS_SQL = """
+SELECT TABLE_SCHEMA, TABLE_NAME, TABLE_ROWS FROM information_schema.tables
+WHERE TABLE_SCHEMA NOT IN ('information_schema', 'mysql', 'performance_schema', 'sys')
+"""
+SQLITE_COLUMNS_SQL = """
+SELECT 'main', m.name, p.name, p.type, ''
+FROM sqlite_master m JOIN pragma_table_info(m.name) p
+WHERE m.type = 'table'
+ORDER BY m.name, p.cid
+"""
+SQLITE_VERSION_SQL = "PRAGMA schema_version"
+
+def _is_sqlite(connection) -> bool:
+    # 连接池借出的是代理连接，按底层驱动连接判断
+    connection = getattr(connection, "dbapi_connection", connection)
+    return type(connection).__module__.startswith("sqlite3")
+
+class SchemaCatalog:
+    """表结构目录
+
+    启动时用一次批量内省查询加载全部字段信息，之后的字段查询都是内存字典查找。
+    通过数据库的版本戳（MySQL的表创建时间、SQLite的schema_version）或快照文件的修改时间判断是否需要重新加载。
+    """
+
+    def __init__(self, snapshot_path: Optional[str] = SCHEMA_CATALOG_SNAPSHOT):
+        self.snapshot_path = snapshot_path
+        self._lock = threading.Lock()
+        self._tables: Dict[str, List[Dict]] = {}
+        self._row_counts: Dict[str, int] = {}
+        self._version = None
+        self._checked_at = 0.0
+        # 目录内容每次变化加一，供下游缓存判断是否失效
+        self._revision = 0
+        self.logger = logging.getLogger(__name__)
+
+    @property
+    def loaded(self) -> bool:
+        return self._version is not None
+
+    def _current_version(self, connection):
+        """读取当前的结构版本戳"""
+        if self.snapshot_path:
+            return os.path.getmtime(self.snapshot_path)
+        cursor = connection.cursor()
+        cursor.execute(SQLITE_VERSION_SQL if _is_sqlite(connection) else MYSQL_VERSION_SQL)
+        return tuple(cursor.fetchone())
+
+    def _load(self, connection) -> Dict[str, List[Dict]]:
+        """批量加载全部字段信息"""
+        if self.snapshot_path:
+            with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+            return {table.lower(): columns for table, columns in snapshot.items()}
+
+        cursor = connection.cursor()
+        cursor.execute(SQLITE_COLUMNS_SQL if _is_sqlite(connection) else MYSQL_COLUMNS_SQL)
+        tables: Dict[str, List[Dict]] = {}
+        for schema, table, column, data_type, comment in cursor.fetchall():
+            key = table.lower() if schema == "main" else f"{schema}.{table}".lower()
+            tables.setdefault(key, []).append({
+                "name": column,
+                "type": data_type,
+                "description": comment or ""
+            })
+        return tables
+
+    def _load_row_counts(self, connection) -> Dict[str, int]:
+        """MySQL的表行数估计（来自统计信息，无需扫描）；快照和SQLite不提供"""
+        if self.snapshot_path or _is_sqlite(connection):
+            return {}
+        cursor = connection.cursor()
+        cursor.execute(MYSQL_ROWS_SQL)
+        return {
+            f"{schema}.{table}".lower(): int(rows)
+            for schema, table, rows in cursor.fetchall() if rows is not None
+        }
+
+    def refresh(self, connection=None, force: bool = False):
+        """版本戳变化时重新加载，未到检查间隔时直接返回"""
+        now = time.monotonic()
+        if not force and self.loaded and now - self._checked_at < SCHEMA_CATALOG_CHECK_INTERVAL:
+            return
+        with self._lock:
+            if not force and self.loaded and now - self._checked_at < SCHEMA_CATALOG_CHECK_INTERVAL:
+                return
+            version = self._current_version(connection)
+            if force or version != self._version:
+                self._tables = self._load(connection)
+                self._row_counts = self._load_row_counts(connection)
+                self._version = version
+                self._revision += 1
+                self.logger.info(f"Loaded schema catalog: {len(self._tables)} tables")
+            self._checked_at = now
+
+    @property
+    def tables(self) -> List[str]:
+        return list(self._tables.keys())
+
+    @property
+    def version(self) -> int:
+        return self._revision
+
+    def invalidate(self):
+        """下次访问时强制重新加载"""
+        with self._lock:
+            self._version = None
+
+    def merge(self, fields: Dict[str, List[Dict]]):
+        """并入 get_fields 返回的字段信息，用于未直连数据库的进程（如前端）
+
+        只有字段信息确实变化时才更新版本号，避免每次取字段都让下游缓存失效
+        """
+        with self._lock:
+            changed = False
+            for table, columns in (fields or {}).items():
+                if isinstance(columns, list) and all(isinstance(c, dict) and "name" in c for c in columns):
+                    if self._tables.get(table.lower()) != columns:
+                        self._tables[table.lower()] = columns
+                        changed = True
+            if changed:
+                self._revision += 1
+
+    def columns(self, table: str) -> List[Dict]:
+        """单表字段，支持 库名.表名 与不带库名两种写法"""
+        key = table.lower()
+        if key in self._tables:
+            return self._tables[key]
+        return self._tables.get(key.split(".")[-1], [])
+
+    def row_count(self, table: str) -> Optional[int]:
+        """表行数估计，未知时返回None"""
+        key = table.lower()
+        if key in self._row_counts:
+            return self._row_counts[key]
+        suffix = "." + key.split(".")[-1]
+        return next((rows for name, rows in self._row_counts.items() if name.endswith(suffix)), None)
+
+    def get_fields(self, connection, tables: List[str]) -> Dict[str, List[Dict]]:
+        """获取指定表的字段信息
+        Returns:
+            {表名: [{name, type, description}, ...]}
+        """
+        self.refresh(connection)
+        return {table: self.columns(table) for table in tables}
+
+@lru_cache(maxsize=1)
+def get_schema_catalog() -> SchemaCatalog:
+    """进程内共享的表结构目录"""
+    return SchemaCatalog()
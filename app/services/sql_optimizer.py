@@ -0,0 +1,385 @@
+import os
+import re
+import threading
+from collections import defaultdict, deque
+from datetime import date
+from functools import lru_cache
+from typing import Dict, List, Optional, Set, Tuple
+from sqlglot import exp
+from sqlglot.errors import ParseError
+from .schema_catalog import SchemaCatalog, get_schema_catalog
+from .sql_validator import SQL_DIALECT, parse_sql, render_sql, table_aliases
+
+# 没有LIMIT时注入的行数上限
+SQL_MAX_ROWS = int(os.getenv("SQL_MAX_ROWS", "1000"))
+# 代价估算参数：目录中没有行数时的默认表行数、日期字段覆盖的年数
+DEFAULT_TABLE_ROWS = int(os.getenv("SQL_DEFAULT_TABLE_ROWS", "1000000"))
+DATE_SPAN_YEARS = float(os.getenv("SQL_DATE_SPAN_YEARS", "10"))
+DEFAULT_TABLE_COLUMNS = 20
+# 只有单边范围时假设的选择率
+OPEN_RANGE_SELECTIVITY = 0.5
+
+DATE_COLUMNS = {"tradingday", "enddate"}
+# 收窄 SELECT * 时总是保留的标识字段
+KEY_COLUMNS = {"innercode", "companycode", "secucode", "secuabbr", "chiname", "tradingday", "enddate"}
+
+# 字段说明按标点、括号拆成词，如 "收盘价(元)" -> 收盘价
+_DESCRIPTION_SEPARATORS = re.compile(r"[\s,，;；:：()（）\[\]【】/、]+")
+
+_COMPARISONS = (exp.EQ, exp.GT, exp.GTE, exp.LT, exp.LTE)
+_FLIPPED = {exp.GT: exp.LT, exp.GTE: exp.LTE, exp.LT: exp.GT, exp.LTE: exp.GTE, exp.EQ: exp.EQ}
+
+def _conjuncts(condition: Optional[exp.Expression]) -> List[exp.Expression]:
+    if condition is None:
+        return []
+    if isinstance(condition, exp.And):
+        return list(condition.flatten())
+    return [condition]
+
+def _parse_date(literal: exp.Expression) -> Optional[date]:
+    if not isinstance(literal, exp.Literal) or not literal.is_string:
+        return None
+    try:
+        return date.fromisoformat(literal.this[:10])
+    except ValueError:
+        return None
+
+def _date_bounds(predicate: exp.Expression) -> Optional[Tuple[exp.Column, Optional[date], Optional[date]]]:
+    """识别日期字段与常量比较的谓词，返回 (字段, 下界, 上界)"""
+    if isinstance(predicate, exp.Between):
+        column = predicate.this
+        if isinstance(column, exp.Column) and column.name.lower() in DATE_COLUMNS:
+            low, high = _parse_date(predicate.args.get("low")), _parse_date(predicate.args.get("high"))
+            if low or high:
+                return column, low, high
+        return None
+    if not isinstance(predicate, _COMPARISONS):
+        return None
+    column, value, kind = predicate.this, predicate.expression, type(predicate)
+    if isinstance(value, exp.Column) and not isinstance(column, exp.Column):
+        column, value, kind = value, column, _FLIPPED[kind]
+    if not isinstance(column, exp.Column) or column.name.lower() not in DATE_COLUMNS:
+        return None
+    bound = _parse_date(value)
+    if bound is None:
+        return None
+    if kind is exp.EQ:
+        return column, bound, bound
+    if kind in (exp.GT, exp.GTE):
+        return column, bound, None
+    return column, None, bound
+
+def _own_tables(select: exp.Select) -> Dict[str, str]:
+    """查询块自己 FROM/JOIN 的基表：别名 -> 表名，不含子查询里的表和CTE"""
+    ctes = {cte.alias.lower() for cte in select.find_all(exp.CTE)}
+    sources = [select.args.get("from")] + list(select.args.get("joins") or [])
+    tables = {}
+    for source in sources:
+        table = source.this if source is not None else None
+        if isinstance(table, exp.Table) and not (not table.db and table.name.lower() in ctes):
+            tables[table.alias_or_name.lower()] = f"{table.db}.{table.name}".lower() if table.db else table.name.lower()
+    return tables
+
+def _mentioned(column: Dict, question: str) -> bool:
+    """问题中是否提到了该字段：字段名，或字段说明中的某个词"""
+    if column["name"].lower() in question:
+        return True
+    terms = _DESCRIPTION_SEPARATORS.split(column.get("description") or "")
+    return any(len(term) >= 2 and term.lower() in question for term in terms)
+
+class SQLOptimizer:
+    """生成SQL的改写优化
+
+    对模型生成的查询做三类改写：把 SELECT * 收窄到回答需要的字段、把日期范围谓词沿日期等值连接
+    传递并下推到内连接的一侧、没有LIMIT时加上行数上限（多取一行，执行后据此标记结果被截断）。
+    改写前后按 表行数 × 日期选择率 × 读取列数估算扫描代价，累计统计改写减少的扫描量。
+    """
+
+    def __init__(
+        self,
+        catalog: Optional[SchemaCatalog] = None,
+        max_rows: int = SQL_MAX_ROWS,
+        dialect: str = SQL_DIALECT
+    ):
+        self.catalog = catalog or get_schema_catalog()
+        self.max_rows = max_rows
+        self.dialect = dialect
+        self._lock = threading.Lock()
+        self._stats = defaultdict(float)
+        self.history = deque(maxlen=200)
+
+    def optimize(self, sql: str, question: str = "") -> Dict:
+        """改写SQL
+        Returns:
+            {"sql": 改写后的SQL, "rewrites": [...], "cost_before": {...}, "cost_after": {...}}；
+            无法解析时原样返回SQL，rewrites 为空
+        """
+        try:
+            tree = parse_sql(sql)
+        except ParseError:
+            return {"sql": sql, "rewrites": [], "cost_before": None, "cost_after": None}
+
+        cost_before = self.estimate_cost(tree)
+        rewrites = []
+        if isinstance(tree, exp.Select):
+            # 只改写最外层查询块，字段归属只在它自己的基表中解析；FROM 中有子查询时不做字段相关的改写
+            tables = _own_tables(tree)
+            sources = [tree.args.get("from")] + list(tree.args.get("joins") or [])
+            if tables and len(tables) == len([source for source in sources if source is not None]):
+                columns = {alias: self.catalog.columns(table) for alias, table in tables.items()}
+                rewrites += self._narrow_projection(tree, columns, question)
+                rewrites += self._push_down_dates(tree, tables, columns)
+            rewrites += self._limit_rows(tree)
+        cost_after = self.estimate_cost(tree)
+
+        result = {
+            "sql": render_sql(tree, self.dialect) if rewrites else sql,
+            "rewrites": rewrites,
+            "cost_before": cost_before,
+            "cost_after": cost_after
+        }
+        with self._lock:
+            self._stats["queries"] += 1
+            self._stats["rewritten"] += bool(rewrites)
+            self._stats["cells_before"] += cost_before["scan_cells"]
+            self._stats["cells_after"] += cost_after["scan_cells"]
+            self.history.append({"question": question, **result})
+        return result
+
+    @staticmethod
+    def _resolve_alias(column: exp.Column, columns: Dict[str, List[Dict]]) -> Optional[str]:
+        """字段所属的表别名；不带别名时在唯一含该字段的表中查找"""
+        if column.table:
+            return column.table.lower()
+        if len(columns) == 1:
+            return next(iter(columns))
+        name = column.name.lower()
+        owners = [alias for alias, known in columns.items() if any(c["name"].lower() == name for c in known)]
+        return owners[0] if len(owners) == 1 else None
+
+    def _narrow_projection(self, select: exp.Select, columns: Dict[str, List[Dict]], question: str) -> List[str]:
+        """FROM 只有一张基表时，把 * / 别名.* 替换为被引用的字段、标识字段和问题中提到的字段
+
+        问题没有提到任何字段（无法判断回答需要哪一列）、有 DISTINCT 或有连接时保留原来的 *。
+        """
+        stars = [
+            e for e in select.expressions
+            if isinstance(e, exp.Star) or (isinstance(e, exp.Column) and isinstance(e.this, exp.Star))
+        ]
+        if not stars or len(columns) != 1 or select.args.get("distinct") or select.args.get("joins"):
+            return []
+        alias, known = next(iter(columns.items()))
+        if not known:
+            return []
+
+        # WHERE / ORDER BY / GROUP BY 等处引用到的字段
+        referenced = {
+            column.name.lower() for column in select.find_all(exp.Column)
+            if not isinstance(column.this, exp.Star) and self._resolve_alias(column, columns) == alias
+        }
+        question = question.lower()
+        mentioned = [c["name"] for c in known if _mentioned(c, question)]
+        if not mentioned:
+            return []
+        needed = [
+            c["name"] for c in known
+            if c["name"] in mentioned or c["name"].lower() in referenced or c["name"].lower() in KEY_COLUMNS
+        ]
+        if len(needed) == len(known):
+            return []
+
+        expressions = []
+        for expression in select.expressions:
+            if expression not in stars:
+                expressions.append(expression)
+                continue
+            qualifier = expression.table if isinstance(expression, exp.Column) else None
+            expressions.extend(exp.column(name, table=qualifier) for name in needed)
+        select.set("expressions", expressions)
+        return ["narrow_projection"]
+
+    def _push_down_dates(
+        self,
+        select: exp.Select,
+        tables: Dict[str, str],
+        columns: Dict[str, List[Dict]]
+    ) -> List[str]:
+        """日期谓词沿日期等值连接传递到另一侧，并下推到内连接（如与secumain的连接）的ON条件中"""
+        where = select.args.get("where")
+        conjuncts = _conjuncts(where.this) if where else []
+        joins = select.args.get("joins") or []
+        rewrites = []
+
+        # 日期字段之间的等值条件，如 qt.TradingDay = q2.TradingDay
+        equalities = []
+        for condition in conjuncts + [c for join in joins for c in _conjuncts(join.args.get("on"))]:
+            if (isinstance(condition, exp.EQ) and isinstance(condition.this, exp.Column)
+                    and isinstance(condition.expression, exp.Column)
+                    and condition.this.name.lower() in DATE_COLUMNS
+                    and condition.expression.name.lower() in DATE_COLUMNS):
+                equalities.append((condition.this, condition.expression))
+
+        # 外连接一侧加过滤条件会改变语义，不向其传递
+        outer_aliases = {join.this.alias_or_name.lower() for join in joins if join.side}
+        existing = {condition.sql() for condition in conjuncts}
+        for predicate in list(conjuncts):
+            bounds = _date_bounds(predicate)
+            if bounds is None:
+                continue
+            column = bounds[0]
+            key = (self._resolve_alias(column, columns), column.name.lower())
+            for left, right in equalities:
+                for source, target in ((left, right), (right, left)):
+                    if (self._resolve_alias(source, columns), source.name.lower()) != key:
+                        continue
+                    if self._resolve_alias(target, columns) in outer_aliases:
+                        continue
+                    copied = predicate.copy().transform(
+                        lambda node: target.copy() if isinstance(node, exp.Column) and node == column else node
+                    )
+                    if copied.sql() not in existing:
+                        existing.add(copied.sql())
+                        conjuncts.append(copied)
+                        rewrites.append("propagate_date_predicate")
+
+        inner_joins = {
+            join.this.alias_or_name.lower(): join for join in joins
+            if isinstance(join.this, exp.Table) and not join.side and join.kind in ("", "INNER")
+            and join.args.get("on") is not None
+        }
+        remaining = []
+        for predicate in conjuncts:
+            bounds = _date_bounds(predicate)
+            alias = self._resolve_alias(bounds[0], columns) if bounds else None
+            if alias in inner_joins:
+                join = inner_joins[alias]
+                join.set("on", exp.and_(*_conjuncts(join.args["on"]), predicate.copy()))
+                rewrites.append("push_down_date_predicate")
+            else:
+                remaining.append(predicate)
+
+        if rewrites:
+            if remaining:
+                select.set("where", exp.Where(this=exp.and_(*remaining)))
+            else:
+                select.set("where", None)
+        return sorted(set(rewrites))
+
+    def _limit_rows(self, select: exp.Select) -> List[str]:
+        """没有LIMIT时加上行数上限；不分组的纯聚合查询只返回一行，不需要
+
+        多取一行，执行后由 mark_truncated 判断结果是否超出上限
+        """
+        if select.args.get("limit") is not None:
+            return []
+        if not select.args.get("group") and all(e.find(exp.AggFunc) for e in select.expressions):
+            return []
+        select.limit(self.max_rows + 1, copy=False)
+        return ["inject_limit"]
+
+    def mark_truncated(self, sql: str, result: Dict) -> Dict:
+        """SQL带有注入的行数上限且结果超出上限时，截到上限并标记 truncated，避免静默丢行"""
+        if not isinstance(result, dict) or result.get("status") != "success":
+            return result
+        if not re.search(rf"\bLIMIT\s+{self.max_rows + 1}\s*$", sql, re.IGNORECASE):
+            return result
+        data = result.get("data")
+        if isinstance(data, dict):
+            rows = len(next(iter(data.values()), ()))
+            if rows > self.max_rows:
+                data = {name: values[:self.max_rows] for name, values in data.items()}
+        else:
+            rows = len(data) if isinstance(data, list) else 0
+            if rows > self.max_rows:
+                data = data[:self.max_rows]
+        if rows <= self.max_rows:
+            return result
+        with self._lock:
+            self._stats["truncated"] += 1
+        return dict(result, data=data, truncated=True, row_limit=self.max_rows)
+
+    def _selectivity(self, tree: exp.Expression, columns: Dict[str, List[Dict]]) -> Dict[str, float]:
+        """按日期范围谓词估算每张表的选择率"""
+        bounds: Dict[Tuple, List[Optional[date]]] = {}
+        for predicate in tree.find_all(exp.Between, *_COMPARISONS):
+            found = _date_bounds(predicate)
+            if found is None:
+                continue
+            column, low, high = found
+            key = (self._resolve_alias(column, columns), column.name.lower())
+            current = bounds.setdefault(key, [None, None])
+            if low and (current[0] is None or low > current[0]):
+                current[0] = low
+            if high and (current[1] is None or high < current[1]):
+                current[1] = high
+
+        selectivity: Dict[str, float] = {}
+        span_days = DATE_SPAN_YEARS * 365
+        for (alias, _), (low, high) in bounds.items():
+            if low and high:
+                fraction = max((high - low).days + 1, 0) / span_days
+            else:
+                fraction = OPEN_RANGE_SELECTIVITY
+            selectivity[alias] = min(selectivity.get(alias, 1.0), max(min(fraction, 1.0), 1 / span_days))
+        return selectivity
+
+    def estimate_cost(self, tree: exp.Expression) -> Dict:
+        """估算扫描行数、扫描单元格数（行数×读取列数）和返回行数"""
+        tables = table_aliases(tree)
+        columns = {alias: self.catalog.columns(table) for alias, table in tables.items()}
+        selectivity = self._selectivity(tree, columns)
+
+        read: Dict[str, Set[str]] = defaultdict(set)
+        star_aliases = set()
+        for column in tree.find_all(exp.Column):
+            alias = self._resolve_alias(column, columns)
+            if isinstance(column.this, exp.Star):
+                star_aliases.add(alias)
+            elif alias is not None:
+                read[alias].add(column.name.lower())
+        # 投影中的裸 * 读取所有表的全部字段；COUNT(*) 中的 * 不算
+        if any(isinstance(e, exp.Star) for select in tree.find_all(exp.Select) for e in select.expressions):
+            star_aliases.update(tables)
+
+        scan_rows = scan_cells = largest = 0.0
+        for alias, table in tables.items():
+            rows = (self.catalog.row_count(table) or DEFAULT_TABLE_ROWS) * selectivity.get(alias, 1.0)
+            width = len(columns[alias]) or DEFAULT_TABLE_COLUMNS
+            if alias not in star_aliases:
+                width = max(len(read[alias]), 1)
+            scan_rows += rows
+            scan_cells += rows * width
+            largest = max(largest, rows)
+
+        limit = tree.args.get("limit")
+        output_rows = largest
+        if limit is not None and isinstance(limit.expression, exp.Literal):
+            output_rows = min(output_rows, float(limit.expression.this))
+        return {
+            "scan_rows": round(scan_rows),
+            "scan_cells": round(scan_cells),
+            "output_rows": round(output_rows)
+        }
+
+    def stats(self) -> Dict:
+        """累计的改写次数与估算扫描量的减少比例"""
+        with self._lock:
+            before = self._stats["cells_before"]
+            return {
+                "queries": int(self._stats["queries"]),
+                "rewritten": int(self._stats["rewritten"]),
+                "truncated": int(self._stats["truncated"]),
+                "cells_before": before,
+                "cells_after": self._stats["cells_after"],
+                "reduction": 1 - self._stats["cells_after"] / before if before else 0.0
+            }
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self.history.clear()
+
+@lru_cache(maxsize=1)
+def get_sql_optimizer() -> SQLOptimizer:
+    """进程内共享的SQL优化器"""
+    return SQLOptimizer()
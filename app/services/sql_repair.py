@@ -0,0 +1,268 @@
+import difflib
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from functools import lru_cache
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from sqlglot import exp
+from sqlglot.errors import ParseError
+from .question_cache import QuestionCache, get_question_cache
+from .schema_catalog import SchemaCatalog, get_schema_catalog
+from .sql_validator import SQL_DIALECT, parse_sql, render_sql, table_aliases
+
+# 每个问题最多的修复次数
+SQL_REPAIR_MAX_ATTEMPTS = int(os.getenv("SQL_REPAIR_MAX_ATTEMPTS", "2"))
+# 学到的 错误 -> 修复 模式在问题缓存中的阶段名
+REPAIR_STAGE = "sql_repair"
+
+_TOKEN = re.compile(r"'(?:[^'\\]|\\.|'')*'|`[^`]*`|\w+|[^\w\s]")
+# 各数据库/校验器报告未知字段的格式
+_UNKNOWN_COLUMN = re.compile(
+    r"Unknown column '(?:[\w`]+\.)?([\w`]+)'|no such column: (?:\w+\.)?(\w+)|没有字段 (\w+)|未知的字段 (\w+)",
+    re.IGNORECASE
+)
+# 表结构类错误（未知的字段/表）：修复是确定的改名，可以学习复用；连接中断、超时等偶发错误不学习
+_SCHEMA_ERROR = re.compile(
+    r"Unknown column|no such column|no such table|Table '[^']*' doesn't exist|Unknown table"
+    r"|Referenced column .* not found|Table with name .* does not exist|没有字段|未知的字段|未知的表",
+    re.IGNORECASE
+)
+# 一次学到的修复最多涉及的改动处数和每处的记号数，改动太大说明是重写而不是可复用的修补
+_MAX_EDITS = 3
+_MAX_EDIT_TOKENS = 4
+
+def error_signature(error: str) -> str:
+    """错误签名：去掉行号等位置信息后的归一化错误文本"""
+    text = re.sub(r"\b(?:line|col(?:umn)?):?\s*\d+", "", error, flags=re.IGNORECASE)
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+def is_schema_error(error: str) -> bool:
+    return _SCHEMA_ERROR.search(error) is not None
+
+def _tokens(sql: str) -> List[re.Match]:
+    return list(_TOKEN.finditer(sql))
+
+def learn_substitutions(before: str, after: str) -> Optional[List[Tuple[List[str], str]]]:
+    """比较失败的SQL和修复后的SQL，得到可复用的局部替换 [(原记号序列, 替换文本)]"""
+    old, new = _tokens(before), _tokens(after)
+    matcher = difflib.SequenceMatcher(
+        a=[t.group().lower() for t in old], b=[t.group().lower() for t in new], autojunk=False
+    )
+    edits = [op for op in matcher.get_opcodes() if op[0] != "equal"]
+    if not edits or len(edits) > _MAX_EDITS:
+        return None
+    substitutions = []
+    for tag, i1, i2, j1, j2 in edits:
+        if tag != "replace" or i2 - i1 > _MAX_EDIT_TOKENS or j2 - j1 > _MAX_EDIT_TOKENS:
+            return None
+        substitutions.append((
+            [t.group().lower() for t in old[i1:i2]],
+            after[new[j1].start():new[j2 - 1].end()]
+        ))
+    return substitutions
+
+def apply_substitutions(sql: str, substitutions: List[Tuple[List[str], str]]) -> Optional[str]:
+    """在SQL中按记号匹配替换，有任一替换找不到位置时返回None"""
+    for old, replacement in substitutions:
+        tokens = _tokens(sql)
+        texts = [t.group().lower() for t in tokens]
+        positions = [i for i in range(len(texts) - len(old) + 1) if texts[i:i + len(old)] == old]
+        if not positions:
+            return None
+        for i in reversed(positions):
+            sql = sql[:tokens[i].start()] + replacement + sql[tokens[i + len(old) - 1].end():]
+    return sql
+
+class SQLRepairer:
+    """执行失败的SQL自动修复
+
+    每次修复先尝试本地修补：已学到的同类错误的替换模式、按表结构目录把拼错的字段名改成最接近的字段；
+    本地无法修补时把错误信息和SQL交给模型修正。表结构类错误经模型修复成功且改动是局部替换时，记下
+    错误签名 -> 替换 的模式，之后同样的错误直接在本地修补。按尝试次序和修复来源统计成功率与耗时。
+    修补模式与问题缓存共用存储，但命中统计单独计算，不计入问题缓存的命中率。
+    """
+
+    def __init__(
+        self,
+        cache: Optional[QuestionCache] = None,
+        catalog: Optional[SchemaCatalog] = None,
+        max_attempts: int = SQL_REPAIR_MAX_ATTEMPTS
+    ):
+        self.cache = cache or QuestionCache(get_question_cache().backend, similarity=0)
+        self.catalog = catalog or get_schema_catalog()
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._attempts = defaultdict(lambda: defaultdict(float))
+        self._sources = defaultdict(lambda: defaultdict(float))
+        self._outcomes = defaultdict(int)
+
+    def _closest_column(self, sql: str, error: str) -> Optional[str]:
+        """未知字段错误：换成涉及的表中名字最接近的字段"""
+        match = _UNKNOWN_COLUMN.search(error)
+        if match is None:
+            return None
+        name = next(group for group in match.groups() if group).strip("`")
+        try:
+            tree = parse_sql(sql)
+        except ParseError:
+            return None
+        known = {
+            c["name"].lower(): c["name"]
+            for table in table_aliases(tree).values() for c in self.catalog.columns(table)
+        }
+        candidates = difflib.get_close_matches(name.lower(), list(known), n=1, cutoff=0.75)
+        if not candidates:
+            return None
+        replacement = known[candidates[0]]
+
+        # 只改写字段引用，同名的字符串字面量、别名不受影响
+        def rename(node):
+            if isinstance(node, exp.Column) and node.name.lower() == name.lower():
+                node = node.copy()
+                node.set("this", exp.to_identifier(replacement, quoted=node.this.args.get("quoted")))
+            return node
+
+        return render_sql(tree.transform(rename), SQL_DIALECT)
+
+    def local_fix(self, sql: str, error: str) -> Tuple[Optional[str], Optional[str]]:
+        """本地修补，返回 (修补后的SQL, 来源)；无法修补时返回 (None, None)"""
+        if not is_schema_error(error):
+            return None, None
+        substitutions = self.cache.get(REPAIR_STAGE, error_signature(error))
+        if substitutions:
+            fixed = apply_substitutions(sql, substitutions)
+            if fixed and fixed != sql:
+                return fixed, "pattern"
+        fixed = self._closest_column(sql, error)
+        if fixed and fixed != sql:
+            return fixed, "schema"
+        return None, None
+
+    def learn(self, error: str, failed_sql: str, fixed_sql: str, elapsed: float):
+        """记下表结构类错误的局部替换，其余错误的修复与错误本身无关，不学习"""
+        if not is_schema_error(error):
+            return
+        substitutions = learn_substitutions(failed_sql, fixed_sql)
+        if substitutions:
+            self.cache.put(REPAIR_STAGE, error_signature(error), substitutions, elapsed)
+
+    def _record(self, attempt: int, source: str, success: bool, elapsed: float):
+        with self._lock:
+            for bucket in (self._attempts[attempt], self._sources[source]):
+                bucket["count"] += 1
+                bucket["success"] += success
+                bucket["seconds"] += elapsed
+
+    def _finish(self, attempts: List[Dict], success: bool):
+        if attempts:
+            with self._lock:
+                self._outcomes["repaired" if success else "failed"] += 1
+
+    @staticmethod
+    def _failed(result) -> bool:
+        return isinstance(result, dict) and result.get("status") == "error"
+
+    def repair(
+        self,
+        question: str,
+        sql: str,
+        result: Dict,
+        llm_fix: Callable[[str, str, str], str],
+        execute: Callable[[str], Dict]
+    ) -> Dict:
+        """修复循环
+        Args:
+            result: 原SQL的执行结果，status 为 error 时开始修复
+            llm_fix: (问题, SQL, 错误) -> 模型修正后的SQL
+            execute: 执行SQL并返回结果
+        Returns:
+            {"sql": 最后一次执行的SQL, "result": 最后一次的执行结果, "attempts": [每次尝试的记录]}
+        """
+        attempts = []
+        for attempt in range(1, self.max_attempts + 1):
+            if not self._failed(result):
+                break
+            error = str(result.get("error", ""))
+            start = time.perf_counter()
+            fixed, source = self.local_fix(sql, error)
+            if fixed is None:
+                fixed, source = llm_fix(question, sql, error), "llm"
+            result = execute(fixed)
+            attempts.append(self._after_attempt(attempt, source, error, sql, fixed, result, start))
+            sql = fixed
+        self._finish(attempts, not self._failed(result))
+        return {"sql": sql, "result": result, "attempts": attempts}
+
+    async def repair_async(
+        self,
+        question: str,
+        sql: str,
+        result: Dict,
+        llm_fix: Callable[[str, str, str], Awaitable[str]],
+        execute: Callable[[str], Awaitable[Dict]]
+    ) -> Dict:
+        """repair 的异步版本"""
+        attempts = []
+        for attempt in range(1, self.max_attempts + 1):
+            if not self._failed(result):
+                break
+            error = str(result.get("error", ""))
+            start = time.perf_counter()
+            fixed, source = self.local_fix(sql, error)
+            if fixed is None:
+                fixed, source = await llm_fix(question, sql, error), "llm"
+            result = await execute(fixed)
+            attempts.append(self._after_attempt(attempt, source, error, sql, fixed, result, start))
+            sql = fixed
+        self._finish(attempts, not self._failed(result))
+        return {"sql": sql, "result": result, "attempts": attempts}
+
+    def _after_attempt(self, attempt, source, error, failed_sql, fixed_sql, result, start) -> Dict:
+        elapsed = time.perf_counter() - start
+        success = not self._failed(result)
+        self._record(attempt, source, success, elapsed)
+        if success and source == "llm":
+            self.learn(error, failed_sql, fixed_sql, elapsed)
+        return {
+            "attempt": attempt,
+            "source": source,
+            "error": error,
+            "sql": fixed_sql,
+            "status": "success" if success else "error",
+            "seconds": round(elapsed, 3)
+        }
+
+    def stats(self) -> Dict:
+        """按尝试次序和修复来源统计的成功率与平均耗时"""
+        def summarize(buckets):
+            return {
+                key: {
+                    "count": int(b["count"]),
+                    "success_rate": b["success"] / b["count"] if b["count"] else 0.0,
+                    "avg_seconds": b["seconds"] / b["count"] if b["count"] else 0.0
+                }
+                for key, b in sorted(buckets.items())
+            }
+        with self._lock:
+            total = self._outcomes["repaired"] + self._outcomes["failed"]
+            return {
+                "questions": total,
+                "repaired": self._outcomes["repaired"],
+                "success_rate": self._outcomes["repaired"] / total if total else 0.0,
+                "attempts": summarize(self._attempts),
+                "sources": summarize(self._sources),
+                "patterns": self.cache.stats()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._attempts.clear()
+            self._sources.clear()
+            self._outcomes.clear()
+
+@lru_cache(maxsize=1)
+def get_sql_repairer() -> SQLRepairer:
+    """进程内共享的SQL修复器"""
+    return SQLRepairer()
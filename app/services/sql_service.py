@@ -1,5 +1,21 @@
-from typing import List, Dict
+from typing import Any, List, Dict, Iterator, Optional
+import json
+import os
+import sys
 import sqlite3  # 或其他数据库客户端
+from decimal import Decimal
+from .schema_catalog import get_schema_catalog
+from .result_cache import get_result_cache
+from .columnar import rows_to_columns
+from .local_engine import get_local_engine
+from .sql_validator import SQL_DIALECT, bind_params, get_sql_validator, parameterize
+from .statement_cache import get_statement_cache
+
+# SQLite没有精确小数类型，也不能直接绑定Decimal，参数化得到的小数按浮点数绑定
+sqlite3.register_adapter(Decimal, float)
+
+# 流式执行时每批返回的行数
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "5000"))
 
 class SQLService:
     def __init__(self, db_connection):
@@ -12,10 +28,8 @@ class SQLService:
         Returns:
             {表名: [{字段名, 类型, 描述}, ...]}
         """
-        fields = {}
-        for table in tables:
-            fields[table] = self._get_table_schema(table)
-        return fields
+        # 表结构从内存目录中查找，不再逐表查询数据库
+        return get_schema_catalog().get_fields(self.db, tables)
     
     def generate_sql(self, question: str, tables: List[str], fields: Dict) -> str:
         """生成SQL语句"""
@@ -29,18 +43,113 @@ class SQLService:
         # 调用LLM生成SQL
         return self._call_llm(prompt)
     
-    def execute_sql(self, sql: str) -> Dict:
-        """执行SQL语句并返回结果"""
+    def execute_sql(self, sql: str, columnar: bool = False, params: Optional[Dict[str, Any]] = None) -> Dict:
+        """执行SQL语句并返回结果
+        Args:
+            columnar: 为True时 data 为 {列名: NumPy数组} 的列式结果，可零拷贝转为DataFrame
+            params: SQL中 :name 命名占位符的参数，按驱动的参数风格绑定，不拼接进SQL
+        """
+        local_engine = get_local_engine()
+        use_local = local_engine is not None and local_engine.covers(sql)
+        # 先在本地解析校验并改写为执行端的方言，错误的SQL不再发往数据库
+        dialect = "duckdb" if use_local else self._dialect()
+        validation = get_sql_validator().validate(sql, dialect)
+        if validation["status"] != "success":
+            return validation
+        sql = validation["sql"]
+
+        cache = get_result_cache()
+        variant = "#columnar" if columnar else ""
+        if params:
+            variant += "#" + json.dumps(params, sort_keys=True, default=str)
+        cached = cache.get(sql, variant)
+        if cached is not None:
+            return cached
         try:
-            cursor = self.db.cursor()
-            cursor.execute(sql)
-            results = cursor.fetchall()
-            return {
+            if use_local:
+                # 涉及的表都已加载到本地Parquet时，在嵌入式引擎中执行
+                results = local_engine.execute(sql, columnar, params)
+            else:
+                # 过滤条件中的字面量提取为参数，只是取值不同的查询复用连接上已准备好的语句；
+                # 结果缓存仍以带字面量的SQL为key
+                statement, statement_params = (sql, params) if params else parameterize(sql, dialect)
+                description, results = get_statement_cache(self.db).execute(statement, statement_params)
+                if columnar:
+                    names = [column[0] for column in description]
+                    results = rows_to_columns(results, names)
+            result = {
                 "status": "success",
                 "data": results
             }
+            cache.put(sql, result, variant)
+            return result
         except Exception as e:
             return {
                 "status": "error",
                 "error": str(e)
-            } 
\ No newline at end of file
+            }
+
+    def _dialect(self) -> str:
+        connection = getattr(self.db, "dbapi_connection", self.db)
+        if type(connection).__module__.startswith("sqlite3"):
+            return "sqlite"
+        return SQL_DIALECT
+
+    def _paramstyle(self) -> str:
+        """驱动模块声明的DB-API参数风格"""
+        connection = getattr(self.db, "dbapi_connection", self.db)
+        module = sys.modules.get(type(connection).__module__.split(".")[0])
+        return getattr(module, "paramstyle", "format")
+
+    def _server_side_cursor(self):
+        """尽量使用服务端游标，避免驱动把整个结果集缓冲在客户端内存中"""
+        connection = getattr(self.db, "dbapi_connection", self.db)
+        module = type(connection).__module__
+        if module.startswith("pymysql"):
+            import pymysql.cursors
+            return self.db.cursor(pymysql.cursors.SSCursor)
+        if module.startswith("MySQLdb"):
+            import MySQLdb.cursors
+            return self.db.cursor(MySQLdb.cursors.SSCursor)
+        if module.startswith("psycopg2"):
+            return self.db.cursor(name="sql_service_stream")
+        return self.db.cursor()
+
+    def execute_sql_stream(
+        self,
+        sql: str,
+        batch_size: int = STREAM_BATCH_SIZE,
+        columnar: bool = False
+    ) -> Iterator[Dict]:
+        """流式执行SQL，按固定行数分批产出结果，内存占用与结果集大小无关
+        Yields:
+            {"columns": [...]}，随后若干 {"rows": [...]}（columnar=True 时为 {"batch": {列名: 数组}}），
+            最后 {"status": "success", "row_count": N}；出错时产出 {"status": "error", "error": ...}
+        """
+        cursor = None
+        try:
+            cursor = self._server_side_cursor()
+            sql, params = parameterize(sql, self._dialect())
+            if params:
+                cursor.execute(*bind_params(sql, params, self._paramstyle()))
+            else:
+                cursor.execute(sql)
+            columns = [column[0] for column in cursor.description or []]
+            yield {"columns": columns}
+
+            row_count = 0
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                row_count += len(rows)
+                if columnar:
+                    yield {"batch": rows_to_columns(rows, columns)}
+                else:
+                    yield {"rows": [list(row) for row in rows]}
+            yield {"status": "success", "row_count": row_count}
+        except Exception as e:
+            yield {"status": "error", "error": str(e)}
+        finally:
+            if cursor is not None:
+                cursor.close()
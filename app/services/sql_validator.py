@@ -0,0 +1,283 @@
+import os
+import re
+from decimal import Decimal
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple, Union
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import ParseError
+from sqlglot.tokens import Tokenizer, TokenType
+from .schema_catalog import SchemaCatalog, get_schema_catalog
+
+# 执行端的SQL方言，模型输出的SQL会被改写为该方言
+SQL_DIALECT = os.getenv("SQL_DIALECT", "mysql")
+# 解析模型输出时依次尝试的方言，None 为sqlglot的通用方言
+_READ_DIALECTS = (None, "mysql", "postgres")
+
+_FENCE = re.compile(r"```(?:sql|mysql)?\s*(.*?)```", re.IGNORECASE | re.DOTALL)
+_STATEMENT_START = re.compile(r"\b(SELECT|WITH)\b", re.IGNORECASE)
+_STRING_OR_SEMICOLON = re.compile(r"'(?:[^'\\]|\\.|'')*'|;")
+# 命名占位符 :name，跳过字符串、带引号的标识符和 :: 类型转换
+_PLACEHOLDER = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.)*\"|`[^`]*`|(?<![:\w]):(\w+)|%")
+
+def _parses(sql: str) -> bool:
+    try:
+        parse_sql(sql)
+        return True
+    except ParseError:
+        return False
+
+def _is_bare_word(line: str) -> bool:
+    """整行只有一个不带引号的词：接在完整语句后只会被解析成隐式别名，如末尾的一句中文说明"""
+    try:
+        tokens = Tokenizer().tokenize(line)
+    except Exception:
+        return False
+    return len(tokens) == 1 and tokens[0].token_type == TokenType.VAR
+
+def extract_sql(text: str) -> str:
+    """从模型输出中提取SQL：去掉markdown代码块、前后的说明文字，只保留第一条语句
+
+    语句后的说明文字按解析结果去掉：保留能解析的最长前缀行，再去掉末尾单独成行、
+    只会被当作隐式别名的说明；都不能解析时原样返回，由校验报告语法错误。
+    """
+    fenced = _FENCE.search(text)
+    if fenced:
+        text = fenced.group(1)
+    start = _STATEMENT_START.search(text)
+    if start:
+        text = text[start.start():]
+    for match in _STRING_OR_SEMICOLON.finditer(text):
+        if match.group() == ";":
+            text = text[:match.start()]
+            break
+    lines = text.strip().splitlines()
+    end = next((k for k in range(len(lines), 0, -1) if _parses("\n".join(lines[:k]))), None)
+    if end is None:
+        return "\n".join(lines).strip()
+    while end > 1 and _is_bare_word(lines[end - 1]) and _parses("\n".join(lines[:end - 1])):
+        end -= 1
+    return "\n".join(lines[:end]).strip()
+
+def parse_sql(sql: str) -> exp.Expression:
+    """依次尝试各方言解析，只接受单条语句"""
+    error = None
+    for dialect in _READ_DIALECTS:
+        try:
+            statements = [s for s in sqlglot.parse(sql, read=dialect) if s is not None]
+        except ParseError as e:
+            error = e
+            continue
+        if len(statements) != 1:
+            raise ParseError("只允许单条SQL语句")
+        return statements[0]
+    raise error
+
+def table_aliases(tree: exp.Expression) -> Dict[str, str]:
+    """别名 -> 表名（库名.表名），不含CTE"""
+    ctes = {cte.alias.lower() for cte in tree.find_all(exp.CTE)}
+    tables = {}
+    for table in tree.find_all(exp.Table):
+        name = f"{table.db}.{table.name}" if table.db else table.name
+        if not table.db and name.lower() in ctes:
+            continue
+        tables[table.alias_or_name.lower()] = name.lower()
+    return tables
+
+def _concat_operands(node: exp.Expression) -> List[exp.Expression]:
+    if isinstance(node, exp.DPipe):
+        return _concat_operands(node.this) + _concat_operands(node.expression)
+    return [node]
+
+def _dpipe_to_concat(node: exp.Expression) -> exp.Expression:
+    if isinstance(node, exp.DPipe):
+        return exp.Concat(expressions=[operand.transform(_dpipe_to_concat) for operand in _concat_operands(node)])
+    return node
+
+def render_sql(tree: exp.Expression, dialect: str) -> str:
+    """按目标方言生成SQL文本
+
+    通用方言里的 || 是字符串拼接，而MySQL默认把 || 当作 OR，先统一改写为 CONCAT(...)
+    """
+    if tree.find(exp.DPipe) is not None:
+        tree = tree.transform(_dpipe_to_concat)
+    return tree.sql(dialect=dialect)
+
+@lru_cache(maxsize=4096)
+def compile_params(sql: str, paramstyle: str) -> Tuple[str, Tuple[str, ...]]:
+    """把SQL中的 :name 命名占位符改写为驱动的参数风格（DB-API paramstyle，另支持 dollar 即 $1）
+    Returns:
+        (改写后的SQL, 按出现顺序的参数名)，同一形态的SQL只改写一次
+    """
+    names: List[str] = []
+
+    def replace(match: re.Match) -> str:
+        name = match.group(1)
+        if name is None:
+            # 使用 %s 风格时SQL中原有的 %（包括字符串里的）需要转义
+            if paramstyle in ("format", "pyformat"):
+                return match.group().replace("%", "%%")
+            return match.group()
+        names.append(name)
+        if paramstyle == "qmark":
+            return "?"
+        if paramstyle == "format":
+            return "%s"
+        if paramstyle == "numeric":
+            return f":{len(names)}"
+        if paramstyle == "dollar":
+            return f"${len(names)}"
+        if paramstyle == "pyformat":
+            return f"%({name})s"
+        return match.group()
+
+    return _PLACEHOLDER.sub(replace, sql), tuple(names)
+
+def bind_params(sql: str, params: Dict[str, Any], paramstyle: str) -> Tuple[str, Union[list, Dict]]:
+    """按驱动的参数风格改写SQL并整理参数
+    Returns:
+        (改写后的SQL, 传给 cursor.execute 的参数列表或字典)
+    """
+    sql, names = compile_params(sql, paramstyle)
+    missing = [name for name in names if name not in params]
+    if missing:
+        raise KeyError(f"缺少SQL参数: {', '.join(missing)}")
+    if paramstyle in ("named", "pyformat"):
+        return sql, {name: params[name] for name in names}
+    return sql, [params[name] for name in names]
+
+def escape_like(value: str) -> str:
+    """转义LIKE模式中的通配符，用于把用户输入作为LIKE参数的一部分"""
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+# 字面量改为参数的谓词：比较、LIKE、BETWEEN、IN
+_PARAMETERIZABLE = (exp.EQ, exp.NEQ, exp.GT, exp.GTE, exp.LT, exp.LTE, exp.Like, exp.ILike, exp.Between, exp.In)
+
+@lru_cache(maxsize=4096)
+def _parameterize(sql: str, dialect: str) -> Tuple[str, Tuple[Tuple[str, Any], ...]]:
+    try:
+        tree = parse_sql(sql)
+    except ParseError:
+        return sql, ()
+    if tree.find(exp.Placeholder) is not None:
+        # 已经是参数化的SQL（如问题模板），不再改写
+        return sql, ()
+    params: List[Tuple[str, Any]] = []
+
+    def replace(node):
+        if (
+            not isinstance(node, exp.Literal)
+            or not isinstance(node.parent, _PARAMETERIZABLE)
+            or node.find_ancestor(exp.Where, exp.Having, exp.Join) is None
+        ):
+            return node
+        value = node.this
+        if not node.is_string:
+            # 小数按Decimal绑定，避免 0.1 这类字面量变成二进制浮点数后与DECIMAL列比较出错
+            value = Decimal(value) if re.search(r"[.eE]", value) else int(value)
+        name = f"p{len(params) + 1}"
+        params.append((name, value))
+        return exp.Placeholder(this=name)
+
+    tree = tree.transform(replace)
+    if not params:
+        return sql, ()
+    return render_sql(tree, dialect), tuple(params)
+
+def parameterize(sql: str, dialect: Optional[str] = None) -> Tuple[str, Dict[str, Any]]:
+    """把过滤条件中的字面量提取为 :p1、:p2... 参数
+
+    只是取值不同的查询因此得到同一条语句文本，可以复用驱动/数据库端已准备好的语句，
+    跳过重复的解析和生成执行计划。
+    Returns:
+        (参数化SQL, 参数)，没有可提取的字面量时原样返回SQL和空参数
+    """
+    sql, params = _parameterize(sql, dialect or SQL_DIALECT)
+    return sql, dict(params)
+
+def inline_params(sql: str, params: Dict[str, Any]) -> str:
+    """把参数值以字面量写回SQL，只用于日志展示和分区裁剪等分析，不用于执行"""
+    def literal(match: re.Match) -> str:
+        name = match.group(1)
+        if name is None or name not in params:
+            return match.group()
+        value = params[name]
+        if value is None:
+            return "NULL"
+        if isinstance(value, (int, float, Decimal)) and not isinstance(value, bool):
+            return str(value)
+        return "'" + str(value).replace("'", "''") + "'"
+
+    return _PLACEHOLDER.sub(literal, sql)
+
+def _error(message: str) -> Dict:
+    return {"status": "error", "error": f"SQL校验失败: {message}", "stage": "validate"}
+
+class SQLValidator:
+    """SQL解析、校验与方言转换
+
+    在发往数据库之前完成：提取SQL文本、解析、只允许查询语句、对照表结构目录检查表和字段、
+    改写为目标方言。校验结果按 (SQL, 方言, 目录版本) 缓存，重复的SQL不再解析。
+    """
+
+    def __init__(self, catalog: Optional[SchemaCatalog] = None, dialect: str = SQL_DIALECT):
+        self.catalog = catalog or get_schema_catalog()
+        self.dialect = dialect
+        self._validate_cached = lru_cache(maxsize=4096)(self._validate)
+
+    def validate(self, sql: str, dialect: Optional[str] = None) -> Dict:
+        """校验并转换SQL
+        Returns:
+            {"status": "success", "sql": 目标方言SQL, "tables": [...]}，
+            或 {"status": "error", "error": ..., "stage": "validate"}
+        """
+        return dict(self._validate_cached(sql, dialect or self.dialect, self.catalog.version))
+
+    def _validate(self, sql: str, dialect: str, catalog_version) -> Dict:
+        text = extract_sql(sql)
+        if not text:
+            return _error("未找到SQL语句")
+        try:
+            tree = parse_sql(text)
+        except ParseError as e:
+            return _error(f"语法错误: {str(e).splitlines()[0]}")
+        if not isinstance(tree, (exp.Select, exp.Union)):
+            return _error("只允许查询语句")
+
+        problems = self._check_schema(tree)
+        if problems:
+            return _error("; ".join(problems))
+        return {
+            "status": "success",
+            "sql": render_sql(tree, dialect),
+            "tables": sorted(table_aliases(tree).values())
+        }
+
+    def _check_schema(self, tree: exp.Expression) -> List[str]:
+        """对照表结构目录检查表名与字段名，目录中没有字段信息的表跳过字段检查"""
+        tables = table_aliases(tree)
+        columns = {alias: {c["name"].lower() for c in self.catalog.columns(table)} for alias, table in tables.items()}
+        problems = []
+        if self.catalog.loaded:
+            problems.extend(f"未知的表 {table}" for alias, table in tables.items() if not columns[alias])
+
+        select_aliases = {alias.alias.lower() for alias in tree.find_all(exp.Alias)}
+        # 有子查询或CTE时，不带表别名的字段可能来自派生表，只检查带别名的字段
+        simple_scope = not any(tree.find_all(exp.Subquery, exp.CTE)) and tables and all(columns.values())
+        for column in tree.find_all(exp.Column):
+            name = column.name.lower()
+            if name == "*" or not name:
+                continue
+            qualifier = column.table.lower()
+            if qualifier:
+                known = columns.get(qualifier)
+                if known and name not in known:
+                    problems.append(f"表 {tables[qualifier]} 没有字段 {column.name}")
+            elif simple_scope and name not in select_aliases and not any(name in known for known in columns.values()):
+                problems.append(f"未知的字段 {column.name}")
+        return problems
+
+@lru_cache(maxsize=1)
+def get_sql_validator() -> SQLValidator:
+    """进程内共享的SQL校验器"""
+    return SQLValidator()
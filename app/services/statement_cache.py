@@ -0,0 +1,164 @@
+import logging
+import os
+import sys
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from .sql_validator import bind_params, compile_params
+
+# 每个连接缓存的预编译语句数
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "128"))
+
+_stats_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "evictions": 0, "prepare_failures": 0}
+# 非池化的DB-API连接（没有 info 字典）按连接对象弱引用保存缓存
+_unpooled: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+def _count(key: str):
+    with _stats_lock:
+        _stats[key] += 1
+
+def _driver(connection) -> str:
+    return type(connection).__module__
+
+class StatementCache:
+    """单个数据库连接上的预编译语句缓存，按语句文本做LRU
+
+    执行参数化的SQL时，同一形态的语句只在第一次准备（解析、生成执行计划），之后只传参数执行：
+    - psycopg2：服务端 PREPARE 一次，之后 EXECUTE；淘汰时 DEALLOCATE
+    - mysql-connector：每条语句保留一个 prepared=True 的游标（二进制协议的预编译语句）
+    - sqlite3：驱动自带按语句文本的预编译缓存（cached_statements），这里只复用参数改写结果
+    - pymysql/MySQLdb 没有预编译语句协议，参数在客户端转义后以文本协议发送
+    """
+
+    def __init__(self, connection, size: int = DB_STATEMENT_CACHE_SIZE):
+        self.connection = connection
+        self.size = size
+        self._lock = threading.Lock()
+        self._statements: "OrderedDict[str, Any]" = OrderedDict()
+        self._sequence = 0
+        module = _driver(connection)
+        self._strategy = (
+            "psycopg2" if module.startswith("psycopg2")
+            else "mysql_connector" if module.startswith("mysql.connector")
+            else "plain"
+        )
+        driver = sys.modules.get(module.split(".")[0])
+        self.paramstyle = getattr(driver, "paramstyle", "format")
+        self.logger = logging.getLogger(__name__)
+
+    def __len__(self) -> int:
+        return len(self._statements)
+
+    def execute(self, sql: str, params: Optional[Dict[str, Any]] = None) -> Tuple[List, List]:
+        """执行 :name 占位符形式的SQL
+        Returns:
+            (cursor.description, 全部结果行)
+        """
+        params = params or {}
+        with self._lock:
+            handle = self._statements.get(sql)
+            if handle is not None:
+                self._statements.move_to_end(sql)
+                _count("hits")
+            else:
+                _count("misses")
+                handle = self._prepare(sql)
+                self._statements[sql] = handle
+                while len(self._statements) > self.size:
+                    _, evicted = self._statements.popitem(last=False)
+                    self._release(evicted)
+                    _count("evictions")
+            return self._execute(sql, handle, params)
+
+    def _prepare(self, sql: str):
+        if self._strategy == "psycopg2":
+            self._sequence += 1
+            name = f"stmt_{self._sequence}"
+            driver_sql, names = compile_params(sql, "dollar")
+            cursor = self.connection.cursor()
+            try:
+                cursor.execute(f"PREPARE {name} AS {driver_sql}")
+                return ("prepared", name, names)
+            except Exception as e:
+                # 参数类型无法推断等情况：回滚失败的事务，这条语句按普通方式执行
+                self.logger.debug(f"PREPARE failed, executing unprepared: {str(e)}")
+                self.connection.rollback()
+                _count("prepare_failures")
+                return ("plain", None, None)
+            finally:
+                cursor.close()
+        if self._strategy == "mysql_connector":
+            return ("cursor", self.connection.cursor(prepared=True), None)
+        return ("plain", None, None)
+
+    def _execute(self, sql: str, handle, params: Dict[str, Any]) -> Tuple[List, List]:
+        kind, target, names = handle
+        if kind == "prepared":
+            cursor = self.connection.cursor()
+            try:
+                placeholders = ", ".join(["%s"] * len(names))
+                cursor.execute(
+                    f"EXECUTE {target} ({placeholders})" if names else f"EXECUTE {target}",
+                    [params[name] for name in names] if names else None
+                )
+                return list(cursor.description or []), cursor.fetchall()
+            finally:
+                cursor.close()
+        if kind == "cursor":
+            driver_sql, args = bind_params(sql, params, "format")
+            target.execute(driver_sql, args)
+            return list(target.description or []), target.fetchall()
+
+        cursor = self.connection.cursor()
+        try:
+            if params:
+                cursor.execute(*bind_params(sql, params, self.paramstyle))
+            else:
+                cursor.execute(sql)
+            return list(cursor.description or []), cursor.fetchall()
+        finally:
+            cursor.close()
+
+    def _release(self, handle):
+        kind, target, _ = handle
+        try:
+            if kind == "prepared":
+                cursor = self.connection.cursor()
+                try:
+                    cursor.execute(f"DEALLOCATE {target}")
+                finally:
+                    cursor.close()
+            elif kind == "cursor":
+                target.close()
+        except Exception as e:
+            self.logger.debug(f"Failed to release prepared statement: {str(e)}")
+
+def get_statement_cache(connection) -> StatementCache:
+    """取连接上的语句缓存
+
+    连接池借出的连接把缓存放在连接记录的 info 中，随物理连接存活，连接被回收重建后自动换新。
+    """
+    dbapi_connection = getattr(connection, "dbapi_connection", connection)
+    info = getattr(connection, "info", None)
+    if isinstance(info, dict):
+        cache = info.get("statement_cache")
+        if cache is None or cache.connection is not dbapi_connection:
+            cache = StatementCache(dbapi_connection)
+            info["statement_cache"] = cache
+        return cache
+    try:
+        cache = _unpooled.get(dbapi_connection)
+        if cache is None:
+            cache = _unpooled[dbapi_connection] = StatementCache(dbapi_connection)
+        return cache
+    except TypeError:
+        # 不支持弱引用的连接对象，只在本次调用内使用
+        return StatementCache(dbapi_connection)
+
+def statement_cache_stats() -> Dict:
+    """所有连接汇总的语句缓存命中情况"""
+    with _stats_lock:
+        lookups = _stats["hits"] + _stats["misses"]
+        return dict(_stats, hit_rate=_stats["hits"] / lookups if lookups else 0.0)
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+# app/services/table_router.py
+"""本地表路由索引
+
+基于表名、chinese_name、description 预先构建中文二元组BM25索引，
+结合关键词与实体提示在进程内完成大部分问题的选表，置信度不足时再交给LLM。
+"""
+import argparse
+import json
+import math
+import os
+import re
+from collections import Counter, defaultdict
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Optional
+
+CONFIG_DIR = Path(__file__).parent.parent / "config"
+
+# 低于该置信度时回退到LLM选表
+TABLE_ROUTER_MIN_CONFIDENCE = float(os.getenv("TABLE_ROUTER_MIN_CONFIDENCE", "0.5"))
+# 回退LLM时放入提示词的候选表数量范围，置信度越低候选越多
+TABLE_PROMPT_TOP_K_MIN = int(os.getenv("TABLE_PROMPT_TOP_K_MIN", "5"))
+TABLE_PROMPT_TOP_K_MAX = int(os.getenv("TABLE_PROMPT_TOP_K_MAX", "20"))
+
+# 关键词提示：问题中出现关键词时直接命中对应的表
+KEYWORD_HINTS = {
+    "股票代码": ["ConstantDB.SecuMain"],
+    "证券代码": ["ConstantDB.SecuMain"],
+    "简称": ["ConstantDB.SecuMain"],
+    "上市日期": ["ConstantDB.SecuMain"],
+    "收盘价": ["AStockMarketQuotesDB.QT_DailyQuote"],
+    "开盘价": ["AStockMarketQuotesDB.QT_DailyQuote"],
+    "最高价": ["AStockMarketQuotesDB.QT_DailyQuote"],
+    "最低价": ["AStockMarketQuotesDB.QT_DailyQuote"],
+    "成交量": ["AStockMarketQuotesDB.QT_DailyQuote"],
+    "成交金额": ["AStockMarketQuotesDB.QT_DailyQuote"],
+    "成交额": ["AStockMarketQuotesDB.QT_DailyQuote"],
+    "涨停": ["AStockMarketQuotesDB.QT_DailyQuote"],
+    "跌停": ["AStockMarketQuotesDB.QT_DailyQuote"],
+    "涨跌幅": ["AStockMarketQuotesDB.QT_DailyQuote"],
+    "资产负债": ["AStockFinanceDB.LC_BalanceSheetAll"],
+    "总资产": ["AStockFinanceDB.LC_BalanceSheetAll"],
+    "总负债": ["AStockFinanceDB.LC_BalanceSheetAll"],
+    "净资产": ["AStockFinanceDB.LC_BalanceSheetAll"],
+    "营业收入": ["AStockFinanceDB.LC_IncomeStatementAll"],
+    "营业总收入": ["AStockFinanceDB.LC_IncomeStatementAll"],
+    "净利润": ["AStockFinanceDB.LC_IncomeStatementAll"],
+    "现金流": ["AStockFinanceDB.LC_CashFlowStatementAll"],
+    "分红": ["AStockFinanceDB.LC_Dividend"],
+    "派息": ["AStockFinanceDB.LC_Dividend"],
+    "股东户数": ["AStockShareholderDB.LC_SHNumber"],
+    "前十大股东": ["AStockShareholderDB.LC_MainSHListNew"],
+    "实际控制人": ["AStockShareholderDB.LC_ActualController"],
+    "质押": ["AStockShareholderDB.LC_ShareFP"],
+    "回购": ["AStockShareholderDB.LC_Buyback"],
+    "增减持": ["AStockShareholderDB.LC_TransferPlan"],
+    "员工持股": ["AStockShareholderDB.LC_ESOP"],
+    "停牌": ["AStockMarketQuotesDB.LC_SuspendResumption"],
+    "复牌": ["AStockMarketQuotesDB.LC_SuspendResumption"],
+    "概念板块": ["AStockIndustryDB.LC_COConcept", "AStockIndustryDB.LC_ConceptList"],
+    "所属行业": ["AStockIndustryDB.LC_ExgIndustry"],
+    "行业分类": ["AStockIndustryDB.LC_ExgIndustry"],
+    "研发": ["AStockFinanceDB.LC_IntAssetsDetail"],
+    "审计意见": ["AStockFinanceDB.LC_AuditOpinion"],
+    "主营业务": ["AStockFinanceDB.LC_MainOperIncome"],
+    "职工": ["AStockOperationsDB.LC_Staff"],
+    "报酬": ["AStockOperationsDB.LC_RewardStat"],
+    "担保": ["AStockEventsDB.LC_Warrant"],
+    "诉讼": ["AStockEventsDB.LC_SuitArbitration"],
+    "调研": ["AStockEventsDB.LC_InvestorRa"],
+    "交易日": ["ConstantDB.QT_TradingDayNew"],
+    "指数成份": ["IndexDB.LC_IndexComponent"],
+    "基金经理": ["PublicFundDB.MF_FundArchives"],
+    "基金公司": ["PublicFundDB.MF_InvestAdvisorOutline"],
+    "基金管理人": ["PublicFundDB.MF_InvestAdvisorOutline"],
+    "美股": ["ConstantDB.US_SecuMain"],
+    "港股": ["ConstantDB.HK_SecuMain"],
+}
+
+# 实体提示：问题提到具体证券时，需要证券主表关联 InnerCode/CompanyCode
+ENTITY_PATTERNS = [
+    # 证券代码
+    re.compile(r"(?<!\d)\d{6}(?!\d)"),
+    # 公司全称
+    re.compile(r"[\u4e00-\u9fff]{2,}(?:股份有限公司|集团|银行|控股)"),
+    # 以证券简称开头的问题，如"贵州茅台2021年…"、"万科A在…"、"中国平安的…"
+    re.compile(r"^[\u4e00-\u9fffA-Za-z]{2,10}?(?:的|在|\d{4}年)"),
+    # 答案是具体证券的问题，如"…最高的公司是哪家"
+    re.compile(r"哪家|哪只|哪些公司|哪些股票"),
+]
+# 以这些词开头的是泛指而非具体证券
+GENERIC_SUBJECTS = ("哪", "上市公司", "公司", "属于", "股票", "基金", "行业", "全部", "所有")
+ENTITY_TABLE = "ConstantDB.SecuMain"
+
+_CJK = re.compile(r"[\u4e00-\u9fff]+")
+_WORD = re.compile(r"[A-Z]?[a-z]+|[A-Z]+(?![a-z])|\d+")
+
+def tokenize(text: str) -> List[str]:
+    """中文按字二元组切分，英文按单词（含驼峰）切分"""
+    tokens = []
+    for segment in _CJK.findall(text):
+        if len(segment) == 1:
+            tokens.append(segment)
+        else:
+            tokens.extend(segment[i:i + 2] for i in range(len(segment) - 1))
+    tokens.extend(word.lower() for word in _WORD.findall(text))
+    return tokens
+
+def load_table_metadata() -> Dict[str, Dict]:
+    """加载表元数据配置"""
+    with open(CONFIG_DIR / "table_metadata.json", "r", encoding="utf-8") as f:
+        return json.load(f)["tables"]
+
+class TableRouter:
+    """表路由索引，构建一次后在进程内复用"""
+
+    def __init__(
+        self,
+        tables: Dict[str, Dict],
+        k1: float = 1.2,
+        b: float = 0.75,
+        name_weight: int = 3
+    ):
+        self.k1 = k1
+        self.b = b
+        self.table_names = list(tables.keys())
+        self._lower_names = {name.lower(): name for name in self.table_names}
+
+        # 每张表一个文档，chinese_name 重复 name_weight 次以提高权重
+        doc_tokens = []
+        for name, meta in tables.items():
+            tokens = tokenize(name.split(".")[-1])
+            tokens += tokenize(meta["chinese_name"]) * name_weight
+            tokens += tokenize(meta["description"])
+            doc_tokens.append(tokens)
+
+        self.doc_lengths = [len(tokens) for tokens in doc_tokens]
+        self.avg_length = sum(self.doc_lengths) / max(len(doc_tokens), 1)
+
+        # 倒排索引：token -> [(文档下标, 词频)]
+        self.postings = defaultdict(list)
+        for doc_id, tokens in enumerate(doc_tokens):
+            for token, tf in Counter(tokens).items():
+                self.postings[token].append((doc_id, tf))
+
+        n_docs = len(doc_tokens)
+        self.idf = {
+            token: math.log(1 + (n_docs - len(posting) + 0.5) / (len(posting) + 0.5))
+            for token, posting in self.postings.items()
+        }
+
+    def score(self, question: str) -> List[tuple]:
+        """返回按BM25得分降序排列的 [(表名, 得分)]"""
+        scores = defaultdict(float)
+        for token in set(tokenize(question)):
+            posting = self.postings.get(token)
+            if not posting:
+                continue
+            idf = self.idf[token]
+            for doc_id, tf in posting:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / self.avg_length)
+                scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return [(self.table_names[doc_id], score) for doc_id, score in ranked]
+
+    def _resolve(self, table: str) -> Optional[str]:
+        return self._lower_names.get(table.lower())
+
+    @staticmethod
+    def _mentions_entity(question: str) -> bool:
+        """问题是否提到具体的证券或公司"""
+        if question.startswith(GENERIC_SUBJECTS):
+            patterns = (ENTITY_PATTERNS[0], ENTITY_PATTERNS[-1])
+            return any(pattern.search(question) for pattern in patterns)
+        return any(pattern.search(question) for pattern in ENTITY_PATTERNS)
+
+    def route(self, question: str) -> Dict:
+        """为问题选表
+        Returns:
+            {"tables": [...], "confidence": 0~1, "scores": [(表名, 得分), ...], "hints": [...]}
+        """
+        ranked = self.score(question)
+        hints = [keyword for keyword in KEYWORD_HINTS if keyword in question]
+
+        tables = []
+        for keyword in hints:
+            for table in KEYWORD_HINTS[keyword]:
+                table = self._resolve(table)
+                if table and table not in tables:
+                    tables.append(table)
+
+        if hints:
+            # 关键词命中时置信度高，命中越多越可靠
+            confidence = min(1.0, 0.7 + 0.1 * len(hints))
+        elif ranked:
+            top_score = ranked[0][1]
+            second_score = ranked[1][1] if len(ranked) > 1 else 0.0
+            # 以第一名相对第二名的领先幅度作为置信度
+            confidence = (top_score - second_score) / top_score if top_score > 0 else 0.0
+            tables.append(ranked[0][0])
+        else:
+            confidence = 0.0
+
+        if tables and self._mentions_entity(question):
+            entity_table = self._resolve(ENTITY_TABLE)
+            if entity_table and entity_table not in tables:
+                tables.append(entity_table)
+
+        return {
+            "tables": tables,
+            "confidence": confidence,
+            "scores": ranked[:10],
+            "hints": hints
+        }
+
+    def candidates(self, question: str, confidence: Optional[float] = None) -> List[str]:
+        """返回放入LLM提示词的top-k候选表，k随置信度自适应
+
+        置信度为1时取 TABLE_PROMPT_TOP_K_MIN，为0时取 TABLE_PROMPT_TOP_K_MAX；
+        路由结果中的表总会被保留。问题与任何表都不相关时返回全部表。
+        """
+        routing = self.route(question)
+        if confidence is None:
+            confidence = routing["confidence"]
+        confidence = min(max(confidence, 0.0), 1.0)
+        k = round(TABLE_PROMPT_TOP_K_MAX - (TABLE_PROMPT_TOP_K_MAX - TABLE_PROMPT_TOP_K_MIN) * confidence)
+
+        ranked = self.score(question)
+        if not ranked:
+            return list(self.table_names)
+
+        tables = list(routing["tables"])
+        for table, _ in ranked:
+            if len(tables) >= k:
+                break
+            if table not in tables:
+                tables.append(table)
+        return tables
+
+    def evaluate(self, labelled: List[Dict], min_confidence: float = TABLE_ROUTER_MIN_CONFIDENCE) -> Dict:
+        """在标注集上评估召回率
+        Args:
+            labelled: [{"question": ..., "tables": [...], "held_out": 可选}]
+        Returns:
+            recall: 本地路由覆盖的标注表占比（全部问题）
+            routed_ratio: 置信度达标、无需回退LLM的问题占比
+            routed_recall: 本地路由问题上的召回率
+            held_out: 标为 held_out 的问题（措辞不含 KEYWORD_HINTS 中的关键词）上的同样指标，
+                      其余问题大多直接命中关键词提示，只有这部分反映索引本身的效果
+        """
+        held_out = [item for item in labelled if item.get("held_out")]
+        report = self._evaluate(labelled, min_confidence)
+        if held_out:
+            report["held_out"] = self._evaluate(held_out, min_confidence)
+        return report
+
+    def _evaluate(self, labelled: List[Dict], min_confidence: float) -> Dict:
+        total_gold = total_hit = 0
+        routed = routed_gold = routed_hit = 0
+        for item in labelled:
+            result = self.route(item["question"])
+            predicted = {table.lower() for table in result["tables"]}
+            gold = {table.lower() for table in item["tables"]}
+            hit = len(gold & predicted)
+            total_gold += len(gold)
+            total_hit += hit
+            if result["confidence"] >= min_confidence:
+                routed += 1
+                routed_gold += len(gold)
+                routed_hit += hit
+        return {
+            "questions": len(labelled),
+            "recall": total_hit / total_gold if total_gold else 0.0,
+            "routed_ratio": routed / len(labelled) if labelled else 0.0,
+            "routed_recall": routed_hit / routed_gold if routed_gold else 0.0
+        }
+
+@lru_cache(maxsize=1)
+def get_table_router() -> TableRouter:
+    """进程内共享的表路由索引"""
+    return TableRouter(load_table_metadata())
+
+def main(argv: Optional[list] = None):
+    parser = argparse.ArgumentParser(description="评估本地表路由在标注集上的召回率")
+    parser.add_argument("--labels", default=str(CONFIG_DIR / "table_routing_labels.json"))
+    parser.add_argument("--min-confidence", type=float, default=TABLE_ROUTER_MIN_CONFIDENCE)
+    args = parser.parse_args(argv)
+
+    with open(args.labels, "r", encoding="utf-8") as f:
+        labelled = json.load(f)
+    report = get_table_router().evaluate(labelled, args.min_confidence)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
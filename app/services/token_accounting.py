@@ -0,0 +1,82 @@
+import re
+import threading
+from collections import defaultdict
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+_CJK = re.compile(r"[　-〿一-鿿＀-￯]")
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算文本的token数
+
+    GLM系列分词器大约每个汉字0.6个token、每4个其他字符1个token，
+    只用于比较提示词体积，不追求与计费完全一致。
+    """
+    cjk = len(_CJK.findall(text))
+    other = len(text) - cjk
+    return int(cjk * 0.6 + other / 4) + 1
+
+class TokenLedger:
+    """按问题记录提示词token用量
+
+    baseline_tokens 是未做裁剪（全量表描述）时的token数，用于统计节省量。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: Dict[str, List[Dict]] = defaultdict(list)
+
+    def record(
+        self,
+        question: str,
+        stage: str,
+        prompt_tokens: int,
+        baseline_tokens: Optional[int] = None,
+        completion_tokens: int = 0
+    ):
+        """记录一次调用的token用量"""
+        entry = {
+            "stage": stage,
+            "prompt_tokens": prompt_tokens,
+            "baseline_tokens": prompt_tokens if baseline_tokens is None else baseline_tokens,
+            "completion_tokens": completion_tokens
+        }
+        with self._lock:
+            self._entries[question].append(entry)
+
+    def question_summary(self, question: str) -> Dict:
+        """单个问题的token汇总"""
+        with self._lock:
+            entries = list(self._entries.get(question, []))
+        return self._summarize(entries)
+
+    def summary(self) -> Dict:
+        """所有问题的token汇总"""
+        with self._lock:
+            entries = [entry for items in self._entries.values() for entry in items]
+            questions = len(self._entries)
+        result = self._summarize(entries)
+        result["questions"] = questions
+        return result
+
+    def reset(self):
+        with self._lock:
+            self._entries.clear()
+
+    @staticmethod
+    def _summarize(entries: List[Dict]) -> Dict:
+        prompt_tokens = sum(entry["prompt_tokens"] for entry in entries)
+        baseline_tokens = sum(entry["baseline_tokens"] for entry in entries)
+        saved = baseline_tokens - prompt_tokens
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": sum(entry["completion_tokens"] for entry in entries),
+            "baseline_tokens": baseline_tokens,
+            "saved_tokens": saved,
+            "saved_ratio": saved / baseline_tokens if baseline_tokens else 0.0
+        }
+
+@lru_cache(maxsize=1)
+def get_token_ledger() -> TokenLedger:
+    """进程内共享的token账本"""
+    return TokenLedger()
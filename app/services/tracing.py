@@ -0,0 +1,283 @@
+import asyncio
+import bisect
+import contextvars
+import functools
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, defaultdict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+# 每个阶段保留最近多少次耗时用于计算分位数
+TRACE_RESERVOIR_SIZE = int(os.getenv("TRACE_RESERVOIR_SIZE", "2048"))
+# 保留最近多少条链路的span明细
+TRACE_MAX_TRACES = int(os.getenv("TRACE_MAX_TRACES", "1000"))
+# 耗时直方图的桶上界（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+QUANTILES = (0.5, 0.95, 0.99)
+METRIC_PREFIX = "finance_qa"
+# 按数值累加导出为计数器的span属性
+COUNTER_ATTRIBUTES = ("prompt_tokens", "completion_tokens", "retries", "rows")
+# 指标由执行流水线的进程自己导出：Streamlit前端在该端口提供 /metrics，0表示不开启
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+_current: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+
+class Span:
+    """一次阶段执行：单调时钟计时，附带token数、重试次数、行数等属性"""
+
+    __slots__ = ("stage", "trace_id", "span_id", "parent_id", "start", "end", "started_at", "attributes", "_token")
+
+    def __init__(self, stage: str, parent: Optional["Span"] = None, attributes: Optional[Dict] = None):
+        self.stage = stage
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex[:16]
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.attributes: Dict[str, Any] = dict(attributes or {})
+        self._token = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    @property
+    def duration(self) -> float:
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+    @property
+    def failed(self) -> bool:
+        return self.attributes.get("status") == "error"
+
+    def to_dict(self) -> Dict:
+        return {
+            "stage": self.stage,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration * 1000, 3),
+            **self.attributes
+        }
+
+class _StageStats:
+    def __init__(self, reservoir_size: int):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.errors = 0
+        self.counters = defaultdict(float)
+        self.recent = deque(maxlen=reservoir_size)
+
+    def observe(self, span: Span):
+        duration = span.duration
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, duration)] += 1
+        self.count += 1
+        self.total += duration
+        self.errors += span.failed
+        self.recent.append(duration)
+        for name in COUNTER_ATTRIBUTES:
+            value = span.attributes.get(name)
+            if isinstance(value, (int, float)):
+                self.counters[name] += value
+
+    def quantile(self, q: float) -> float:
+        if not self.recent:
+            return 0.0
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class Tracer:
+    """进程内的阶段链路追踪与指标汇总
+
+    span 按上下文（contextvars）嵌套，同一条链路共享 trace_id；结束时按阶段累计耗时直方图、
+    最近耗时（算 p50/p95/p99）、错误数以及token/重试/行数计数，可导出为Prometheus文本格式。
+    """
+
+    def __init__(self, reservoir_size: int = TRACE_RESERVOIR_SIZE, max_traces: int = TRACE_MAX_TRACES):
+        self.reservoir_size = reservoir_size
+        self.max_traces = max_traces
+        self._lock = threading.Lock()
+        self._stages: Dict[str, _StageStats] = {}
+        self._traces: "OrderedDict[str, List[Dict]]" = OrderedDict()
+
+    def start(self, stage: str, activate: bool = False, **attributes) -> Span:
+        """开始一个span；activate=True 时成为当前上下文中后续span的父span，需由 finish 结束"""
+        span = Span(stage, _current.get(), attributes)
+        if activate:
+            span._token = _current.set(span)
+        return span
+
+    def current(self) -> Optional[Span]:
+        """当前上下文中激活的span"""
+        return _current.get()
+
+    def finish(self, span: Span):
+        span.end = time.perf_counter()
+        if span._token is not None:
+            _current.reset(span._token)
+            span._token = None
+        with self._lock:
+            stats = self._stages.get(span.stage)
+            if stats is None:
+                stats = self._stages[span.stage] = _StageStats(self.reservoir_size)
+            stats.observe(span)
+            spans = self._traces.get(span.trace_id)
+            if spans is None:
+                spans = self._traces[span.trace_id] = []
+                while len(self._traces) > self.max_traces:
+                    self._traces.popitem(last=False)
+            spans.append(span.to_dict())
+
+    @contextmanager
+    def span(self, stage: str, **attributes) -> Iterator[Span]:
+        """在代码块上记录一个span，抛出异常时标记为失败"""
+        span = self.start(stage, activate=True, **attributes)
+        try:
+            yield span
+        except Exception as e:
+            span.set(status="error", error=str(e))
+            raise
+        finally:
+            self.finish(span)
+
+    def trace(self, trace_id: str) -> List[Dict]:
+        """一条链路中已结束的span，按开始时间排序"""
+        with self._lock:
+            spans = list(self._traces.get(trace_id, []))
+        return sorted(spans, key=lambda s: s["started_at"])
+
+    def summary(self) -> Dict[str, Dict]:
+        """各阶段的次数、错误数、平均和分位耗时（秒）"""
+        with self._lock:
+            return {
+                stage: {
+                    "count": stats.count,
+                    "errors": stats.errors,
+                    "mean": stats.total / stats.count if stats.count else 0.0,
+                    **{f"p{int(q * 100)}": stats.quantile(q) for q in QUANTILES},
+                    **{name: value for name, value in stats.counters.items()}
+                }
+                for stage, stats in sorted(self._stages.items())
+            }
+
+    def render_prometheus(self) -> str:
+        """Prometheus文本格式：耗时直方图、分位数摘要、错误数和各计数器"""
+        duration = f"{METRIC_PREFIX}_stage_duration_seconds"
+        latency = f"{METRIC_PREFIX}_stage_latency_seconds"
+        lines = [
+            f"# HELP {duration} Stage latency histogram.",
+            f"# TYPE {duration} histogram"
+        ]
+        with self._lock:
+            stages = sorted(self._stages.items())
+            for stage, stats in stages:
+                label = f'stage="{_escape(stage)}"'
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS, stats.buckets):
+                    cumulative += count
+                    lines.append(f'{duration}_bucket{{{label},le="{bound}"}} {cumulative}')
+                lines.append(f'{duration}_bucket{{{label},le="+Inf"}} {stats.count}')
+                lines.append(f"{duration}_sum{{{label}}} {stats.total}")
+                lines.append(f"{duration}_count{{{label}}} {stats.count}")
+
+            lines += [
+                f"# HELP {latency} Stage latency quantiles over the most recent {self.reservoir_size} spans.",
+                f"# TYPE {latency} summary"
+            ]
+            for stage, stats in stages:
+                label = f'stage="{_escape(stage)}"'
+                for q in QUANTILES:
+                    lines.append(f'{latency}{{{label},quantile="{q}"}} {stats.quantile(q)}')
+                lines.append(f"{latency}_sum{{{label}}} {stats.total}")
+                lines.append(f"{latency}_count{{{label}}} {stats.count}")
+
+            errors = f"{METRIC_PREFIX}_stage_errors_total"
+            lines += [f"# HELP {errors} Failed stage executions.", f"# TYPE {errors} counter"]
+            lines += [f'{errors}{{stage="{_escape(stage)}"}} {stats.errors}' for stage, stats in stages]
+
+            for name in COUNTER_ATTRIBUTES:
+                metric = f"{METRIC_PREFIX}_stage_{name}_total"
+                lines += [f"# HELP {metric} Sum of {name} recorded on stage spans.", f"# TYPE {metric} counter"]
+                lines += [
+                    f'{metric}{{stage="{_escape(stage)}"}} {stats.counters[name]}'
+                    for stage, stats in stages if name in stats.counters
+                ]
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+            self._traces.clear()
+
+_tracer = Tracer()
+
+def get_tracer() -> Tracer:
+    """进程内共享的追踪器"""
+    return _tracer
+
+def start_metrics_server(port: int, render: Callable[[], str]) -> ThreadingHTTPServer:
+    """在后台线程中以 GET /metrics 提供Prometheus文本，用于没有Web框架路由的进程（如Streamlit）"""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
+
+def traced(stage: str, describe: Optional[Callable[[Any], Dict]] = None):
+    """把同步或异步方法的执行记录为一个span，describe 从返回值提取span属性"""
+    def decorator(fn):
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with _tracer.span(stage) as span:
+                    result = await fn(*args, **kwargs)
+                    if describe is not None:
+                        span.set(**describe(result))
+                    return result
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with _tracer.span(stage) as span:
+                result = fn(*args, **kwargs)
+                if describe is not None:
+                    span.set(**describe(result))
+                return result
+        return wrapper
+    return decorator
+
+def row_count(data: Any) -> int:
+    """查询结果的行数，兼容行列表和列式结果"""
+    if isinstance(data, dict):
+        return len(next(iter(data.values()), ()))
+    return len(data) if isinstance(data, (list, tuple)) else 0
+
+def describe_result(result: Any) -> Dict:
+    """SQL执行结果的span属性：行数或错误"""
+    if isinstance(result, dict) and result.get("status") == "error":
+        return {"status": "error", "error": str(result.get("error", ""))[:200]}
+    if isinstance(result, dict):
+        return {"rows": row_count(result.get("data"))}
+    return {}
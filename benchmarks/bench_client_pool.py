@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# benchmarks/bench_client_pool.py
+"""对比每次新建OpenAI客户端与复用连接池客户端的单次调用延迟
+
+用法: python benchmarks/bench_client_pool.py --calls 200
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app", "frontend"))
+
+from openai import OpenAI
+from utils.llm_client import get_client, close_clients
+from mock_llm_server import start_server
+
+MESSAGES = [{"role": "user", "content": "ping"}]
+
+def _measure(make_client, calls: int) -> list:
+    latencies = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        client = make_client()
+        client.chat.completions.create(model="mock", messages=MESSAGES)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+def _report(name: str, latencies: list):
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f"{name:<12} mean={statistics.mean(latencies):7.2f}ms "
+          f"p50={statistics.median(latencies):7.2f}ms p95={p95:7.2f}ms")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.0, help="模拟服务端延迟（秒）")
+    args = parser.parse_args()
+
+    server, base_url = start_server(latency=args.latency)
+    try:
+        fresh = _measure(lambda: OpenAI(api_key="mock", base_url=base_url), args.calls)
+        pooled = _measure(lambda: get_client("mock", base_url), args.calls)
+    finally:
+        close_clients()
+        server.shutdown()
+
+    _report("fresh", fresh)
+    _report("pooled", pooled)
+    saved = statistics.mean(fresh) - statistics.mean(pooled)
+    print(f"saved per call: {saved:.2f}ms")
+
+if __name__ == "__main__":
+    main()
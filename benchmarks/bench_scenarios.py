@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+# benchmarks/bench_scenarios.py
+"""离线场景压测：模拟LLM服务 + 合成金融数据库 + 回放问题文件
+
+对每个 (执行引擎, 规模因子) 组合启动一个独立子进程，避免缓存和内存统计互相影响：
+子进程生成/复用合成数据库（DuckDB引擎另导出为Parquet），启动按规则回复的模拟LLM服务，
+把 /fields、/query 请求交给真实的 SQLService 在合成库上执行，然后用 AsyncQuestionService
+并发回放问题文件。输出吞吐量、端到端与各阶段（追踪span）的 p50/p95/p99 耗时和进程内存峰值。
+
+每个组合默认执行 --runs 次，各指标取中位数，降低单次运行的抖动。
+结果可保存为基线（benchmarks/baselines/<名称>.json），之后的运行与基线对比，超出容忍度的指标标记为回退。
+耗时与机器相关，基线不提交到仓库，需先在同一台机器上记录；与其他机器记录的基线对比时会给出提示。
+
+用法:
+  python benchmarks/bench_scenarios.py --scale 1 10 --engine sqlite duckdb
+  python benchmarks/bench_scenarios.py --save-baseline reference
+  python benchmarks/bench_scenarios.py --compare reference --fail-on-regression
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+SCENARIO_DIR = os.path.join(BENCH_DIR, "scenarios")
+BASELINE_DIR = os.path.join(BENCH_DIR, "baselines")
+
+# 各阶段耗时低于该值（毫秒）的变化视为噪声，不判定为回退
+STAGE_NOISE_FLOOR_MS = 2.0
+# 样本数少于该值时p95接近最大值，很不稳定，改为对比p50
+MIN_P95_SAMPLES = 100
+
+def load_questions(path: str) -> List[str]:
+    """读取与前端上传格式相同的问题文件：[{"tid", "team": [{"id", "question"}]}]"""
+    with open(path, "r", encoding="utf-8") as f:
+        groups = json.load(f)
+    return [q["question"] for group in groups for q in group["team"]]
+
+def _percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0}
+    ordered = sorted(values)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {"p50": statistics.median(ordered), "p95": pick(0.95), "p99": pick(0.99)}
+
+def _max_rss_mb() -> float:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以KB为单位，macOS 以字节为单位
+    return rss / 1024 / 1024 if sys.platform == "darwin" else rss / 1024
+
+def _build_parquet(engine, root: str):
+    """把合成库中的表导出为本地引擎的Parquet目录，已导出时跳过"""
+    from services.local_engine import MANIFEST_FILE, load_table
+    from fixture import SCHEMAS
+
+    connection = engine.raw_connection()
+    try:
+        for table, schema in SCHEMAS.items():
+            if not os.path.exists(os.path.join(root, schema, table, MANIFEST_FILE)):
+                load_table(connection, f"{schema}.{table}", root)
+    finally:
+        connection.close()
+
+def run_one(config: Dict) -> Dict:
+    """在当前进程中执行一个组合，环境变量（缓存路径、本地引擎开关）已由父进程设置"""
+    sys.path.append(BENCH_DIR)
+    sys.path.append(os.path.join(ROOT, "app"))
+    sys.path.append(os.path.join(ROOT, "app", "frontend"))
+
+    from fixture import build_fixture, create_engine, fixture_path
+    from mock_llm_server import ResponseRules, start_server
+    from services.entity_index import get_entity_index
+    from services.question_cache import get_question_cache
+    from services.question_service import AsyncQuestionService
+    from services.question_templates import get_template_registry
+    from services.result_cache import get_result_cache
+    from services.schema_catalog import get_schema_catalog
+    from services.sql_service import SQLService
+    from utils.llm_client import close_async_clients
+    from services.tracing import describe_result, get_tracer
+
+    rss_before = _max_rss_mb()
+    path = build_fixture(fixture_path(config["scale"], config["fixture_dir"]), config["scale"])
+    engine = create_engine(path, pool_size=config["concurrency"])
+    if config["engine"] == "duckdb":
+        _build_parquet(engine, os.environ["LOCAL_ENGINE_DIR"])
+
+    connection = engine.raw_connection()
+    try:
+        get_schema_catalog().refresh(connection, force=True)
+        get_entity_index().load(connection)
+    finally:
+        connection.close()
+
+    tracer = get_tracer()
+
+    def backend(endpoint: str, body: Dict) -> Dict:
+        # 与后端一样，每个请求从连接池借出连接
+        connection = engine.raw_connection()
+        try:
+            service = SQLService(connection)
+            if endpoint == "fields":
+                with tracer.span("db.get_fields"):
+                    return service.get_fields(body.get("tables", []))
+            with tracer.span("db.execute_sql") as span:
+                result = service.execute_sql(body["sql"], params=body.get("params"))
+                span.set(**describe_result(result))
+                return result
+        finally:
+            connection.close()
+
+    responses = ResponseRules.load(config["responses"])
+    server, base_url = start_server(latency=config["latency"], responses=responses, backend=backend)
+    questions = load_questions(config["questions"])
+    latencies: List[float] = []
+    succeeded = 0
+
+    async def replay():
+        nonlocal succeeded
+        service = AsyncQuestionService("mock", base_url=base_url, model="mock")
+        semaphore = asyncio.Semaphore(config["concurrency"])
+
+        async def one(question: str):
+            nonlocal succeeded
+            async with semaphore:
+                start = time.perf_counter()
+                answer = await service.answer(question)
+                latencies.append(time.perf_counter() - start)
+                result = answer.get("result")
+                succeeded += isinstance(result, dict) and result.get("status") == "success"
+
+        for _ in range(config["repeat"]):
+            if not config["warm"]:
+                # 每轮都是冷启动：清空问题流水线缓存和结果缓存
+                get_question_cache().clear()
+                get_result_cache().clear()
+            await asyncio.gather(*(one(q) for q in questions))
+        await close_async_clients()
+
+    tracer.reset()
+    get_template_registry().reset()
+    start = time.perf_counter()
+    try:
+        asyncio.run(replay())
+    finally:
+        server.shutdown()
+        engine.dispose()
+    elapsed = time.perf_counter() - start
+
+    total = len(questions) * config["repeat"]
+    stages = {
+        stage: {
+            "count": s["count"],
+            "errors": s["errors"],
+            **{key: round(s[key] * 1000, 3) for key in ("mean", "p50", "p95", "p99")}
+        }
+        for stage, s in tracer.summary().items()
+    }
+    rss_peak = _max_rss_mb()
+    return {
+        "engine": config["engine"],
+        "scale": config["scale"],
+        "questions": total,
+        "succeeded": succeeded,
+        "template_answered": get_template_registry().stats()["answered"],
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput": round(total / elapsed, 3),
+        "latency_ms": {k: round(v * 1000, 3) for k, v in _percentiles(latencies).items()},
+        "stages": stages,
+        "memory_mb": {"rss_peak": round(rss_peak, 1), "rss_growth": round(rss_peak - rss_before, 1)}
+    }
+
+def _spawn(config: Dict) -> Dict:
+    """在子进程中执行一个组合，返回其结果"""
+    cache_dir = tempfile.mkdtemp(prefix="bench-")
+    env = dict(
+        os.environ,
+        QUESTION_CACHE_URL="sqlite:///" + os.path.join(cache_dir, "question_cache.sqlite3"),
+        LOCAL_ENGINE="1" if config["engine"] == "duckdb" else "0",
+        LOCAL_ENGINE_DIR=os.path.join(config["fixture_dir"], f"parquet-sf{config['scale']:g}"),
+        DATABASE_URL="sqlite:///" + os.path.join(config["fixture_dir"], f"finance-sf{config['scale']:g}.sqlite3")
+    )
+    env.pop("SCHEMA_CATALOG_SNAPSHOT", None)
+    env.pop("ENTITY_INDEX_SNAPSHOT", None)
+    completed = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--run-one", json.dumps(config)],
+        env=env, capture_output=True, text=True
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"{config['engine']} sf={config['scale']:g} failed:\n{completed.stderr[-4000:]}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+def _median_run(runs: List[Dict]):
+    """同一组合多次运行的结果逐项取中位数；只在部分运行中出现的阶段丢弃"""
+    first = runs[0]
+    if isinstance(first, dict):
+        return {key: _median_run([run[key] for run in runs]) for key in first if all(key in run for run in runs)}
+    if isinstance(first, (int, float)) and not isinstance(first, bool):
+        return round(statistics.median(runs), 3)
+    return first
+
+def run_key(run: Dict) -> str:
+    return f"{run['engine']}-sf{run['scale']:g}"
+
+def print_run(run: Dict):
+    latency = run["latency_ms"]
+    print(
+        f"\n== {run_key(run)}: {run['questions']} questions, {run['succeeded']} succeeded, "
+        f"{run['template_answered']} answered by templates"
+    )
+    print(
+        f"throughput {run['throughput']:.1f} q/s  elapsed {run['elapsed_seconds']:.2f}s  "
+        f"latency p50/p95/p99 {latency['p50']:.1f}/{latency['p95']:.1f}/{latency['p99']:.1f} ms  "
+        f"rss peak {run['memory_mb']['rss_peak']:.0f} MB (+{run['memory_mb']['rss_growth']:.0f})"
+    )
+    print(f"{'stage':<32}{'count':>7}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for stage, s in run["stages"].items():
+        print(f"{stage:<32}{s['count']:>7}{s['errors']:>8}{s['p50']:>10.1f}{s['p95']:>10.1f}{s['p99']:>10.1f}")
+
+def _baseline_path(name: str) -> str:
+    return name if name.endswith(".json") else os.path.join(BASELINE_DIR, f"{name}.json")
+
+def save_baseline(name: str, runs: List[Dict], config: Dict):
+    os.makedirs(BASELINE_DIR, exist_ok=True)
+    baseline = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "host": platform.node(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": config,
+        "runs": {run_key(run): run for run in runs}
+    }
+    with open(_baseline_path(name), "w", encoding="utf-8") as f:
+        json.dump(baseline, f, ensure_ascii=False, indent=2)
+    print(f"\nSaved baseline to {_baseline_path(name)}")
+
+def compare(runs: List[Dict], name: str, tolerance: float) -> List[str]:
+    """与基线对比，返回回退的指标列表
+    吞吐量下降、端到端/各阶段p95上升、内存峰值上升超过 tolerance（比例）视为回退；
+    样本数不足 MIN_P95_SAMPLES 的端到端耗时和阶段对比p50
+    """
+    with open(_baseline_path(name), "r", encoding="utf-8") as f:
+        recorded = json.load(f)
+    baseline = recorded["runs"]
+    regressions = []
+    if recorded.get("host") != platform.node() or recorded.get("platform") != platform.platform():
+        print(
+            f"\nWARNING: baseline {name} was recorded on {recorded.get('host') or 'another machine'} "
+            f"({recorded.get('platform')}); timings are only comparable on the same machine"
+        )
+
+    def check(label: str, old: float, new: float, higher_is_better: bool = False, floor: float = 0.0):
+        if not old:
+            return
+        change = (new - old) / old
+        worse = -change if higher_is_better else change
+        regressed = worse > tolerance and abs(new - old) > floor
+        print(f"  {label:<40}{old:>12.1f}{new:>12.1f}{change:>+10.1%}{'  REGRESSION' if regressed else ''}")
+        if regressed:
+            regressions.append(label)
+
+    print(f"\nComparison with baseline {name} (tolerance {tolerance:.0%})")
+    for run in runs:
+        key = run_key(run)
+        old = baseline.get(key)
+        if old is None:
+            print(f"{key}: not in baseline")
+            continue
+        print(f"{key}:{'baseline':>44}{'current':>12}{'change':>10}")
+        check(f"{key} throughput", old["throughput"], run["throughput"], higher_is_better=True)
+        metric = "p95" if min(run["questions"], old["questions"]) >= MIN_P95_SAMPLES else "p50"
+        check(f"{key} latency {metric}", old["latency_ms"][metric], run["latency_ms"][metric], floor=STAGE_NOISE_FLOOR_MS)
+        for stage, s in run["stages"].items():
+            if stage in old["stages"]:
+                metric = "p95" if min(s["count"], old["stages"][stage]["count"]) >= MIN_P95_SAMPLES else "p50"
+                check(f"{key} {stage} {metric}", old["stages"][stage][metric], s[metric], floor=STAGE_NOISE_FLOOR_MS)
+        check(f"{key} rss peak", old["memory_mb"]["rss_peak"], run["memory_mb"]["rss_peak"])
+    return regressions
+
+def main(argv: Optional[list] = None):
+    parser = argparse.ArgumentParser(description="离线场景压测")
+    parser.add_argument("--questions", default=os.path.join(SCENARIO_DIR, "basic_questions.json"), help="问题文件")
+    parser.add_argument("--responses", default=os.path.join(SCENARIO_DIR, "basic_responses.json"), help="模拟LLM的预置回复规则")
+    parser.add_argument("--scale", type=float, nargs="+", default=[1], help="合成数据库的规模因子")
+    parser.add_argument("--engine", nargs="+", default=["sqlite"], choices=["sqlite", "duckdb"])
+    parser.add_argument("--latency", type=float, default=0.05, help="模拟LLM单次调用延迟（秒）")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=3, help="问题文件回放轮数")
+    parser.add_argument("--runs", type=int, default=3, help="每个组合执行的次数，各指标取中位数")
+    parser.add_argument("--warm", action="store_true", help="轮与轮之间不清空缓存")
+    parser.add_argument("--fixture-dir", default=os.path.join(ROOT, ".cache", "bench"))
+    parser.add_argument("--save-baseline", metavar="NAME", help="把结果保存为基线")
+    parser.add_argument("--compare", metavar="NAME", help="与基线对比")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="判定回退的相对变化")
+    parser.add_argument("--fail-on-regression", action="store_true", help="有回退时以非零状态退出")
+    parser.add_argument("--json", action="store_true", help="输出JSON格式的结果")
+    parser.add_argument("--run-one", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.run_one:
+        print(json.dumps(run_one(json.loads(args.run_one)), ensure_ascii=False))
+        return
+
+    config = {
+        "questions": os.path.abspath(args.questions),
+        "responses": os.path.abspath(args.responses),
+        "latency": args.latency,
+        "concurrency": args.concurrency,
+        "repeat": args.repeat,
+        "warm": args.warm,
+        "fixture_dir": os.path.abspath(args.fixture_dir)
+    }
+    runs = []
+    for engine in args.engine:
+        for scale in args.scale:
+            run = _median_run([_spawn(dict(config, engine=engine, scale=scale)) for _ in range(args.runs)])
+            runs.append(run)
+            if not args.json:
+                print_run(run)
+    if args.json:
+        print(json.dumps(runs, ensure_ascii=False, indent=2))
+
+    if args.save_baseline:
+        save_baseline(args.save_baseline, runs, {k: v for k, v in config.items() if k != "fixture_dir"})
+    if args.compare:
+        regressions = compare(runs, args.compare, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s)")
+            if args.fail_on_regression:
+                sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# benchmarks/bench_streaming.py
+"""对比阻塞式调用的完整响应时间与流式调用的首token时间（感知延迟）
+
+对本地模拟LLM服务分别用阻塞式和流式方式生成SQL，同时校验两种方式得到的文本一致。
+用法: python benchmarks/bench_streaming.py --calls 20 --latency 0.3 --token-delay 0.02
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app", "frontend"))
+
+from utils.api_client import stream_api
+from utils.llm_client import get_client, close_clients
+from mock_llm_server import start_server
+
+CONTENT = (
+    "SELECT sm.SecuCode, sm.SecuAbbr, qt.ClosePrice\n"
+    "FROM astockmarketquotesdb.qt_dailyquote qt\n"
+    "JOIN constantdb.secumain sm ON qt.InnerCode = sm.InnerCode\n"
+    "WHERE qt.TradingDay = '2021-12-31' AND sm.SecuAbbr = '平安银行'"
+)
+PARAMS = {"question": "平安银行2021年12月31日的收盘价是多少？", "tables": [], "fields": {}}
+
+def _blocking(base_url: str, calls: int) -> list:
+    client = get_client("mock", base_url)
+    latencies = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        content = client.chat.completions.create(
+            model="mock", messages=[{"role": "user", "content": "sql"}]
+        ).choices[0].message.content
+        latencies.append((time.perf_counter() - start) * 1000)
+        assert content == CONTENT
+    return latencies
+
+def _streaming(base_url: str, calls: int) -> tuple:
+    first_tokens, totals = [], []
+    for _ in range(calls):
+        start = time.perf_counter()
+        text = ""
+        for delta in stream_api("generate_sql", PARAMS, "mock", base_url, "mock"):
+            if not text:
+                first_tokens.append((time.perf_counter() - start) * 1000)
+            text += delta
+        totals.append((time.perf_counter() - start) * 1000)
+        assert text == CONTENT
+    return first_tokens, totals
+
+def _report(name: str, latencies: list):
+    print(f"{name:<22} mean={statistics.mean(latencies):8.2f}ms p50={statistics.median(latencies):8.2f}ms")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--calls", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.3, help="首token前的模拟延迟（秒）")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="相邻token的模拟间隔（秒）")
+    args = parser.parse_args()
+
+    server, base_url = start_server(latency=args.latency, content=CONTENT, token_delay=args.token_delay)
+    try:
+        # 阻塞式请求时模拟服务一次返回整段内容，这里补上等价的逐token生成时间
+        server.latency = args.latency + args.token_delay * len(CONTENT) / server.token_size
+        blocking = _blocking(base_url, args.calls)
+        server.latency = args.latency
+        first_tokens, totals = _streaming(base_url, args.calls)
+    finally:
+        server.shutdown()
+        close_clients()
+
+    _report("blocking (full)", blocking)
+    _report("streaming (first)", first_tokens)
+    _report("streaming (full)", totals)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+# benchmarks/fixture.py
+"""合成的金融数据库，用于离线压测
+
+生成 secumain、qt_dailyquote、lc_balancesheetall（以及 lc_namechange）四张表的SQLite文件，
+数据量按规模因子线性放大：scale=1 约100只证券、5万行日行情。数据由固定种子生成，同一规模每次完全相同。
+表建在主库中，连接时再把同一个文件按 constantdb、astockmarketquotesdb 等库名各挂载一次，
+生产环境中带库名的SQL不用改写即可执行。
+
+用法: python benchmarks/fixture.py --scale 1 10 --output .cache/bench
+"""
+import argparse
+import os
+import random
+import sqlite3
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURE_DIR = os.path.join(ROOT, ".cache", "bench")
+
+# 每个规模因子对应的证券数
+SECURITIES_PER_SCALE = 100
+QUOTE_START = date(2020, 1, 1)
+QUOTE_END = date(2021, 12, 31)
+REPORT_YEARS = (2019, 2020, 2021)
+# 每个交易日涨停的概率
+LIMIT_UP_PROBABILITY = 0.02
+
+# 表名 -> 所在库，连接时按库名挂载
+SCHEMAS = {
+    "secumain": "constantdb",
+    "qt_dailyquote": "astockmarketquotesdb",
+    "lc_balancesheetall": "astockfinancedb",
+    "lc_namechange": "astockbasicinfodb"
+}
+
+DDL = """
+CREATE TABLE secumain (
+    ID INTEGER PRIMARY KEY,
+    InnerCode INTEGER NOT NULL UNIQUE,
+    CompanyCode INTEGER NOT NULL,
+    SecuCode TEXT NOT NULL,
+    SecuAbbr TEXT,
+    ChiName TEXT,
+    ChiNameAbbr TEXT,
+    SecuMarket INTEGER,
+    SecuCategory INTEGER,
+    ListedDate TEXT,
+    ListedState INTEGER
+);
+CREATE INDEX idx_secumain_company ON secumain (CompanyCode);
+CREATE INDEX idx_secumain_code ON secumain (SecuCode);
+
+CREATE TABLE qt_dailyquote (
+    ID INTEGER PRIMARY KEY,
+    InnerCode INTEGER NOT NULL,
+    TradingDay TEXT NOT NULL,
+    PrevClosePrice REAL,
+    OpenPrice REAL,
+    HighPrice REAL,
+    LowPrice REAL,
+    ClosePrice REAL,
+    TurnoverVolume REAL,
+    TurnoverValue REAL,
+    ChangePCT REAL
+);
+CREATE UNIQUE INDEX idx_quote_inner_day ON qt_dailyquote (InnerCode, TradingDay);
+CREATE INDEX idx_quote_day ON qt_dailyquote (TradingDay);
+
+CREATE TABLE lc_balancesheetall (
+    ID INTEGER PRIMARY KEY,
+    CompanyCode INTEGER NOT NULL,
+    InfoPublDate TEXT,
+    EndDate TEXT NOT NULL,
+    IfAdjusted INTEGER,
+    IfMerged INTEGER,
+    TotalAssets REAL,
+    TotalLiability REAL,
+    TotalShareholderEquity REAL
+);
+CREATE INDEX idx_balance_company_end ON lc_balancesheetall (CompanyCode, EndDate);
+CREATE INDEX idx_balance_end ON lc_balancesheetall (EndDate);
+
+CREATE TABLE lc_namechange (
+    ID INTEGER PRIMARY KEY,
+    CompanyCode INTEGER NOT NULL,
+    ChangeDate TEXT,
+    ChiName TEXT,
+    ChiNameAbbr TEXT,
+    SecuAbbr TEXT
+);
+CREATE INDEX idx_namechange_company ON lc_namechange (CompanyCode);
+"""
+
+# 真实存在的几只证券，保证样例问题能解析到实体
+KNOWN_SECURITIES = [
+    (3, 3, "000001", "平安银行", "平安银行股份有限公司", 90),
+    (6, 6, "000002", "万科A", "万科企业股份有限公司", 90),
+    (1120, 1043, "600000", "浦发银行", "上海浦东发展银行股份有限公司", 83),
+    (1133, 1055, "600036", "招商银行", "招商银行股份有限公司", 83),
+    (1576, 1485, "600519", "贵州茅台", "贵州茅台酒股份有限公司", 83)
+]
+KNOWN_NAME_CHANGES = [
+    (3, "1999-07-16", "深圳发展银行股份有限公司", "深发展", "深发展A")
+]
+_NAME_HEADS = "华中东海新金天国长恒安盛泰宏鼎瑞嘉明星远"
+_NAME_TAILS = "科源达通信联丰润阳成"
+_INDUSTRIES = ("科技", "电子", "医药", "能源", "材料", "汽车", "食品", "传媒", "化工", "建设")
+
+def fixture_path(scale: float, directory: str = FIXTURE_DIR) -> str:
+    return os.path.join(directory, f"finance-sf{scale:g}.sqlite3")
+
+def trading_days(start: date = QUOTE_START, end: date = QUOTE_END) -> List[str]:
+    """区间内的工作日（不考虑节假日）"""
+    days = []
+    day = start
+    while day <= end:
+        if day.weekday() < 5:
+            days.append(day.isoformat())
+        day += timedelta(days=1)
+    return days
+
+def _synthetic_names(count: int) -> Iterator[Tuple[str, str]]:
+    """不重复的 (证券简称, 公司全称)，组合用尽后追加序号"""
+    produced = 0
+    round_number = 0
+    while True:
+        for industry in _INDUSTRIES:
+            for head in _NAME_HEADS:
+                for tail in _NAME_TAILS:
+                    if produced >= count:
+                        return
+                    suffix = str(round_number) if round_number else ""
+                    abbr = f"{head}{tail}{industry}{suffix}"
+                    yield abbr, f"{abbr}股份有限公司"
+                    produced += 1
+        round_number += 1
+
+def securities(scale: float) -> List[Tuple]:
+    """(InnerCode, CompanyCode, SecuCode, SecuAbbr, ChiName, SecuMarket)"""
+    count = max(len(KNOWN_SECURITIES), int(round(SECURITIES_PER_SCALE * scale)))
+    rows = list(KNOWN_SECURITIES)
+    for i, (abbr, name) in enumerate(_synthetic_names(count - len(rows))):
+        market = 90 if i % 2 else 83
+        code = f"{(2000 + i) if market == 90 else (601000 + i):06d}"
+        rows.append((10000 + i, 20000 + i, code, abbr, name, market))
+    return rows
+
+def _quotes(rng: random.Random, inner_code: int, days: List[str]) -> Iterator[Tuple]:
+    """几何随机游走的日行情，偶尔涨停"""
+    close = round(rng.uniform(3, 200), 2)
+    for day in days:
+        prev = close
+        if rng.random() < LIMIT_UP_PROBABILITY:
+            change = 0.10
+        else:
+            change = max(-0.1, min(0.099, rng.gauss(0.0003, 0.02)))
+        close = round(max(0.5, prev * (1 + change)), 2)
+        open_price = round(prev * (1 + rng.uniform(-0.01, 0.01)), 2)
+        high = max(open_price, close) * (1 + rng.uniform(0, 0.01))
+        low = min(open_price, close) * (1 - rng.uniform(0, 0.01))
+        volume = float(int(rng.lognormvariate(15, 1)))
+        yield (
+            inner_code, day, prev, open_price, round(high, 2), round(low, 2), close,
+            volume, round(volume * close, 2), round((close / prev - 1) * 100, 4)
+        )
+
+def _balance_sheets(rng: random.Random, company_code: int) -> Iterator[Tuple]:
+    assets = rng.lognormvariate(23, 1.5)
+    ratio = rng.uniform(0.2, 0.9)
+    for year in REPORT_YEARS:
+        for month, day in ((3, 31), (6, 30), (9, 30), (12, 31)):
+            assets *= 1 + rng.gauss(0.02, 0.03)
+            ratio = min(0.98, max(0.05, ratio + rng.gauss(0, 0.02)))
+            end_date = date(year, month, day)
+            liability = assets * ratio
+            yield (
+                company_code, (end_date + timedelta(days=30)).isoformat(), end_date.isoformat(),
+                2, 1, round(assets, 2), round(liability, 2), round(assets - liability, 2)
+            )
+
+def build_fixture(path: str, scale: float = 1, seed: int = 0) -> str:
+    """生成指定规模的SQLite数据库文件，已存在时直接返回"""
+    if os.path.exists(path):
+        return path
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    rng = random.Random(seed)
+    tmp_path = path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    connection = sqlite3.connect(tmp_path)
+    try:
+        connection.executescript(DDL)
+        rows = securities(scale)
+        connection.executemany(
+            "INSERT INTO secumain (InnerCode, CompanyCode, SecuCode, SecuAbbr, ChiName, ChiNameAbbr, "
+            "SecuMarket, SecuCategory, ListedDate, ListedState) VALUES (?, ?, ?, ?, ?, ?, ?, 1, ?, 1)",
+            [
+                (inner, company, code, abbr, name, abbr, market, f"{rng.randint(1991, 2015)}-01-01")
+                for inner, company, code, abbr, name, market in rows
+            ]
+        )
+        connection.executemany(
+            "INSERT INTO lc_namechange (CompanyCode, ChangeDate, ChiName, ChiNameAbbr, SecuAbbr) "
+            "VALUES (?, ?, ?, ?, ?)",
+            KNOWN_NAME_CHANGES
+        )
+        days = trading_days()
+        for inner, *_ in rows:
+            connection.executemany(
+                "INSERT INTO qt_dailyquote (InnerCode, TradingDay, PrevClosePrice, OpenPrice, HighPrice, "
+                "LowPrice, ClosePrice, TurnoverVolume, TurnoverValue, ChangePCT) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                _quotes(rng, inner, days)
+            )
+        for company in sorted({row[1] for row in rows}):
+            connection.executemany(
+                "INSERT INTO lc_balancesheetall (CompanyCode, InfoPublDate, EndDate, IfAdjusted, IfMerged, "
+                "TotalAssets, TotalLiability, TotalShareholderEquity) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                _balance_sheets(rng, company)
+            )
+        connection.commit()
+        connection.execute("ANALYZE")
+    finally:
+        connection.close()
+    os.replace(tmp_path, path)
+    return path
+
+def attach_schemas(connection: sqlite3.Connection, path: str):
+    """把同一个数据库文件按各表所在的库名挂载，使 库名.表名 的写法可以直接执行"""
+    for schema in sorted(set(SCHEMAS.values())):
+        connection.execute(f"ATTACH DATABASE ? AS {schema}", (path,))
+
+def connect(path: str) -> sqlite3.Connection:
+    connection = sqlite3.connect(path, check_same_thread=False)
+    attach_schemas(connection, path)
+    return connection
+
+def create_engine(path: str, pool_size: int = 8):
+    """指向夹具文件的SQLAlchemy连接池，每个新建的连接都挂载库名，与生产环境一样经连接池借出连接"""
+    from sqlalchemy import create_engine as sa_create_engine, event
+    from sqlalchemy.pool import QueuePool
+
+    engine = sa_create_engine(
+        f"sqlite:///{path}",
+        poolclass=QueuePool,
+        pool_size=pool_size,
+        max_overflow=0,
+        connect_args={"check_same_thread": False}
+    )
+
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        attach_schemas(dbapi_connection, path)
+
+    return engine
+
+def table_rows(path: str) -> dict:
+    connection = sqlite3.connect(path)
+    try:
+        return {
+            f"{schema}.{table}": connection.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            for table, schema in SCHEMAS.items()
+        }
+    finally:
+        connection.close()
+
+def main(argv: Optional[list] = None):
+    parser = argparse.ArgumentParser(description="生成压测用的合成金融数据库")
+    parser.add_argument("--scale", type=float, nargs="+", default=[1])
+    parser.add_argument("--output", default=FIXTURE_DIR)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    for scale in args.scale:
+        path = build_fixture(fixture_path(scale, args.output), scale, args.seed)
+        rows = table_rows(path)
+        size = os.path.getsize(path) / 1024 / 1024
+        print(f"sf={scale:g} {path} ({size:.1f} MB): " + ", ".join(f"{t}={n}" for t, n in rows.items()))
+
+if __name__ == "__main__":
+    main()
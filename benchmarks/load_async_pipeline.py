@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# benchmarks/load_async_pipeline.py
+"""异步问题流水线的并发压测
+
+对本地模拟LLM服务并发执行完整的四步流程，输出不同并发度下的吞吐量。
+用法: python benchmarks/load_async_pipeline.py --questions 200 --latency 0.2
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, "app"))
+sys.path.append(os.path.join(ROOT, "app", "frontend"))
+
+from services.question_service import AsyncQuestionService
+from utils.llm_client import close_async_clients
+from mock_llm_server import start_server
+
+async def _run(base_url: str, questions: int, concurrency: int) -> dict:
+    service = AsyncQuestionService("mock", base_url=base_url, model="mock")
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(i: int):
+        async with semaphore:
+            start = time.perf_counter()
+            await service.answer(f"问题{i}: 平安银行的股票代码是什么？")
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(questions)))
+    elapsed = time.perf_counter() - start
+    await close_async_clients()
+    return {
+        "elapsed": elapsed,
+        "throughput": questions / elapsed,
+        "p50": statistics.median(latencies)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--questions", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.2, help="模拟LLM单次调用延迟（秒）")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50, 200])
+    args = parser.parse_args()
+
+    server, base_url = start_server(latency=args.latency)
+    try:
+        for concurrency in args.concurrency:
+            stats = asyncio.run(_run(base_url, args.questions, concurrency))
+            print(f"concurrency={concurrency:<4} elapsed={stats['elapsed']:7.2f}s "
+                  f"throughput={stats['throughput']:7.1f} q/s p50={stats['p50'] * 1000:7.1f}ms")
+    finally:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
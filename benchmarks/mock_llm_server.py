@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+# benchmarks/mock_llm_server.py
+"""本地OpenAI兼容的模拟LLM服务，用于离线压测；请求带 stream=true 时按SSE逐token返回
+
+回复内容可以按规则预置：规则文件是 {"rules": [{"endpoint", "match", "content"}]}，
+endpoint 由系统提示词判断（analyze_tables/generate_sql/repair_sql/qa，省略时匹配所有），
+match 是在最后一条用户消息上搜索的正则，按顺序取第一条命中的规则，都不命中时返回默认内容。
+/fields、/query 等非对话请求交给 backend 回调处理（如在合成数据库上真实执行SQL）。
+设置 max_concurrent 时模拟服务商的并发限额：同时处理的对话请求超过限额时返回429。
+"""
+import argparse
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Tuple
+
+DEFAULT_CONTENT = '["constantdb.secumain", "astockmarketquotesdb.qt_dailyquote"]'
+
+# 系统提示词中的关键词 -> 对话类endpoint，与 utils.api_client 中的消息构建一致
+_SYSTEM_MARKERS = (
+    ("分析SQL查询需要用到的表", "analyze_tables"),
+    ("生成准确的SQL", "generate_sql"),
+    ("修正执行出错", "repair_sql")
+)
+
+def chat_endpoint(messages: List[Dict]) -> str:
+    system = next((m.get("content", "") for m in messages if m.get("role") == "system"), "")
+    return next((endpoint for marker, endpoint in _SYSTEM_MARKERS if marker in system), "qa")
+
+def estimate_tokens(text: str) -> int:
+    """粗略估计token数：中文约每字一个，其他字符约四个一个"""
+    cjk = sum(1 for ch in text if "\u4e00" <= ch <= "\u9fff")
+    return cjk + (len(text) - cjk + 3) // 4
+
+class ResponseRules:
+    """按endpoint和用户消息选择预置回复"""
+
+    def __init__(self, rules: Optional[List[Dict]] = None, default: str = DEFAULT_CONTENT):
+        self.default = default
+        self.rules = [
+            (rule.get("endpoint"), re.compile(rule.get("match", "")), rule["content"])
+            for rule in rules or []
+        ]
+
+    @classmethod
+    def load(cls, path: str, default: str = DEFAULT_CONTENT) -> "ResponseRules":
+        with open(path, "r", encoding="utf-8") as f:
+            config = json.load(f)
+        return cls(config.get("rules", []), config.get("default", default))
+
+    def reply(self, messages: List[Dict]) -> str:
+        endpoint = chat_endpoint(messages)
+        question = next((m.get("content", "") for m in reversed(messages) if m.get("role") == "user"), "")
+        for rule_endpoint, pattern, content in self.rules:
+            if (rule_endpoint is None or rule_endpoint == endpoint) and pattern.search(question):
+                return content
+        return self.default
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    # 启用keep-alive，才能体现连接复用的效果
+    protocol_version = "HTTP/1.1"
+    # 响应头和响应体分两次写出，关闭Nagle避免与延迟ACK叠加出40ms的等待
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+
+        if self.path.endswith("/chat/completions"):
+            if not self.server.admit():
+                self._send_json(429, {"error": {"message": "Too many concurrent requests", "type": "rate_limit_error"}})
+                return
+            try:
+                time.sleep(self.server.latency)
+                self._chat_completion(body)
+            finally:
+                self.server.leave()
+            return
+
+        time.sleep(self.server.latency)
+        if self.server.backend is not None:
+            payload = self.server.backend(self.path.rsplit("/", 1)[-1], body)
+        else:
+            payload = {"status": "success", "data": []}
+        self._send_json(200, payload)
+
+    def _send_json(self, status: int, payload: dict):
+        data = json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _chat_completion(self, body: dict):
+        messages = body.get("messages", [])
+        content = self.server.responses.reply(messages)
+        if body.get("stream"):
+            self._stream_completion(body, content)
+            return
+        prompt_tokens = sum(estimate_tokens(m.get("content", "")) for m in messages)
+        completion_tokens = estimate_tokens(content)
+        self._send_json(200, {
+            "id": "chatcmpl-mock",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "mock"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop"
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens
+            }
+        })
+
+    def _write_chunk(self, data: bytes):
+        """HTTP/1.1 分块传输的一个块，写出后立即刷新，客户端才能逐个收到"""
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _stream_completion(self, body: dict, content: str):
+        """按OpenAI流式格式输出：每个token一个 chat.completion.chunk 事件，最后是 [DONE]"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def event(delta: dict, finish_reason=None) -> bytes:
+            chunk = {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get("model", "mock"),
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+            }
+            return f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8")
+
+        try:
+            self._write_chunk(event({"role": "assistant", "content": ""}))
+            for token in split_tokens(content, self.server.token_size):
+                time.sleep(self.server.token_delay)
+                self._write_chunk(event({"content": token}))
+            self._write_chunk(event({}, "stop"))
+            self._write_chunk(b"data: [DONE]\n\n")
+            self._write_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端提前停止读取
+            self.close_connection = True
+
+def split_tokens(content: str, size: int):
+    """把回复切成固定字符数的片段，模拟逐token生成"""
+    return [content[i:i + size] for i in range(0, len(content), size)]
+
+class MockLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # 压测时会有大量并发连接
+    request_queue_size = 512
+
+    def __init__(self, *args, max_concurrent: int = 0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_concurrent = max_concurrent
+        self.in_flight = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def admit(self) -> bool:
+        """占用一个对话请求名额，超过并发限额时记一次拒绝"""
+        with self._lock:
+            if self.max_concurrent and self.in_flight >= self.max_concurrent:
+                self.rejected += 1
+                return False
+            self.in_flight += 1
+            return True
+
+    def leave(self):
+        with self._lock:
+            self.in_flight -= 1
+
+def start_server(
+    port: int = 0,
+    latency: float = 0.0,
+    content: str = DEFAULT_CONTENT,
+    token_delay: float = 0.0,
+    token_size: int = 2,
+    responses: Optional[ResponseRules] = None,
+    backend: Optional[Callable[[str, Dict], Dict]] = None,
+    max_concurrent: int = 0
+) -> Tuple[MockLLMServer, str]:
+    """在后台线程启动模拟服务，返回 (server, base_url)
+    Args:
+        latency: 首个token之前的延迟（秒）
+        token_delay: 流式输出时相邻token之间的延迟（秒）
+        token_size: 流式输出时每个token的字符数
+        responses: 预置回复规则，不指定时总是回复 content
+        backend: 处理非对话请求的回调 (路径最后一段如 "query", 请求体) -> 响应
+        max_concurrent: 同时处理的对话请求上限，超过时返回429，0表示不限制
+    """
+    server = MockLLMServer(("127.0.0.1", port), MockLLMHandler, max_concurrent=max_concurrent)
+    server.latency = latency
+    server.content = content
+    server.responses = responses or ResponseRules(default=content)
+    server.backend = backend
+    server.token_delay = token_delay
+    server.token_size = token_size
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1/"
+
+def main(argv: Optional[list] = None):
+    parser = argparse.ArgumentParser(description="模拟LLM服务")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", type=float, default=0.0, help="每个请求的模拟延迟（秒）")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="流式输出相邻token的延迟（秒）")
+    parser.add_argument("--content", default=DEFAULT_CONTENT, help="模型回复内容")
+    parser.add_argument("--responses", help="预置回复规则文件（JSON）")
+    parser.add_argument("--max-concurrent", type=int, default=0, help="对话请求的并发限额，超过时返回429")
+    args = parser.parse_args(argv)
+
+    responses = ResponseRules.load(args.responses, args.content) if args.responses else None
+    server, base_url = start_server(
+        args.port,
+        args.latency,
+        args.content,
+        args.token_delay,
+        responses=responses,
+        max_concurrent=args.max_concurrent
+    )
+    print(f"Mock LLM server listening on {base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
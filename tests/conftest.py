@@ -0,0 +1,15 @@
+import os
+import sys
+import tempfile
+
+# 后端以 app.* 导入服务模块，共用的 utils.* 在 app/frontend 下（与 app/main.py 的路径设置一致）
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "app", "frontend")]
+
+# 磁盘缓存、运行记录等写到临时目录，不碰仓库下的 .cache
+_CACHE_DIR = tempfile.mkdtemp(prefix="finance-qa-tests-")
+os.environ.setdefault("QUESTION_CACHE_URL", "sqlite:///" + os.path.join(_CACHE_DIR, "question_cache.sqlite3"))
+os.environ.setdefault("RUN_STORE_DIR", os.path.join(_CACHE_DIR, "runs"))
+os.environ.setdefault("LOCAL_ENGINE_DIR", os.path.join(_CACHE_DIR, "parquet"))
+os.environ.setdefault("ENTITY_INDEX_SNAPSHOT", os.path.join(_CACHE_DIR, "entities.json"))
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(_CACHE_DIR, "finance.sqlite3"))
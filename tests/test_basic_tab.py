@@ -0,0 +1,48 @@
+import pytest
+
+bt = pytest.importorskip("tabs.basic_tab")
+
+class FakeService:
+    """四步流程的替身：执行和修复的结果由测试指定"""
+
+    remembered = []
+
+    def __init__(self, api_key, base_url=None, model=None):
+        self.token_ledger = type("Ledger", (), {"question_summary": staticmethod(lambda question: {})})()
+
+    def answer_from_template(self, question):
+        return None
+
+    def analyze_tables(self, question):
+        return ["constantdb.secumain"]
+
+    def get_fields(self, tables):
+        return {}
+
+    def generate_sql(self, question, tables, fields, on_delta=None):
+        return "SELECT 1"
+
+    def execute_sql(self, sql):
+        return {"status": "error", "error": "Unknown column 'x'"}
+
+    def repair_and_execute(self, question, sql, result, fields):
+        return {"sql": "SELECT 2", "result": self.repaired, "attempts": [{"attempt": 1}]}
+
+    def remember_sql(self, question, tables, fields, sql):
+        self.remembered.append(sql)
+
+@pytest.mark.parametrize("repaired, status", [
+    ({"status": "error", "error": "still broken"}, "error"),
+    ({"status": "success", "data": [[1]]}, "completed"),
+])
+def test_final_status_follows_the_answer(monkeypatch, repaired, status):
+    FakeService.repaired = repaired
+    FakeService.remembered = []
+    monkeypatch.setattr(bt, "QuestionService", FakeService)
+    result = bt._execute_question("问题", "key", None, "http://localhost:1", "test")
+    assert result["status"] == status
+    assert result["answer"] == repaired
+    assert FakeService.remembered == ([] if status == "error" else ["SELECT 2"])
+    question = {"question": "问题"}
+    bt.write_back(question, result)
+    assert question["status"] == status
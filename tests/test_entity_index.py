@@ -0,0 +1,35 @@
+import os
+import time
+
+from app.services import entity_index
+from app.services.entity_index import EntityIndex
+
+def test_missing_entity_snapshot_falls_back_to_empty_index(tmp_path, caplog):
+    index = EntityIndex(snapshot_path=str(tmp_path / "missing.json"))
+    assert index.resolve("平安银行的股票代码") == []
+    assert index.loaded and len(index) == 0
+    assert "Failed to load entity snapshot" in caplog.text
+
+RECORDS = [{"InnerCode": 3, "CompanyCode": 3, "SecuCode": "000001", "SecuAbbr": "平安银行", "SecuCategory": 1}]
+
+def test_exported_snapshot_is_loaded_and_reloaded_after_change(tmp_path, monkeypatch):
+    path = str(tmp_path / "entities.json")
+    backend = EntityIndex(snapshot_path=path)
+    backend.load_records([])
+    backend.export()
+
+    frontend = EntityIndex(snapshot_path=path)
+    frontend.refresh()
+    assert frontend.resolve("平安银行的股票代码") == []
+
+    backend.load_records(RECORDS)
+    backend.export()
+    os.utime(path, (time.time() + 10, time.time() + 10))
+    monkeypatch.setattr(entity_index, "ENTITY_INDEX_CHECK_INTERVAL", 0)
+    assert [m["InnerCode"] for m in frontend.resolve("平安银行的股票代码")] == [3]
+
+def test_empty_snapshot_logs_warning(tmp_path, caplog):
+    path = tmp_path / "entities.json"
+    path.write_text("[]", encoding="utf-8")
+    EntityIndex(snapshot_path=str(path)).refresh()
+    assert "is empty" in caplog.text
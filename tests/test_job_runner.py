@@ -0,0 +1,28 @@
+import time
+
+from app.services import job_runner
+from app.services.job_runner import COMPLETED, FAILED, RUNNING, JobRunner, MemoryJobStore
+
+def _snapshot(job_id, status, updated):
+    return {
+        "job_id": job_id, "run_id": "run1", "status": status, "total": 2, "finished": 0,
+        "processed": 0, "errors": 0, "current_group": "", "current_question": "",
+        "created": updated, "updated": updated, "error": None
+    }
+
+def test_stale_job_is_reported_failed():
+    store = MemoryJobStore()
+    runner = JobRunner(store)
+    store.save(_snapshot("crashed", RUNNING, time.time() - job_runner.JOB_STALE_SECONDS - 1))
+    assert runner.find_active("run1") is None
+    status = runner.status("crashed")
+    assert status["status"] == FAILED and "心跳" in status["error"]
+    assert runner.stats()["active"] == 0
+
+def test_live_and_finished_jobs_unchanged():
+    store = MemoryJobStore()
+    runner = JobRunner(store)
+    store.save(_snapshot("live", RUNNING, time.time()))
+    store.save(_snapshot("done", COMPLETED, 0))
+    assert runner.find_active("run1") == "live"
+    assert runner.status("done")["status"] == COMPLETED
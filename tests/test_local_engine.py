@@ -0,0 +1,54 @@
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("duckdb")
+pytest.importorskip("pyarrow")
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+from app.services.local_engine import LocalEngine, load_table
+
+QUOTE = "astockmarketquotesdb.qt_dailyquote"
+
+@pytest.fixture(scope="module")
+def engines(tmp_path_factory):
+    from fixture import SCHEMAS, build_fixture, connect
+
+    directory = tmp_path_factory.mktemp("local_engine")
+    path = build_fixture(str(directory / "fixture.db"), scale=0.05)
+    connection = connect(path)
+    for table, schema in SCHEMAS.items():
+        load_table(connection, f"{schema}.{table}", str(directory / "parquet"))
+    yield connection, LocalEngine(str(directory / "parquet"))
+    connection.close()
+
+QUERIES = [
+    f"SELECT COUNT(*) FROM {QUOTE} WHERE TradingDay >= '2021-01-01'",
+    f"SELECT COUNT(*) FROM {QUOTE} qt WHERE qt.TradingDay BETWEEN '2020-03-01' AND '2020-03-31'",
+    f"SELECT COUNT(*) FROM {QUOTE} WHERE InnerCode IN "
+    f"(SELECT InnerCode FROM {QUOTE} WHERE TradingDay = '2021-06-01')",
+    f"SELECT COUNT(*) FROM {QUOTE} WHERE NOT (TradingDay >= '2021-01-01')",
+    f"SELECT SUM(CASE WHEN TradingDay >= '2021-01-01' THEN 1 ELSE 0 END), COUNT(*) FROM {QUOTE}",
+    f"SELECT COUNT(*) FROM {QUOTE} WHERE TradingDay >= '2021-01-01' OR TradingDay < '2020-02-01'",
+    f"SELECT COUNT(*) FROM {QUOTE} a JOIN {QUOTE} b ON a.InnerCode = b.InnerCode AND a.TradingDay = b.TradingDay "
+    f"WHERE a.TradingDay = '2021-06-01'",
+    f"SELECT COUNT(*) FROM {QUOTE} WHERE '2021-12-01' <= TradingDay",
+]
+
+@pytest.mark.parametrize("sql", QUERIES)
+def test_pruned_results_match_sqlite(engines, sql):
+    connection, local = engines
+    assert local.execute(sql) == connection.execute(sql).fetchall()
+
+def test_prune_reads_only_matching_partitions(engines):
+    _, local = engines
+    pruned = local.prune(f"SELECT COUNT(*) FROM {QUOTE} qt WHERE qt.TradingDay >= :p1", {"p1": "2021-01-01"})
+    assert "part_year=2021" in pruned and "part_year=2020" not in pruned
+    assert pruned.endswith("AS qt WHERE qt.TradingDay >= :p1")
+
+def test_prune_ignores_predicates_outside_top_level_and(engines):
+    _, local = engines
+    for sql in QUERIES[3:6]:
+        assert "part_year=" not in local.prune(sql)
@@ -0,0 +1,39 @@
+import pytest
+
+from app.services.entity_index import EntityIndex
+from app.services.question_cache import QuestionCache, SQLiteCacheBackend
+
+@pytest.fixture
+def entity_index():
+    index = EntityIndex(snapshot_path=None)
+    index.load_records([
+        {"InnerCode": 3, "CompanyCode": 3, "SecuCode": "000001", "SecuAbbr": "平安银行", "SecuCategory": 1},
+        {"InnerCode": 1133, "CompanyCode": 1055, "SecuCode": "600036", "SecuAbbr": "招商银行", "SecuCategory": 1},
+    ])
+    return index
+
+@pytest.fixture
+def cache(tmp_path, entity_index):
+    return QuestionCache(
+        SQLiteCacheBackend(str(tmp_path / "cache.sqlite3")), similarity=0.5, entity_index=entity_index
+    )
+
+def test_near_duplicate_requires_same_entities(cache):
+    cache.put("analyze_tables", "平安银行的股票代码是什么", ["constantdb.secumain"], 1.0)
+    assert cache.get("analyze_tables", "招商银行的股票代码是什么") is None
+    assert cache.get("analyze_tables", "平安银行的股票代码是多少") == ["constantdb.secumain"]
+    assert cache.stats()["near_hits"] == 1
+
+def test_variant_separates_entries_and_near_matches(cache):
+    cache.put("generate_sql", "平安银行的股票代码是什么", "SELECT 1", 1.0, "v1")
+    assert cache.get("generate_sql", "平安银行的股票代码是什么", "v1") == "SELECT 1"
+    assert cache.get("generate_sql", "平安银行的股票代码是什么", "v2") is None
+    assert cache.get("generate_sql", "平安银行的股票代码是多少", "v2") is None
+    assert cache.get("generate_sql", "平安银行的股票代码是多少", "v1") == "SELECT 1"
+
+def test_questions_differing_in_decimal_or_sign_do_not_share_a_key(cache):
+    cache.put("analyze_tables", "市盈率大于1.5的公司有哪些？", ["a"], 1.0)
+    assert cache.get("analyze_tables", "市盈率大于15的公司有哪些？") is None
+    assert cache.get("analyze_tables", "市盈率大于 1.5 的公司有哪些") == ["a"]
+    cache.put("analyze_tables", "涨幅低于-5%的股票有哪些", ["b"], 1.0)
+    assert cache.get("analyze_tables", "涨幅低于5%的股票有哪些") is None
@@ -0,0 +1,42 @@
+import pytest
+
+from app.services.question_cache import QuestionCache, SQLiteCacheBackend
+from app.services.question_service import QuestionService
+
+TABLES = ["constantdb.secumain"]
+FIELDS = {"constantdb.secumain": [{"name": "SecuCode", "type": "varchar", "description": "证券代码"}]}
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    service = QuestionService("test-key", base_url="http://localhost:1", model="test")
+    service.cache = QuestionCache(SQLiteCacheBackend(str(tmp_path / "cache.sqlite3")))
+    responses = {"generate_sql": "SELECT SecuCode FROM constantdb.secumain LIMIT 1"}
+    monkeypatch.setattr(service, "_call_api", lambda endpoint, params: responses[endpoint])
+    service.responses = responses
+    return service
+
+def test_generated_sql_is_cached_only_after_success(service):
+    question = "平安银行的股票代码"
+    sql = service.generate_sql(question, TABLES, FIELDS)
+    # 执行失败：不写入缓存
+    assert service.cache.get("generate_sql", question, service._sql_variant(TABLES, FIELDS)) is None
+
+    service.generate_sql(question, TABLES, FIELDS)
+    service.remember_sql(question, TABLES, FIELDS, sql)
+    assert service.cache.get("generate_sql", question, service._sql_variant(TABLES, FIELDS)) == sql
+
+def test_cached_sql_is_keyed_on_tables_and_fields(service):
+    question = "平安银行的股票代码"
+    sql = service.generate_sql(question, TABLES, FIELDS)
+    service.remember_sql(question, TABLES, FIELDS, sql)
+    service.responses["generate_sql"] = "SELECT SecuCode, ChiName FROM constantdb.secumain LIMIT 1"
+    changed = {"constantdb.secumain": FIELDS["constantdb.secumain"] + [{"name": "ChiName"}]}
+    assert service.generate_sql(question, TABLES, changed) != sql
+    assert service.generate_sql(question, TABLES, FIELDS) == sql
+
+def test_repaired_sql_replaces_cached_sql(service):
+    question = "平安银行的股票代码"
+    service.generate_sql(question, TABLES, FIELDS)
+    repaired = "SELECT SecuCode FROM constantdb.secumain WHERE SecuAbbr = '平安银行'"
+    service.remember_sql(question, TABLES, FIELDS, repaired)
+    assert service.generate_sql(question, TABLES, FIELDS) == repaired
@@ -0,0 +1,60 @@
+import os
+import sqlite3
+from decimal import Decimal
+
+from app.services.entity_index import EntityIndex
+from app.services.question_templates import TemplateRegistry
+
+TEMPLATES = os.path.join(os.path.dirname(os.path.dirname(__file__)), "app", "config", "question_templates.json")
+
+def test_limit_up_count_uses_board_thresholds():
+    registry = TemplateRegistry([TEMPLATES], entity_index=EntityIndex(snapshot_path=None))
+    match = registry.match("2021年6月1日涨停股票数量是多少")
+    assert match["template"] == "limit_up_count"
+
+    connection = sqlite3.connect(":memory:")
+    connection.execute("ATTACH DATABASE ':memory:' AS constantdb")
+    connection.execute("ATTACH DATABASE ':memory:' AS astockmarketquotesdb")
+    connection.execute("CREATE TABLE constantdb.secumain (InnerCode, SecuCode, SecuAbbr, SecuMarket)")
+    connection.execute("CREATE TABLE astockmarketquotesdb.qt_dailyquote (InnerCode, TradingDay, ChangePCT)")
+    securities = [
+        (1, "600001", "主板甲", 83, 10.0),   # 主板涨停
+        (2, "600003", "主板乙", 83, 9.5),    # 未涨停
+        (3, "300001", "创业板甲", 90, 10.0),  # 创业板20%限制，未涨停
+        (4, "688001", "科创板甲", 83, 20.0),  # 科创板涨停
+        (5, "600002", "*ST某某", 83, 5.0),   # ST股5%涨停
+        (6, "830001", "北交所甲", 18, 15.0),  # 北交所30%限制，未涨停
+    ]
+    for inner, code, abbr, market, change in securities:
+        connection.execute("INSERT INTO constantdb.secumain VALUES (?, ?, ?, ?)", (inner, code, abbr, market))
+        connection.execute(
+            "INSERT INTO astockmarketquotesdb.qt_dailyquote VALUES (?, ?, ?)", (inner, match["params"]["day"], change)
+        )
+    assert connection.execute(match["sql"], match["params"]).fetchone()[0] == 3
+
+def _registry():
+    index = EntityIndex(snapshot_path=None)
+    index.load_records([
+        {"InnerCode": 3, "CompanyCode": 3, "SecuCode": "000001", "SecuAbbr": "平安银行", "ChiName": "平安银行股份有限公司", "SecuCategory": 1},
+        {"InnerCode": 9, "CompanyCode": 9, "SecuCode": "600518", "SecuAbbr": "*ST康美", "ChiName": "康美药业股份有限公司", "SecuCategory": 1},
+    ])
+    return TemplateRegistry([TEMPLATES], entity_index=index)
+
+def test_company_templates_match_raw_question_text():
+    registry = _registry()
+    match = registry.match("平安银行的股票代码是什么？")
+    assert match["template"] == "stock_code" and match["params"]["company_inner_code"] == 3
+    assert registry.match("*ST康美 的股票代码是什么")["params"]["company_inner_code"] == 9
+    match = registry.match("平安银行在2021-06-01的收盘价是多少?")
+    assert match["template"] == "close_price" and match["params"]["day"] == "2021-06-01"
+
+def test_number_slot_captures_decimals():
+    registry = _registry()
+    registry.add({
+        "name": "pe_above",
+        "pattern": "市盈率大于(?P<pe>-?\\d+(?:\\.\\d+)?)的公司有哪些",
+        "slots": {"pe": "number"},
+        "sql": "SELECT SecuCode FROM t WHERE pe > :pe"
+    })
+    assert registry.match("市盈率大于1.5的公司有哪些？")["params"]["pe"] == Decimal("1.5")
+    assert registry.match("市盈率大于15的公司有哪些")["params"]["pe"] == 15
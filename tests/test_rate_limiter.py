@@ -0,0 +1,14 @@
+from utils.rate_limiter import RateLimiter, TokenBucket, create_bucket
+
+def test_create_bucket_in_process_by_default():
+    assert create_bucket("requests", 0, "memory") is None
+    assert type(create_bucket("requests", 60, "memory")) is TokenBucket
+    limiter = RateLimiter(requests_per_minute=60, tokens_per_minute=0, url="memory")
+    assert isinstance(limiter.requests, TokenBucket) and limiter.tokens is None
+
+def test_token_bucket_waits_after_burst_and_refunds():
+    bucket = TokenBucket(60, burst_seconds=3)
+    assert bucket.reserve(bucket.capacity) == 0.0
+    assert bucket.reserve(1) > 0
+    bucket.refund(1)
+    assert abs(bucket.tokens) < 0.1
@@ -0,0 +1,58 @@
+import sqlite3
+
+import pytest
+
+from app.services.result_cache import ResultCache, get_result_cache
+from app.services.sql_service import SQLService
+
+@pytest.fixture
+def cache():
+    return ResultCache(max_bytes=1 << 20)
+
+def test_formatting_variants_share_an_entry(cache):
+    cache.put("SELECT a FROM t WHERE b = 1.50", {"data": [1]})
+    assert cache.get("select  a\nfrom T where b=1.5;") == {"data": [1]}
+    assert cache.get("SELECT a FROM t WHERE b = 2") is None
+    assert cache.get("SELECT a FROM t WHERE b = 1.5", "#columnar") is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 2)
+
+def test_invalidate_table_drops_only_its_entries(cache):
+    cache.put("SELECT a FROM db.t", {"data": [1]})
+    cache.put("SELECT a FROM u", {"data": [2]})
+    cache.invalidate_table("t")
+    assert cache.get("SELECT a FROM db.t") is None
+    assert cache.get("SELECT a FROM u") == {"data": [2]}
+    assert cache.stats()["invalidations"] == 1
+
+def test_write_statement_invalidates_table(cache):
+    cache.put("SELECT a FROM t", {"data": [1]})
+    cache.put("DELETE FROM t WHERE a = 1", {"status": "success"})
+    assert cache.get("SELECT a FROM t") is None
+    assert cache.stats()["entries"] == 0
+
+def test_byte_budget_evicts_least_recently_used():
+    row = {"data": ["x" * 400]}
+    cache = ResultCache(max_bytes=1000)
+    cache.put("SELECT 1 FROM t", row)
+    cache.put("SELECT 2 FROM t", row)
+    cache.get("SELECT 1 FROM t")
+    cache.put("SELECT 3 FROM t", row)
+    assert cache.get("SELECT 2 FROM t") is None
+    assert cache.get("SELECT 1 FROM t") == row
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["bytes"] <= 1000
+
+def test_sql_service_hits_cache_for_repeated_literal_query():
+    connection = sqlite3.connect(":memory:")
+    connection.execute("CREATE TABLE quote (code TEXT, price REAL)")
+    connection.executemany("INSERT INTO quote VALUES (?, ?)", [("000001", 10.5), ("600036", 35.2)])
+    cache = get_result_cache()
+    cache.clear()
+    before = cache.stats()
+    service = SQLService(connection)
+    first = service.execute_sql("SELECT code FROM quote WHERE price > 20")
+    second = service.execute_sql("SELECT code FROM quote WHERE price > 20")
+    assert first == second == {"status": "success", "data": [("600036",)]}
+    assert cache.stats()["hits"] - before["hits"] == 1
+    assert service.execute_sql("SELECT code FROM quote WHERE price > 5")["data"] == [("000001",), ("600036",)]
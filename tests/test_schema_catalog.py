@@ -0,0 +1,12 @@
+from app.services.schema_catalog import SchemaCatalog
+
+FIELDS = {"constantdb.secumain": [{"name": "SecuCode", "type": "varchar", "description": "证券代码"}]}
+
+def test_merge_bumps_revision_only_on_change():
+    catalog = SchemaCatalog(snapshot_path=None)
+    catalog.merge(FIELDS)
+    revision = catalog.version
+    catalog.merge({table: [dict(c) for c in columns] for table, columns in FIELDS.items()})
+    assert catalog.version == revision
+    catalog.merge({"constantdb.secumain": FIELDS["constantdb.secumain"] + [{"name": "ChiName"}]})
+    assert catalog.version == revision + 1
@@ -0,0 +1,65 @@
+import pytest
+
+from app.services.schema_catalog import SchemaCatalog
+from app.services.sql_optimizer import SQLOptimizer
+
+QUOTE = "astockmarketquotesdb.qt_dailyquote"
+SECUMAIN = "constantdb.secumain"
+
+@pytest.fixture
+def optimizer():
+    catalog = SchemaCatalog(snapshot_path=None)
+    catalog.merge({
+        QUOTE: [
+            {"name": "InnerCode", "description": "证券内部编码"},
+            {"name": "TradingDay", "description": "交易日"},
+            {"name": "ClosePrice", "description": "收盘价(元)"},
+            {"name": "TurnoverVolume", "description": "成交量(股)"},
+            {"name": "ChangePCT", "description": "涨跌幅(%)"},
+        ],
+        SECUMAIN: [
+            {"name": "InnerCode", "description": "证券内部编码"},
+            {"name": "SecuCode", "description": "证券代码"},
+            {"name": "ChiName", "description": "中文名称"},
+            {"name": "ListedDate", "description": "上市日期"},
+        ],
+    })
+    return SQLOptimizer(catalog=catalog, max_rows=100, dialect="mysql")
+
+def test_narrow_keeps_answer_column_matched_by_description(optimizer):
+    result = optimizer.optimize(f"SELECT * FROM {QUOTE} WHERE TradingDay = '2021-06-01' LIMIT 5", "这天的收盘价是多少")
+    assert result["sql"] == f"SELECT InnerCode, TradingDay, ClosePrice FROM {QUOTE} WHERE TradingDay = '2021-06-01' LIMIT 5"
+
+def test_narrow_keeps_order_by_column(optimizer):
+    result = optimizer.optimize(f"SELECT * FROM {QUOTE} ORDER BY ChangePCT DESC LIMIT 5", "哪天收盘价最高")
+    assert "ChangePCT" in result["sql"] and "ClosePrice" in result["sql"]
+    assert "TurnoverVolume" not in result["sql"]
+
+def test_no_narrowing_when_question_names_no_column(optimizer):
+    sql = f"SELECT * FROM {QUOTE} WHERE TradingDay = '2021-06-01' LIMIT 5"
+    assert optimizer.optimize(sql, "平安银行那天怎么样")["sql"] == sql
+
+def test_narrow_ignores_tables_inside_subqueries(optimizer):
+    subquery = (
+        f"SELECT * FROM {QUOTE} mx WHERE mx.InnerCode IN "
+        f"(SELECT InnerCode FROM {SECUMAIN} WHERE ChiName = '平安银行') LIMIT 5"
+    )
+    assert optimizer.optimize(subquery, "收盘价")["sql"] == (
+        f"SELECT InnerCode, TradingDay, ClosePrice FROM {QUOTE} AS mx WHERE mx.InnerCode IN "
+        f"(SELECT InnerCode FROM {SECUMAIN} WHERE ChiName = '平安银行') LIMIT 5"
+    )
+
+def test_no_narrowing_with_derived_tables_or_joins(optimizer):
+    derived = f"SELECT * FROM (SELECT InnerCode, ClosePrice FROM {QUOTE}) AS t LIMIT 5"
+    assert optimizer.optimize(derived, "收盘价")["sql"] == derived
+    join = f"SELECT * FROM {QUOTE} qt JOIN {SECUMAIN} s ON qt.InnerCode = s.InnerCode LIMIT 5"
+    assert "*" in optimizer.optimize(join, "收盘价")["sql"]
+
+def test_injected_limit_marks_truncated_results(optimizer):
+    sql = optimizer.optimize(f"SELECT InnerCode FROM {QUOTE}")["sql"]
+    assert sql.endswith("LIMIT 101")
+    result = optimizer.mark_truncated(sql, {"status": "success", "data": [[i] for i in range(101)]})
+    assert result["truncated"] and len(result["data"]) == 100
+    complete = {"status": "success", "data": [[i] for i in range(100)]}
+    assert optimizer.mark_truncated(sql, complete) is complete
+    assert optimizer.stats()["truncated"] == 1
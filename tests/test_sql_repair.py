@@ -0,0 +1,42 @@
+import pytest
+
+from app.services.question_cache import QuestionCache, SQLiteCacheBackend
+from app.services.schema_catalog import SchemaCatalog
+from app.services.sql_repair import REPAIR_STAGE, SQLRepairer, error_signature
+
+QUOTE = "astockmarketquotesdb.qt_dailyquote"
+
+@pytest.fixture
+def repairer(tmp_path):
+    catalog = SchemaCatalog(snapshot_path=None)
+    catalog.merge({QUOTE: [{"name": "InnerCode"}, {"name": "TradingDay"}, {"name": "ClosePrice"}]})
+    cache = QuestionCache(SQLiteCacheBackend(str(tmp_path / "cache.sqlite3")))
+    return SQLRepairer(cache=cache, catalog=catalog)
+
+def test_closest_column_renames_columns_but_not_literals(repairer):
+    sql = f"SELECT ClosePric FROM {QUOTE} WHERE TradingDay = '2021-06-01' AND 'ClosePric' <> ''"
+    fixed, source = repairer.local_fix(sql, "Unknown column 'ClosePric' in 'field list'")
+    assert source == "schema"
+    assert fixed == f"SELECT ClosePrice FROM {QUOTE} WHERE TradingDay = '2021-06-01' AND 'ClosePric' <> ''"
+
+def test_learns_only_from_schema_errors(repairer):
+    failed = f"SELECT ClosingPrice FROM {QUOTE}"
+    fixed = f"SELECT ClosePrice FROM {QUOTE}"
+    transient = "Lost connection to MySQL server during query"
+    repairer.learn(transient, failed, fixed, 1.0)
+    assert repairer.cache.backend.get(REPAIR_STAGE, error_signature(transient), 60) is None
+
+    schema = "Unknown column 'ClosingPrice' in 'field list'"
+    repairer.learn(schema, failed, fixed, 1.0)
+    assert repairer.local_fix(failed, schema) == (fixed, "pattern")
+    assert repairer.local_fix(failed, transient) == (None, None)
+
+def test_repair_loop_uses_llm_then_local_pattern(repairer):
+    failed = f"SELECT ClosingPrice FROM {QUOTE}"
+    fixed = f"SELECT ClosePrice FROM {QUOTE}"
+    error = {"status": "error", "error": "Unknown column 'ClosingPrice' in 'field list'"}
+    execute = lambda sql: {"status": "success", "data": []} if sql == fixed else error
+    first = repairer.repair("q", failed, error, lambda q, s, e: fixed, execute)
+    assert first["sql"] == fixed and first["attempts"][0]["source"] in ("schema", "llm")
+    second = repairer.repair("q", failed, error, lambda q, s, e: pytest.fail("LLM called"), execute)
+    assert second["sql"] == fixed
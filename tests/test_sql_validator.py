@@ -0,0 +1,33 @@
+from decimal import Decimal
+
+from app.services.sql_validator import extract_sql, inline_params, parameterize
+
+def test_extract_sql_keeps_where_clause_with_chinese_literal():
+    sql = 'SELECT SecuCode FROM constantdb.secumain\nWHERE ChiName LIKE "%平安银行%"'
+    assert extract_sql(sql) == sql
+
+def test_extract_sql_keeps_order_by_chinese_column():
+    sql = "SELECT 收盘价 FROM t\nORDER BY 收盘价 DESC"
+    assert extract_sql(sql) == sql
+
+def test_extract_sql_drops_trailing_prose():
+    text = "```sql\nSELECT a FROM t\nWHERE b = 1\n```"
+    assert extract_sql(text) == "SELECT a FROM t\nWHERE b = 1"
+    assert extract_sql("SELECT a FROM t\nWHERE b = 1\n以上SQL查询了平安银行。") == "SELECT a FROM t\nWHERE b = 1"
+    assert extract_sql("SELECT a FROM t\n注意：这里使用了 LIKE 模糊匹配") == "SELECT a FROM t"
+
+def test_extract_sql_drops_leading_prose_and_trailing_statements():
+    assert extract_sql("查询如下：\nSELECT a FROM t; SELECT b FROM u") == "SELECT a FROM t"
+
+def test_validate_turns_pipe_concat_into_concat_for_mysql():
+    from app.services.schema_catalog import SchemaCatalog
+    from app.services.sql_validator import SQLValidator
+    validator = SQLValidator(catalog=SchemaCatalog(snapshot_path=None), dialect="mysql")
+    result = validator.validate("SELECT a || '-' || b FROM t WHERE c LIKE '%' || d")
+    assert result["status"] == "success"
+    assert result["sql"] == "SELECT CONCAT(a, '-', b) FROM t WHERE c LIKE CONCAT('%', d)"
+
+def test_parameterize_binds_decimals_exactly():
+    sql, params = parameterize("SELECT a FROM t WHERE ratio > 0.1 AND n = 3 AND v < 1e3", "mysql")
+    assert params == {"p1": Decimal("0.1"), "p2": 3, "p3": Decimal("1e3")}
+    assert inline_params(sql, params) == "SELECT a FROM t WHERE ratio > 0.1 AND n = 3 AND v < 1E+3"
@@ -0,0 +1,51 @@
+import sqlite3
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api import endpoints
+from app.services.sql_service import SQLService
+
+@pytest.fixture
+def client(monkeypatch):
+    connection = sqlite3.connect(":memory:", check_same_thread=False)
+    connection.execute("CREATE TABLE quote (code TEXT, price REAL)")
+    connection.executemany("INSERT INTO quote VALUES (?, ?)", [("000001", 10.5), ("600036", 35.2)])
+
+    def pooled_stream(sql, columnar=False):
+        yield from SQLService(connection).execute_sql_stream(sql, columnar=columnar)
+
+    monkeypatch.setattr(endpoints, "_pooled_stream", pooled_stream)
+    app = FastAPI()
+    app.include_router(endpoints.router)
+    yield TestClient(app)
+    connection.close()
+
+@pytest.mark.parametrize("format", ["ndjson", "arrow"])
+def test_stream_query_error_returns_400(client, format):
+    response = client.post("/execute_sql/stream", params={"sql": "SELECT missing FROM quote", "format": format})
+    assert response.status_code == 400
+    assert response.json()["status"] == "error"
+    assert "missing" in response.json()["error"]
+
+def test_arrow_stream_returns_batches(client):
+    pa = pytest.importorskip("pyarrow")
+    response = client.post("/execute_sql/stream", params={"sql": "SELECT code, price FROM quote", "format": "arrow"})
+    assert response.status_code == 200
+    table = pa.ipc.open_stream(response.content).read_all()
+    assert table.column("code").to_pylist() == ["000001", "600036"]
+
+def test_ndjson_stream_ends_with_status(client):
+    response = client.post("/execute_sql/stream", params={"sql": "SELECT code FROM quote"})
+    lines = response.text.strip().splitlines()
+    assert response.status_code == 200
+    assert lines[0] == '{"columns": ["code"]}'
+    assert '"status": "success"' in lines[-1]
+
+def test_arrow_batches_abort_on_mid_stream_error():
+    items = iter([{"columns": ["a"]}, {"batch": {"a": [1]}}, {"status": "error", "error": "连接中断"}])
+    batches = endpoints._arrow_batches(items)
+    assert next(batches) == {"a": [1]}
+    with pytest.raises(RuntimeError, match="连接中断"):
+        next(batches)
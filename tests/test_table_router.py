@@ -0,0 +1,17 @@
+import json
+
+from app.services.table_router import CONFIG_DIR, KEYWORD_HINTS, get_table_router
+
+def _labels():
+    with open(CONFIG_DIR / "table_routing_labels.json", "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def test_held_out_questions_avoid_keyword_hints():
+    held_out = [item["question"] for item in _labels() if item.get("held_out")]
+    assert held_out
+    assert not [(q, k) for q in held_out for k in KEYWORD_HINTS if k in q]
+
+def test_evaluate_reports_held_out_separately():
+    report = get_table_router().evaluate(_labels())
+    assert report["held_out"]["questions"] < report["questions"]
+    assert 0.0 <= report["held_out"]["recall"] <= 1.0
@@ -0,0 +1,22 @@
+import urllib.error
+import urllib.request
+
+import pytest
+
+from app.services.tracing import Tracer, start_metrics_server
+
+def test_metrics_server_serves_prometheus_text():
+    tracer = Tracer()
+    with tracer.span("generate_sql"):
+        pass
+    server = start_metrics_server(0, tracer.render_prometheus)
+    try:
+        base = f"http://127.0.0.1:{server.server_address[1]}"
+        with urllib.request.urlopen(f"{base}/metrics") as response:
+            body = response.read().decode("utf-8")
+        assert 'stage="generate_sql"' in body
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(f"{base}/other")
+    finally:
+        server.shutdown()
+        server.server_close()